@@ -1,5 +1,7 @@
 from .iv import IV
 from .grid import Grid
 from .experiment import MODE, bell_kaiser_v, r_squared, residu_bell_kaiser_v, use_pure_c, BEEM_MODEL
+from .experiment import bell_kaiser_v_batch, residu_bell_kaiser_v_batch, jacobian_bell_kaiser_v
 from .bees_data import BEESData
 from .bees_fit import BEESFit
+from .cache import use_cache
@@ -6,7 +6,7 @@ for higher speed.)
 import numpy as np
 
 def bell_kaiser_v(bias,n,params):
-    '''Function that return the BEEM current for given bias according to the
+    r'''Function that return the BEEM current for given bias according to the
     Bell Kaiser V model with multiple barrier heights
 
     ..math:: I_{BEEM}=offset+\frac{a_1}{V}(V-\Phi_1)^n+
@@ -27,7 +27,7 @@ def bell_kaiser_v(bias,n,params):
     '''
     i_beem = np.empty(len(bias))
     i_beem[:]=params[0]
-    nbh=int(len(params)-1)/2
+    nbh=int((len(params)-1)/2)
     negative=bias[0]<0
 
     for bh, a in zip(params[1:nbh+1], params[nbh+1:2*nbh+1]):
@@ -42,7 +42,7 @@ def bell_kaiser_v(bias,n,params):
 
 
 def residu_bell_kaiser_v(params,bias,i_beem,n):
-    '''Function that compute the residu of an estimation of a set of parameter
+    r'''Function that compute the residu of an estimation of a set of parameter
     for the Bell Kaiser V model. Useful to use with scipy.optimize.leastsq
 
     :param  bias: Bias to compute
@@ -58,3 +58,140 @@ def residu_bell_kaiser_v(params,bias,i_beem,n):
     :rtype: ndarray
     '''
     return bell_kaiser_v(bias,n,params)-i_beem
+
+
+def jacobian_bell_kaiser_v(params,bias,i_beem,n):
+    r'''Function that compute the analytic jacobian of
+    :func:`residu_bell_kaiser_v` with respect to the parameters. Useful to use
+    as Dfun of scipy.optimize.leastsq (with col_deriv=1)
+
+    :param params: parameters of the Bell Kaiser V model\
+            params[0]=offset\
+            params[1:x-1]=:math:`\Phi_1,\Phi_2,\dots,\Phi_{x-1}`\
+            params[x:2x-1]=:math:`a_1,a_2,\dots,a_{x-1}`
+    :type params: ndarray
+    :param  bias: Bias to compute
+    :type bias: ndarray
+    :param i_beem: BEEM current measured (unused, for leastsq)
+    :param n: parameter n of the Bell Kasier V model
+    :type n: float
+
+    :return: derivative of the residu, one row per parameter
+    :rtype: ndarray
+    '''
+    jac = np.zeros((len(params),len(bias)))
+    jac[0]=1
+    nbh=int((len(params)-1)/2)
+    negative=bias[0]<0
+
+    for j, (bh, a) in enumerate(zip(params[1:nbh+1], params[nbh+1:2*nbh+1])):
+        if negative:
+            i=bias<bh
+        else:
+            i=bias>bh
+        V=bias[i]
+        k=np.abs(V-bh)
+        jac[1+nbh+j,i]=-k**n/V
+        jac[1+j,i]=a*n*k**(n-1)*np.sign(V-bh)/V
+
+    return jac
+
+
+def bell_kaiser_v_batch(bias,n,params,out=None):
+    '''Batched version of :func:`bell_kaiser_v` computing many curves at once
+
+    :param  bias: Bias to compute, one row per curve (a 1-D bias is shared\
+            by every curve)
+    :type bias: ndarray
+    :param n: parameter n of the Bell Kasier V model
+    :type n: float
+    :param params: parameters of the Bell Kaiser V model, one row per curve\
+            ordered as for :func:`bell_kaiser_v` (a 1-D params is shared by\
+            every curve)
+    :type params: ndarray
+    :param out: preallocated array (curves x points) to store the result
+    :type out: ndarray
+
+    :return: BEEM current according to the model, one row per curve
+    :rtype: ndarray
+    '''
+    bias=np.asarray(bias,dtype=float)
+    params=np.atleast_2d(np.asarray(params,dtype=float))
+    nbh=int((params.shape[1]-1)/2)
+    b=np.atleast_2d(bias)
+    if out is None:
+        out=np.empty((max(len(params),len(b)),b.shape[1]))
+    i_beem=out.reshape(-1,b.shape[1])
+
+    negative=b[:,:1]<0
+    i_beem[:]=params[:,:1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for j in range(nbh):
+            bh=params[:,1+j,None]
+            a=params[:,1+nbh+j,None]
+            i=np.where(negative,b<bh,b>bh)
+            i_beem-=np.where(i,a*np.abs(b-bh)**n/b,0)
+
+    return out
+
+
+def residu_bell_kaiser_v_batch(params,bias,i_beem,n,out=None):
+    '''Batched version of :func:`residu_bell_kaiser_v` computing the residu
+    of many curves at once
+
+    :param params: parameters of the Bell Kaiser V model, one row per curve
+    :type params: ndarray
+    :param  bias: Bias to compute, one row per curve
+    :type bias: ndarray
+    :param i_beem: BEEM current measured, one row per curve
+    :type i_beem: ndarray
+    :param n: parameter n of the Bell Kasier V model
+    :type n: float
+    :param out: preallocated array (curves x points) to store the result
+    :type out: ndarray
+    :rtype: ndarray
+    '''
+    i_beem=np.asarray(i_beem,dtype=float)
+    if out is None:
+        out=np.empty(np.atleast_2d(i_beem).shape)
+    bell_kaiser_v_batch(bias,n,params,out)
+    out-=i_beem.reshape(out.shape)
+    return out
+
+
+def jacobian_bell_kaiser_v_batch(params,bias,i_beem,n,out=None):
+    '''Batched version of :func:`jacobian_bell_kaiser_v`
+
+    :param params: parameters of the Bell Kaiser V model, one row per curve
+    :type params: ndarray
+    :param  bias: Bias to compute, one row per curve
+    :type bias: ndarray
+    :param i_beem: BEEM current measured (unused)
+    :param n: parameter n of the Bell Kasier V model
+    :type n: float
+    :param out: preallocated array (curves x parameters x points) to store\
+            the result
+    :type out: ndarray
+
+    :return: derivative of the residu (curves x parameters x points)
+    :rtype: ndarray
+    '''
+    params=np.atleast_2d(np.asarray(params,dtype=float))
+    b=np.atleast_2d(np.asarray(bias,dtype=float))
+    nbh=int((params.shape[1]-1)/2)
+    if out is None:
+        out=np.empty((max(len(params),len(b)),1+2*nbh,b.shape[1]))
+    jac=out.reshape(-1,1+2*nbh,b.shape[1])
+
+    negative=b[:,:1]<0
+    jac[:,0]=1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for j in range(nbh):
+            bh=params[:,1+j,None]
+            a=params[:,1+nbh+j,None]
+            i=np.where(negative,b<bh,b>bh)
+            k=np.abs(b-bh)
+            jac[:,1+nbh+j]=np.where(i,-k**n/b,0)
+            jac[:,1+j]=np.where(i,a*n*k**(n-1)*np.sign(b-bh)/b,0)
+
+    return out
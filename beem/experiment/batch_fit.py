@@ -0,0 +1,190 @@
+"""Module that fit many BEESFit at once with the batched Levenberg-Marquardt
+solver of :mod:`optimize` instead of one MINPACK call per curve.
+"""
+
+import numpy as np
+
+from . import experiment
+from .experiment import BEEM_MODEL
+from .optimize import leastsq_batch
+from . import instrument
+
+_FAILED = {'barrier_height':[None],
+           'trans_a':[None],
+           'noise':None,
+           'barrier_height_err':[np.inf],
+           'trans_a_err':[np.inf],
+           'noise_err':np.inf}
+
+
+def _pad(arrays):
+    """Stack arrays of different length in a (curves x points) array padded
+    with NaN"""
+    out = np.empty((len(arrays), max(len(x) for x in arrays)))
+    out[:] = np.nan
+    for i, x in enumerate(arrays):
+        out[i, :len(x)] = x
+    return out
+
+
+def _batch_fit(bias, i_beem, window, p0, n):
+    """Fit a block of curves on their window and return the parameters and
+    their errors (scaled as in BEESFit._fit)"""
+    popt, cov, cost, info = leastsq_batch(
+            experiment.residu_bell_kaiser_v_batch,
+            experiment.jacobian_bell_kaiser_v_batch,
+            p0, (bias, i_beem, n), window)
+    dof = np.sum(window, 1) - p0.shape[1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        err = np.diagonal(cov, 0, 1, 2)*(cost/dof)[:, None]
+    err[np.logical_or(dof <= 0, ~np.isfinite(err).all(1))] = np.inf
+    popt[info < 0] = np.nan
+    return popt, np.sqrt(np.abs(err))
+
+
+def _auto_range(bias, i_beem, valid, n, p0, bias_min, bias_max, auto_range,
+                auto, tol=0.001, maxIt=10, conv_ratio=1):
+    """Vectorized version of BEESFit._auto_range_fit: every curve follows the
+    same rules to move its window but all the curves are fitted together.
+    Curves with auto=False are fitted once on their window."""
+    c = len(bias)
+    conv_inv = 1-conv_ratio
+    a = p0.copy()
+    bias_min = bias_min.copy()
+    bias_max = bias_max.copy()
+
+    neg = a[:, 1] < 0
+    bias_min[auto & neg] = a[auto & neg, 1] - auto_range[auto & neg]
+    bias_max[auto & ~neg] = a[auto & ~neg, 1] + auto_range[auto & ~neg]
+    sweep_neg = bias_max < 0
+    lim = np.where(sweep_neg, np.nanmin(bias, 1), np.nanmax(bias, 1))
+
+    popt = np.empty(a.shape)
+    perr = np.empty(a.shape)
+    done = np.zeros(c, dtype=bool)
+    todo = np.arange(c)
+
+    for i in range(maxIt):
+        instrument.count('auto_range_iterations', len(todo))
+        window = np.logical_and(valid[todo], np.logical_and(
+            bias[todo] >= bias_min[todo, None],
+            bias[todo] <= bias_max[todo, None]))
+        b, err = _batch_fit(bias[todo], i_beem[todo], window, a[todo], n)
+
+        #Same as the start point: restart from an other point
+        same = np.all(b == a[todo], 1)
+        instrument.count('restarts', int(np.sum(same)))
+        if np.any(same):
+            s0 = a[todo[same]].copy()
+            nb = (s0.shape[1]-1)//2
+            s0[:, 1:nb+1] *= 1.1
+            s0[:, nb+1:] *= 0.1
+            b[same], err[same] = _batch_fit(bias[todo[same]],
+                    i_beem[todo[same]], window[same], s0, n)
+
+        popt[todo] = b
+        perr[todo] = err
+        bh = b[:, 1]
+        found = np.isfinite(bh)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rel = np.abs(err[:, 1]/bh)
+        conv = np.logical_or(~auto[todo],
+                np.logical_and(found, np.abs(bh-a[todo, 1]) < tol))
+        done[todo[conv]] = True
+
+        #if barrier not found look further
+        further = np.logical_and(~conv, np.logical_or(~found, ~(rel <= 0.04)))
+        instrument.count('window_expansions', int(np.sum(further)))
+        t = todo[further]
+        bias_min[t] = np.where(sweep_neg[t],
+                np.maximum(bias_min[t]-auto_range[t], lim[t]), bias_min[t])
+        bias_max[t] = np.where(sweep_neg[t], bias_max[t],
+                np.minimum(bias_max[t]+auto_range[t], lim[t]))
+
+        #else move the window around the barrier found
+        move = np.logical_and(~conv, ~further)
+        instrument.count('window_moves', int(np.sum(move)))
+        t = todo[move]
+        bh_t = bh[move]
+        outside = np.logical_or(bh_t > bias_max[t], bh_t < bias_min[t])
+        center = conv_ratio*bh_t + conv_inv*a[t, 1]
+        bias_min[t] = np.where(~outside & sweep_neg[t],
+                center-auto_range[t], bias_min[t])
+        bias_max[t] = np.where(~outside & ~sweep_neg[t],
+                center+auto_range[t], bias_max[t])
+        popt[t[outside], 1] = (bias_max[t[outside]]+bias_min[t[outside]])/2
+        a[t] = popt[t]
+
+        todo = todo[~conv]
+        if not len(todo):
+            break
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rel = np.abs(perr[:, 1]/popt[:, 1])
+    failed = np.logical_and(~done, np.logical_or(~np.isfinite(popt[:, 1]),
+                                                 ~(rel <= 0.1)))
+    popt[failed] = np.nan
+    instrument.count('failed', int(np.sum(failed)))
+    return popt, perr, bias_min, bias_max
+
+
+def fit_beesfit(beesfit, barrier_height=[-0.8], trans_a=[0.001], noise=1e-9,
+                tol=0.001, maxIt=10, conv_ratio=1, chunk=2048, init=None):
+    """Fit a list of BEESFit with the batched solver and update them with the
+    result (same fields as BEESFit.fit_update).
+
+    Args:
+        beesfit (list): BEESFit to fit
+        barrier_height, trans_a, noise: initial values (as BEESFit.fit)
+        tol, maxIt, conv_ratio: auto range parameters (as BEESFit.fit)
+        chunk (int): number of curves fitted together
+        init (list): initial values of each curve (dictionary with
+            barrier_height, trans_a and noise), overwrite the values above
+    """
+    with instrument.record('fit_beesfit', curves=len(beesfit)):
+        _fit_beesfit(beesfit, barrier_height, trans_a, noise, tol, maxIt,
+                     conv_ratio, chunk, init)
+
+
+def _fit_beesfit(beesfit, barrier_height, trans_a, noise, tol, maxIt,
+                 conv_ratio, chunk, init):
+    nb = len(barrier_height)
+    p0 = np.tile(np.r_[noise, barrier_height, trans_a], (len(beesfit), 1))
+    if init is not None:
+        for i, x in enumerate(init):
+            p0[i] = np.r_[x.get('noise', noise),
+                          x.get('barrier_height', barrier_height),
+                          x.get('trans_a', trans_a)]
+    bkv = np.array([b.method == BEEM_MODEL['bkv'] for b in beesfit], dtype=bool)
+    beesfit = [b for b, k in zip(beesfit, bkv) if k]
+    p0 = p0[bkv]
+    n = np.array([b.n for b in beesfit], dtype=float)
+
+    for x in np.unique(n):
+        index = np.flatnonzero(n == x)
+        group = [beesfit[i] for i in index]
+        for s in range(0, len(group), chunk):
+            block = group[s:s+chunk]
+            bias = _pad([b.bias for b in block])
+            i_beem = _pad([b.i_beem for b in block])
+            valid = np.logical_and(np.isfinite(bias), np.isfinite(i_beem))
+            popt, perr, bias_min, bias_max = _auto_range(
+                    bias, i_beem, valid, x, p0[index[s:s+chunk]],
+                    np.array([b.bias_min for b in block], dtype=float),
+                    np.array([b.bias_max for b in block], dtype=float),
+                    np.array([b.range for b in block], dtype=float),
+                    np.array([bool(b.auto_range) for b in block]),
+                    tol, maxIt, conv_ratio)
+
+            for i, b in enumerate(block):
+                if np.isfinite(popt[i, 1]):
+                    res = {'barrier_height':popt[i, 1:nb+1],
+                           'trans_a':popt[i, nb+1:2*nb+1],
+                           'noise':popt[i, 0],
+                           'barrier_height_err':perr[i, 1:nb+1],
+                           'trans_a_err':perr[i, nb+1:2*nb+1],
+                           'noise_err':perr[i, 0]}
+                else:
+                    res = dict(_FAILED)
+                res.update({'bias_max':bias_max[i], 'bias_min':bias_min[i]})
+                b.update(res)
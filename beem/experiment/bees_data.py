@@ -1,3 +1,5 @@
+import numpy as np
+
 from .experiment import Experiment, MODE
 
 class BEESData(Experiment):
@@ -40,78 +42,136 @@ class BEESData(Experiment):
         return self.id<other.id
 
     def set_id(self):
-        self.id = BEESID()
-        self.id.x_index = self.x_index
-        self.id.y_index = self.y_index
-        self.id.mode = self.mode
-        self.id.number = self.number
-        self.id.pass_number = self.pass_number
+        self.id = BEESID(self.x_index, self.y_index, self.pass_number,
+                         self.number, self.mode)
 
 class BEESID(object):
-
-    def __init__(self):
-        self.x_index = 0
-        self.y_index = 0
-        self.pass_number = 0
-        self.number = 0
-        self.mode = MODE['fwd']
+    """Immutable identifier of a curve: the tuple (x_index, y_index,
+    pass_number, number, mode) with its hash computed once. The methods
+    return a new BEESID."""
+
+    FIELDS = ('x_index', 'y_index', 'pass_number', 'number', 'mode')
+    __slots__ = ('key', '_hash')
+
+    def __init__(self, x_index=0, y_index=0, pass_number=0, number=0,
+                 mode=MODE['fwd']):
+        key = (int(x_index), int(y_index), int(pass_number), int(number),
+               int(mode))
+        object.__setattr__(self, 'key', key)
+        object.__setattr__(self, '_hash', hash(key))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('BEESID is immutable, use replace')
+
+    def __reduce__(self):
+        return (BEESID, self.key)
+
+    def __setstate__(self, state):
+        #files of old versions: instance dictionary of a mutable BEESID
+        if isinstance(state, tuple):
+            state = state[-1]
+        self.__init__(*[state[x] for x in BEESID.FIELDS])
+
+    x_index = property(lambda self: self.key[0])
+    y_index = property(lambda self: self.key[1])
+    pass_number = property(lambda self: self.key[2])
+    number = property(lambda self: self.key[3])
+    mode = property(lambda self: self.key[4])
 
     def __hash__(self):
-        return int(self.mode + 10*self.number + 1000*self.pass_number +\
-                   100000*self.y_index + 100000000*self.x_index)
+        return self._hash
 
     def __eq__(self,other):
-        l=['x_index', 'y_index', 'pass_number', 'number', 'mode']
-        for x in l:
-            if self.__getattribute__(x)!=other.__getattribute__(x):
-                return False
-        return True
+        return self.key==other.key
 
     def __ne__(self,other):
-        return not(self==other)
+        return self.key!=other.key
 
     def __lt__(self,other):
-        l=['x_index', 'y_index', 'pass_number', 'number', 'mode']
-        for x in l:
-            if self.__getattribute__(x)<other.__getattribute__(x):
-                return True
-        return False
-
+        return self.key<other.key
 
     def copy(self):
-        k = BEESID()
-        k.x_index = self.x_index
-        k.y_index = self.y_index
-        k.pass_number = self.pass_number
-        k.number = self.number
-        k.mode = self.mode
-        return k
-
-    def switch_mode(self):
-        k = self.copy()
+        return self
 
-        if k.mode==MODE['fwd']:
-            k.mode = MODE['bwd']
-        
-        elif k.mode==MODE['bwd']:
-            k.mode = MODE['fwd']
+    def replace(self, **kwd):
+        """Return the BEESID with some fields changed"""
+        key = list(self.key)
+        for x, v in kwd.items():
+            key[BEESID.FIELDS.index(x)] = v
+        return BEESID(*key)
 
-        return k
+    def switch_mode(self):
+        if self.mode==MODE['fwd']:
+            return self.replace(mode=MODE['bwd'])
+        elif self.mode==MODE['bwd']:
+            return self.replace(mode=MODE['fwd'])
+        return self
 
     def next_sweep(self):
-        k = self.copy()
-        k.number += 1
-        return k
+        return self.replace(number=self.number+1)
 
     def previous_sweep(self):
-        k = self.copy()
-        k.number -= 1
-        return k
+        return self.replace(number=self.number-1)
 
 
     def __str__(self):
-        return '%03d_%03d_%03d_%03d_%02d'%(self.x_index, 
-                                           self.y_index,
-                                           self.pass_number, 
-                                           self.number, 
-                                           self.mode)
+        return '%03d_%03d_%03d_%03d_%02d'%self.key
+
+
+def _stored(name, per_row=True):
+    """Property reading (and writing) an attribute of the GridStore of a
+    StoredBEESData"""
+    if per_row:
+        def fget(self):
+            return self.store.get(name, self.row)
+        def fset(self, value):
+            self.store.set(name, self.row, value)
+    else:
+        def fget(self):
+            return getattr(self.store, name)
+        def fset(self, value):
+            setattr(self.store, name, value)
+    return property(fget, fset)
+
+
+class StoredBEESData(BEESData):
+    """BEESData which is a lightweight view of one row of a
+    :class:`grid_store.GridStore`: all the data and the indexes live in the
+    arrays of the store.
+    """
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+        self.id = None
+        self.parent = None
+
+    bias = _stored('bias')
+    i_tunnel = _stored('i_tunnel')
+    i_beem = _stored('i_beem')
+    pos_z = _stored('pos_z')
+    mode = _stored('mode')
+    number = _stored('number')
+    pass_number = _stored('pass_number')
+    x_index = _stored('x_index')
+    y_index = _stored('y_index')
+    pos_x = _stored('pos_x')
+    pos_y = _stored('pos_y')
+    sample = _stored('sample', False)
+    device = _stored('device', False)
+    src_files = _stored('src_files', False)
+
+    @property
+    def date(self):
+        #one date for the store or one date per curve
+        d = self.store.date
+        if isinstance(d, np.ndarray):
+            return d[self.row]
+        return d
+
+    @date.setter
+    def date(self, value):
+        if isinstance(self.store.date, np.ndarray):
+            self.store.date[self.row] = value
+        else:
+            self.store.date = value
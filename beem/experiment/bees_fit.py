@@ -1,8 +1,11 @@
 import numpy as np
 import scipy.optimize as op
 
-from .experiment import BEEM_MODEL, MODE, bell_kaiser_v, residu_bell_kaiser_v
-from beem.experiment.bees_data import BEESData
+from . import experiment
+from . import cache
+from . import instrument
+from .experiment import BEEM_MODEL, MODE
+from beem.experiment.bees_data import BEESData, BEESID
 from .optimize import leastsq
 from .experiment import r_squared
 
@@ -33,19 +36,95 @@ class BEESFit(object):
         self.barrier_height_err = [None]
         self.trans_a_err = [None]
         self.noise_err = None
+        self.barrier_height_err_boot = None
+        self.trans_a_err_boot = None
+        self.barrier_height_ci = None
+        self.trans_a_ci = None
         self.id = BEESFitID()
         self.parent=None
-        self._bias_max = self.bias_max
-        self._bias_min = self.bias_min
-        if data!=None:
-            self._index = [True]*len(self.bias)
+        self.memo_hits = 0
+        self.memo_misses = 0
 
     def __eq__(self,other):
         return self.id==other.id
 
+    def __getstate__(self):
+        state=self.__dict__.copy()
+        state.pop('_memo',None)
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.memo_hits=0
+        self.memo_misses=0
+
+    def _memoized(self,name,objects,values,compute):
+        """Return compute() cached until one of the objects (compared by
+        identity) or of the values (compared by equality) change"""
+        memo=self.__dict__.setdefault('_memo',{})
+        if name in memo:
+            o,v,value=memo[name]
+            if v==values and len(o)==len(objects) and \
+                    all([a is b for a,b in zip(o,objects)]):
+                self.memo_hits+=1
+                return value
+        self.memo_misses+=1
+        value=compute()
+        memo[name]=(objects,values,value)
+        return value
+
+    def _prime(self,attribute,value):
+        """Store the combined and filtered array of an attribute computed
+        elsewhere (see Grid.prefilter)"""
+        memo=self.__dict__.setdefault('_memo',{})
+        memo[attribute]=(self._sources(attribute),(),value)
+
+    def clear_memo(self):
+        """Forget the cached arrays (needed only if the arrays of the data
+        are modified in place)"""
+        self.__dict__.pop('_memo',None)
+
+    def _sources(self,attribute):
+        ## the array of a BEESData or the BEESData itself if the array is
+        ## a property (view of a GridStore)
+        src=[self.filter,self.combine]
+        for t in self.data:
+            src.append(t.__dict__.get(attribute,t))
+        return src
+
+    def _combined(self,attribute):
+        if len(self.data)==1 and self.filter is None and \
+                attribute not in self.__dict__.get('_memo',()):
+            ## nothing to compute
+            return getattr(self.data[0],attribute)
+
+        def compute():
+            if len(self.data)>1:
+                combined=self.combine([getattr(t,attribute) for t in self.data])
+            else:
+                combined=getattr(self.data[0],attribute)
+            if self.filter==None:
+                return combined
+            return self.filter(combined)
+        return self._memoized(attribute,self._sources(attribute),(),compute)
+
+    def _fitted(self,attribute):
+        return self._memoized(attribute+'_fitted',
+                self._sources(attribute)+self._sources('bias'),
+                (self.bias_min,self.bias_max),
+                lambda: getattr(self,attribute)[self.index])
+
     def update(self,dic):
         for key in dic:
             setattr(self,key,dic[key])
+        if 'barrier_height_err' in dic:
+            ## the resampled errors were those of the previous fit
+            self.barrier_height_err_boot=None
+            self.trans_a_err_boot=None
+            self.barrier_height_ci=None
+            self.trans_a_ci=None
+        if self.parent is not None:
+            self.parent._changed()
 
     @property
     def bias(self):
@@ -54,38 +133,68 @@ class BEESFit(object):
         else:
             return self.data[0].bias
 
+    @property
+    def sweep(self):
+        """Return the sorted bias and the order of the bias: 1 or -1 if the
+        bias is increasing or decreasing, else the indices which sort it"""
+        def compute():
+            bias=np.asarray(self.bias)
+            d=np.diff(bias)
+            if np.all(d>=0):
+                return bias,1
+            if np.all(d<=0):
+                return bias[::-1],-1
+            order=np.argsort(bias,kind='mergesort')
+            return bias[order],order
+        return self._memoized('sweep',self._sources('bias'),(),compute)
+
     @property
     def index(self):
-        if (self.bias_max!=self._bias_max or self.bias_min != self._bias_min):
-          index = np.logical_and(self.bias <= self.bias_max,
-                               self.bias >= self.bias_min)
-          self._index = index
-          self._bias_max = self.bias_max
-          self._bias_min = self.bias_min
-        return self._index
+        """Points of the fit window [bias_min, bias_max] found by bisection:
+        a slice if the bias is monotonic (the fitted arrays are views), else
+        the indices of the points"""
+        def compute():
+            s,order=self.sweep
+            lo=np.searchsorted(s,self.bias_min,'left')
+            hi=max(lo,np.searchsorted(s,self.bias_max,'right'))
+            if isinstance(order,int):
+                if order==1:
+                    return slice(lo,hi)
+                return slice(len(s)-hi,len(s)-lo)
+            return np.sort(order[lo:hi])
+        return self._memoized('index',self._sources('bias'),
+                              (self.bias_min,self.bias_max),compute)
 
     @property
     def i_beem_fitted(self):
-        return self.i_beem[self.index]
+        return self._fitted('i_beem')
 
     @property
     def i_tunnel_fitted(self):
-        return self.i_tunnel[self.index]
+        return self._fitted('i_tunnel')
 
     @property
     def bias_fitted(self):
-        return self.bias[self.index]
+        return self._fitted('bias')
 
     @property
     def i_beem_estimated(self):
         if self.barrier_height[0]==None:
             return None
         if self.method==BEEM_MODEL["bkv"]:
-            return bell_kaiser_v(self.bias_fitted,self.n,
+            return experiment.bell_kaiser_v(self.bias_fitted,self.n,
                         np.r_[self.noise, self.barrier_height,self.trans_a]);
         return None
 
 
+    @property
+    def params(self):
+        """Fitted parameters ordered as for the model functions
+        (noise, barrier heights, transmission), None if not fitted"""
+        if self.barrier_height[0] is None:
+            return None
+        return np.r_[self.noise, self.barrier_height, self.trans_a]
+
     def _wrap_bees(self,attribute):
         if not(self.data):
             return None
@@ -143,48 +252,19 @@ class BEESFit(object):
     def i_beem(self):
         if not(self.data):
             return None
-
-        if len(self.data)>1:
-            combined=self.combine([t.i_beem for t in self.data])
-        else:
-            combined=self.data[0].i_beem
-
-        if self.filter==None:
-            return combined
-        else:
-            return self.filter(combined)
+        return self._combined('i_beem')
 
     @property
     def i_tunnel(self):
         if not(self.data):
             return None
-
-        if len(self.data)>1:
-            combined=self.combine([t.i_tunnel for t in self.data])
-        else:
-            combined=self.data[0].i_tunnel
-
-        if self.filter==None:
-            i_tunnel=combined
-        else:
-            i_tunnel = self.filter(combined)
-        return i_tunnel
+        return self._combined('i_tunnel')
 
     @property
     def pos_z(self):
         if not(self.data):
             return None
-
-        if len(self.data)>1:
-            combined=self.combine([t.pos_z for t in self.data])
-        else:
-            combined=self.data[0].pos_z
-
-        if self.filter==None:
-            pos_z=combined
-        else:
-            pos_z = self.filter(combined)
-        return pos_z
+        return self._combined('pos_z')
 
     @property
     def trans_r(self):
@@ -199,42 +279,47 @@ class BEESFit(object):
         return self.trans_a_err/np.mean(self.i_tunnel)
 
     def set_id(self):
-        self.id=BEESFitID()
-        for b in self.data:
-            self.id.bees.append(b.id)
-
-        self.id.n=self.n
+        self.id=BEESFitID([b.id for b in self.data],self.n)
+
+    def _move(self,other,**kwd):
+        """Return the BEESFit of the grid with the id of self but some fields
+        of its BEESID changed (None if there is none), read in the index of
+        the grid for one curve and looked up by other() for the others"""
+        bid=self.id
+        if len(bid.bees)==1:
+            key=list(bid.bees[0].key)
+            for x,v in kwd.items():
+                key[BEESID.FIELDS.index(x)]=v
+            b=self.parent.at(tuple(key))
+            if b is None or b.id.n==bid.n:
+                return b
+        return self.parent.find(other())
 
     def get_reverse_mode(self):
-        bid=self.id.switch_mode()
-        return self.parent.beesfit_dict[bid]
+        bid=self.id
+        mode=MODE['bwd'] if bid.bees[0].mode==MODE['fwd'] else MODE['fwd']
+        b=self._move(bid.switch_mode,mode=mode)
+        if b is None:
+            raise KeyError(bid.switch_mode())
+        return b
 
     def get_next_sweep(self):
-        bid=self.id.next_sweep()
-        if bid in self.parent.beesfit_dict:
-            return self.parent.beesfit_dict[bid]
-        else:
-            return None
+        return self._move(self.id.next_sweep,
+                          number=self.id.bees[0].number+1)
 
     def get_previous_sweep(self):
-        bid=self.id.previous_sweep()
-        if bid in self.parent.beesfit_dict:
-            return self.parent.beesfit_dict[bid]
-        else:
-            return None
-
+        return self._move(self.id.previous_sweep,
+                          number=self.id.bees[0].number-1)
 
     def get_same_pos(self,sweep,mode,pass_number=None):
         if pass_number==None:
             pass_number=self.data[0].pass_number
 
-        k=self.id.copy()
-        for b in k.bees:
-            b.pass_number=pass_number
-            b.number=sweep
-            b.mode=mode
-
-        return self.parent.beesfit_dict[k]
+        kwd=dict(pass_number=pass_number,number=sweep,mode=mode)
+        b=self._move(lambda:self.id.replace(**kwd),**kwd)
+        if b is None:
+            raise KeyError(self.id.replace(**kwd))
+        return b
 
     def add_data(self, data):
         if isinstance(data,BEESData):
@@ -248,14 +333,15 @@ class BEESFit(object):
             b=len(barrier_height)
             ydata=self.i_beem_fitted
             if self.method==BEEM_MODEL['bkv']:
-                func=residu_bell_kaiser_v
+                func=experiment.residu_bell_kaiser_v
+                jac=experiment.jacobian_bell_kaiser_v
                 p0=[noise]+list(barrier_height)+list(trans_a)
                 args=(self.bias_fitted,ydata,self.n)
 
 
             #Curve fit and compute error
             #popt, pcov,info,mesg,ier = op.leastsq(func,p0,args,full_output=1)
-            popt, pcov= leastsq(func,p0,args,full_output=1)
+            popt, pcov= leastsq(func,p0,args,full_output=1,Dfun=jac)
             if (len(ydata) > len(p0)) and pcov is not None:
                 s_sq = (func(popt, *args)**2).sum()/(len(ydata)-len(p0))
                 pcov = pcov * s_sq
@@ -270,7 +356,8 @@ class BEESFit(object):
                     'barrier_height_err':np.sqrt(err[1:b+1]),
                     'trans_a_err':np.sqrt(err[b+1:2*b+1]),
                     'noise_err':np.sqrt(err[0])}
-        except:
+        except Exception as e:
+            instrument.count('exception.'+type(e).__name__)
             return {'barrier_height':[None],
                     'trans_a':[None],
                     'noise':None,
@@ -298,8 +385,10 @@ class BEESFit(object):
 
 
         for i in range(maxIt):
+            instrument.count('auto_range_iterations')
             b=self._fit(a['barrier_height'],a['trans_a'], a['noise'])
             if b['barrier_height']==a['barrier_height']:
+              instrument.count('restarts')
               b=self._fit(a['barrier_height']*1.1,a['trans_a']*0.1, a['noise'])
 
             if b['barrier_height'][0]!=None and\
@@ -311,11 +400,13 @@ class BEESFit(object):
             if b['barrier_height'][0]==None or\
                     np.abs(b['barrier_height_err'][0]/b['barrier_height'][0])\
                     >0.04:
+                instrument.count('window_expansions')
                 if self.bias_max<0:
                     self.bias_min=max(self.bias_min-auto_range,lim)
                 else:
                     self.bias_max=min(self.bias_max+auto_range,lim)
             else:
+                instrument.count('window_moves')
                 if b['barrier_height'][0]>self.bias_max or\
                         b['barrier_height'][0]<self.bias_min:
                     b['barrier_height'][0]=(self.bias_max+self.bias_min)/2
@@ -329,7 +420,7 @@ class BEESFit(object):
 
         if(b['barrier_height'][0]==None or\
                 np.abs(b['barrier_height_err'][0]/b['barrier_height'][0])>0.1):
-
+            instrument.count('failed')
             b={'barrier_height':[None],
                'trans_a':[None],
                'noise':None,
@@ -341,6 +432,10 @@ class BEESFit(object):
         return b
 
     def fit(self,auto=None,**kwarg):
+        with instrument.record('bees_fit'):
+            return self._fit_auto(auto,**kwarg)
+
+    def _fit_auto(self,auto=None,**kwarg):
         if auto==None and self.auto_range:
             return self._auto_range_fit(auto_range=self.range,**kwarg)
         elif auto==None:
@@ -351,7 +446,16 @@ class BEESFit(object):
             return self._fit(**kwarg)
 
     def fit_update(self,**kwarg):
-        self.update(self.fit(**kwarg))
+        c=cache.get_cache()
+        if c is None:
+            self.update(self.fit(**kwarg))
+            return
+        key=[c.key(self,kwarg)]
+        res=c.get(key)[0]
+        if res is None:
+            res=self.fit(**kwarg)
+            c.put(key,[res])
+        self.update(res)
 
     @property
     def r_squared(self):
@@ -363,61 +467,59 @@ class BEESFit(object):
 
 
 class BEESFitID(object):
+    """Immutable identifier of a BEESFit: the sorted tuple of the BEESID of
+    its data and the exponent n, with its hash computed once. The methods
+    return a new BEESFitID."""
+
+    __slots__ = ('bees', 'n', 'key', '_hash')
+
+    def __init__(self,bees=(),n=0):
+        bees=tuple(sorted(bees))
+        for x, v in [('bees',bees),('n',n),('key',(bees,n)),
+                     ('_hash',hash((bees,n)))]:
+            object.__setattr__(self,x,v)
 
-    def __init__(self):
-        self.bees=[]
-        self.n=0
+    def __setattr__(self,name,value):
+        raise AttributeError('BEESFitID is immutable, use replace')
+
+    def __reduce__(self):
+        return (BEESFitID,self.key)
+
+    def __setstate__(self,state):
+        #files of old versions: instance dictionary of a mutable BEESFitID
+        if isinstance(state,tuple):
+            state=state[-1]
+        self.__init__(state['bees'],state['n'])
 
     def copy(self):
-        b=BEESFitID()
-        b.bees=self.bees[:]
-        b.n=self.n
-        return b
+        return self
+
+    def replace(self,**kwd):
+        """Return the BEESFitID with some fields of all its BEESID changed"""
+        return BEESFitID([b.replace(**kwd) for b in self.bees],self.n)
 
     def switch_mode(self):
-        b=self.copy()
-        for bt in range(len(b.bees)):
-            b.bees[bt]=b.bees[bt].switch_mode()
-        return b
+        return BEESFitID([b.switch_mode() for b in self.bees],self.n)
 
     def next_sweep(self):
-        b=self.copy()
-        for bt in range(len(b.bees)):
-            b.bees[bt]=b.bees[bt].next_sweep()
-        return b
+        return BEESFitID([b.next_sweep() for b in self.bees],self.n)
 
     def previous_sweep(self):
-        b=self.copy()
-        for bt in range(len(b.bees)):
-            b.bees[bt]=b.bees[bt].previous_sweep()
-        return b
+        return BEESFitID([b.previous_sweep() for b in self.bees],self.n)
 
 
     def __hash__(self):
-        h=0
-        self.bees.sort()
-        for x in self.bees:
-            h+=x.__hash__()
-        return int(h*100+10*self.n)
+        return self._hash
 
 
     def __eq__(self,other):
-        if len(self.bees)!=len(other.bees):
-            return False
-        self.bees.sort()
-        other.bees.sort()
-
-        for x in range(len(self.bees)):
-            if self.bees[x]!=other.bees[x]:
-                return False
-        return self.n==other.n
+        return self.key==other.key
 
     def __ne__(self,other):
-        return not(self==other)
+        return self.key!=other.key
 
     def __str__(self):
         s=''
-        self.bees.sort()
         for k in self.bees:
             s+=str(k)+'__'
 
@@ -0,0 +1,203 @@
+"""Module implementing a persistent cache of the fit results. A result is keyed
+on a digest of the data of the BEESFit (bias and combined i_beem) and of its
+fit settings (including the solver), so fitting again an unchanged curve does not call the optimizer.
+
+The cache is disabled by default, see :func:`use_cache`.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'pybeem',
+                            'fit_cache.sqlite')
+
+#Settings of BEESFit which change the result of a fit
+SETTINGS = ['n', 'method', 'range']
+
+#Solvers giving different results: MINPACK (BEESFit.fit, process pool) and
+#the batched Levenberg-Marquardt (backends batch and threads)
+SOLVERS = ['minpack', 'batch']
+
+_cache = None
+
+
+class FitCache(object):
+    """On-disk cache of fit results (sqlite) with a least recently used
+    eviction when its size is larger than max_size (bytes)"""
+
+    def __init__(self, path=DEFAULT_PATH, max_size=2**28):
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA synchronous=OFF')
+        self._db.execute('CREATE TABLE IF NOT EXISTS result '
+                         '(key BLOB PRIMARY KEY, record BLOB, used REAL)')
+        self._db.commit()
+        self._size = self._total()
+
+    def __getstate__(self):
+        raise TypeError('FitCache can not be pickled')
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM result').fetchone()[0]
+
+    @staticmethod
+    def key(beesfit, kwarg={}, solver='minpack'):
+        """Digest of the data and of the fit settings of a BEESFit
+
+        Args:
+            beesfit (BEESFit): curve to fit
+            kwarg (dict): arguments of BEESFit.fit
+            solver (str): solver of the fit (one of SOLVERS)
+        """
+        if solver not in SOLVERS:
+            raise ValueError('solver must be one of %s' % SOLVERS)
+        h = hashlib.sha1()
+        for x in [beesfit.bias, beesfit.i_beem]:
+            h.update(np.ascontiguousarray(x, dtype=float).tobytes())
+
+        auto = kwarg.get('auto')
+        if auto is None:
+            auto = beesfit.auto_range
+        if auto:
+            ## the auto range sets one edge of the window from the initial
+            ## barrier height: only the other one is a setting
+            bh = kwarg.get('barrier_height', [-0.8])[0]
+            window = (beesfit.bias_max,) if bh < 0 else (beesfit.bias_min,)
+        else:
+            window = (beesfit.bias_min, beesfit.bias_max)
+        settings = [solver, bool(auto), window] + \
+                [getattr(beesfit, x) for x in SETTINGS] + \
+                sorted((k, np.asarray(v).tolist()) for k, v in kwarg.items()
+                       if k != 'auto')
+        h.update(repr(settings).encode())
+        return h.digest()
+
+    def get(self, keys):
+        """Return the results (dictionary or None) of a list of keys"""
+        from .parallel import decode
+        out = []
+        with self._lock:
+            for k in keys:
+                r = self._db.execute('SELECT record FROM result WHERE key=?',
+                                     (k,)).fetchone()
+                out.append(None if r is None else
+                           decode(np.frombuffer(r[0], dtype=float)))
+            found = [(time.time(), k) for k, r in zip(keys, out)
+                     if r is not None]
+            if found:
+                self._db.executemany('UPDATE result SET used=? WHERE key=?',
+                                     found)
+                self._db.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return out
+
+    def put(self, keys, results):
+        """Store a list of results (dictionary returned by BEESFit.fit)"""
+        from .parallel import encode
+        rows = [(k, encode(r, len(r['barrier_height'])).tobytes(), time.time())
+                for k, r in zip(keys, results)]
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO result VALUES '
+                                 '(?,?,?)', rows)
+            ## upper bound (replaced rows are counted twice)
+            self._size += sum(len(k)+len(r) for k, r, t in rows)
+            if self._size > self.max_size:
+                self._evict()
+            self._db.commit()
+
+    def _total(self):
+        return self._db.execute('SELECT SUM(LENGTH(key)+LENGTH(record)) '
+                                'FROM result').fetchone()[0] or 0
+
+    def _evict(self):
+        self._size = self._total()
+        if self._size <= self.max_size:
+            return
+        ## remove the oldest entries until 90% of max_size
+        count = self._db.execute('SELECT COUNT(*) FROM result').fetchone()[0]
+        remove = int(np.ceil(count*(1-0.9*self.max_size/self._size)))
+        self._db.execute('DELETE FROM result WHERE key IN (SELECT key FROM '
+                         'result ORDER BY used LIMIT ?)', (remove,))
+        self._size = self._total()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM result')
+            self._db.commit()
+            self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self._db.close()
+
+
+def use_cache(val=True, path=DEFAULT_PATH, max_size=2**28):
+    """Enable (or disable) the fit cache
+
+    Args:
+        val (bool): enable the cache
+        path (str): sqlite file of the cache
+        max_size (int): maximum size of the cache in bytes
+    """
+    global _cache
+    if _cache is not None:
+        _cache.close()
+        _cache = None
+    if val:
+        _cache = FitCache(path, max_size)
+    return _cache
+
+
+def get_cache():
+    """Return the FitCache used (None if disabled)"""
+    return _cache
+
+
+def result(beesfit):
+    """Result of the last fit of a BEESFit (as returned by BEESFit.fit)"""
+    return dict((x, getattr(beesfit, x)) for x in
+                ['barrier_height', 'trans_a', 'noise', 'barrier_height_err',
+                 'trans_a_err', 'noise_err', 'bias_min', 'bias_max'])
+
+
+def fit_cached(beesfit, init, kwarg, fit, solver='minpack'):
+    """Update the BEESFit found in the cache and fit the others
+
+    Args:
+        beesfit (list): BEESFit to fit
+        init (list): initial values of each curve (or None)
+        kwarg (dict): arguments of the fit
+        fit (function): called as fit(beesfit, init) to fit the curves not
+            in the cache
+        solver (str): solver used by fit (one of SOLVERS)
+    """
+    if _cache is None:
+        return fit(beesfit, init)
+    if init is None:
+        init = [{}]*len(beesfit)
+    keys = [_cache.key(b, dict(kwarg, **i), solver)
+            for b, i in zip(beesfit, init)]
+    miss = []
+    for i, (b, r) in enumerate(zip(beesfit, _cache.get(keys))):
+        if r is None:
+            miss.append(i)
+        else:
+            b.update(r)
+    if miss:
+        fit([beesfit[i] for i in miss], [init[i] for i in miss])
+        _cache.put([keys[i] for i in miss],
+                   [result(beesfit[i]) for i in miss])
@@ -29,13 +29,23 @@ class Experiment(object):
 _use_pure_c=True
 bell_kaiser_v=None
 residu_bell_kaiser_v=None
+bell_kaiser_v_batch=None
+residu_bell_kaiser_v_batch=None
+jacobian_bell_kaiser_v=None
+jacobian_bell_kaiser_v_batch=None
 
 def use_pure_c(val=True):
     global bell_kaiser_v,residu_bell_kaiser_v,_use_pure_c
+    global bell_kaiser_v_batch,residu_bell_kaiser_v_batch
+    global jacobian_bell_kaiser_v,jacobian_bell_kaiser_v_batch
     if val==True:
         try:
             bell_kaiser_v=_pure_c.bell_kaiser_v
             residu_bell_kaiser_v=_pure_c.residu_bell_kaiser_v
+            bell_kaiser_v_batch=_pure_c.bell_kaiser_v_batch
+            residu_bell_kaiser_v_batch=_pure_c.residu_bell_kaiser_v_batch
+            jacobian_bell_kaiser_v=_pure_c.jacobian_bell_kaiser_v
+            jacobian_bell_kaiser_v_batch=_pure_c.jacobian_bell_kaiser_v_batch
             _use_pure_c = True
             return
         except:
@@ -45,6 +55,10 @@ def use_pure_c(val=True):
     from . import _pure_python as _pure_python
     bell_kaiser_v = _pure_python.bell_kaiser_v
     residu_bell_kaiser_v = _pure_python.residu_bell_kaiser_v
+    bell_kaiser_v_batch = _pure_python.bell_kaiser_v_batch
+    residu_bell_kaiser_v_batch = _pure_python.residu_bell_kaiser_v_batch
+    jacobian_bell_kaiser_v = _pure_python.jacobian_bell_kaiser_v
+    jacobian_bell_kaiser_v_batch = _pure_python.jacobian_bell_kaiser_v_batch
     _use_pure_c = False
 
 
@@ -67,8 +81,8 @@ def r_squared(y_sampled, y_estimated):
     Returns:
         float. squared correlation coefficient
     """
-    if y_estimated==None:
-        return np.NAN
-    sse = sum( (y_sampled - y_estimated)**2 )
-    sst = sum( (y_sampled - np.mean(y_sampled) )**2 )
+    if y_estimated is None:
+        return np.nan
+    sse = np.sum( (y_sampled - y_estimated)**2 )
+    sst = np.sum( (y_sampled - np.mean(y_sampled) )**2 )
     return 1 - sse / sst
@@ -0,0 +1,89 @@
+"""Module of filters and combine functions for the BEES curves. The filters
+work along the last axis so they clean one curve or a (curves x points)
+array at once, and the combine functions reduce the first axis (sweeps) like
+:func:`bees_fit.combine_mean`.
+
+A :class:`Pipeline` chains filters and can be used as BEESFit.filter or with
+:meth:`grid.Grid.prefilter` to clean all the curves of a grid together.
+"""
+
+from functools import partial
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import savgol_filter
+from scipy.stats import trim_mean
+
+
+def _windows(x, width):
+    """Sliding windows (..., points, width) of x along its last axis, the
+    edges are padded with the edge values"""
+    h = width//2
+    pad = [(0, 0)]*(x.ndim-1) + [(h, h)]
+    return sliding_window_view(np.pad(x, pad, mode='edge'), width, axis=-1)
+
+
+def median(x, width=5):
+    """Running median
+
+    Args:
+        x (ndarray): curve or (curves x points) array
+        width (int): odd size of the window
+    """
+    return np.median(_windows(np.asarray(x, dtype=float), width), -1)
+
+
+def savgol(x, width=7, order=2):
+    """Savitzky-Golay smoothing
+
+    Args:
+        x (ndarray): curve or (curves x points) array
+        width (int): odd size of the window
+        order (int): order of the polynomial
+    """
+    return savgol_filter(np.asarray(x, dtype=float), width, order, axis=-1)
+
+
+def hampel(x, width=7, n_sigma=3):
+    """Hampel filter: replace by the running median the points further than
+    n_sigma standard deviations (estimated by the median absolute deviation)
+    from it
+
+    Args:
+        x (ndarray): curve or (curves x points) array
+        width (int): odd size of the window
+        n_sigma (float): threshold
+    """
+    x = np.asarray(x, dtype=float)
+    w = _windows(x, width)
+    med = np.median(w, -1)
+    mad = 1.4826*np.median(np.abs(w-med[..., None]), -1)
+    return np.where(np.abs(x-med) > n_sigma*mad, med, x)
+
+
+def combine_median(x):
+    return np.median(x, 0)
+
+
+def combine_trimmed_mean(x, proportion=0.2):
+    """Mean of the sweeps without the proportion of lowest and highest
+    values at each point"""
+    return trim_mean(x, proportion, axis=0)
+
+
+class Pipeline(object):
+    """Chain of filters applied in order. A step is a function or a tuple
+    (function, dictionary of arguments).
+
+    Example:
+        Pipeline(hampel, (savgol, {'width':11}))
+    """
+
+    def __init__(self, *steps):
+        self.steps = [s if callable(s) else partial(s[0], **s[1])
+                      for s in steps]
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=float)
+        for f in self.steps:
+            x = f(x)
+        return x
@@ -1,8 +1,18 @@
 import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+from . import experiment as exp
 from .experiment import Experiment
 from .bees_fit import BEESFit
+from .batch_fit import fit_beesfit, _pad
+from .parallel import FitPool
+from .warm_start import Seeder, wavefronts
+from .cache import fit_cached
+from .sweep import sweep_fit
+from .uncertainty import bootstrap
+from . import instrument
 from copy import copy
+from time import time
 
 class Grid(Experiment):
 
@@ -21,12 +31,37 @@ class Grid(Experiment):
         self.ys=[]
         self.bees_dict=None
         self.beesfit_dict=dict()
+        self._index=None
+        self._indexed=None
+        self._index_len=0
+        self.channels=dict()
+        self.store=None
+        self.quality=None
+        self._version=0
+        self._quality_key=None
+        self.fit_stats=None
+        self._fit_pool=None
+
+    def __getstate__(self):
+        state=self.__dict__.copy()
+        state['_fit_pool']=None
+        state['_index']=None
+        state['_indexed']=None
+        ## the channels are views of the data of the bees
+        state['channels']=dict()
+        return state
+
+    def __setstate__(self,state):
+        ## grids saved by old versions miss the newer attributes
+        self.__dict__.update(Grid().__dict__)
+        self.__dict__.update(state)
 
     def __add__(self,other):
         ret=copy(self)
         ret.bees+=other.bees
         ret.beesfit+=other.beesfit
         ret.src_files+=other.src_files
+        ret._index=None
         
         return ret
 
@@ -36,47 +71,205 @@ class Grid(Experiment):
             b.set_id()
             self.beesfit_dict[b.id]=b
             b.parent=self
+        self._index=None
+        self._changed()
 
     def set_n(self,n):
         for b in self.beesfit:
             b.n=n
+        self._changed()
+
+    def _changed(self):
+        """Note that the fits of the grid changed (see fit_quality)"""
+        self._version+=1
+        self.quality=None
+
+
+    def append(self,bees):
+        """Add bees (with their indexes already set) to the grid and create
+        a BEESFit for each of them
+
+        Returns:
+            list. the new BEESFit
+        """
+        if self.bees_dict is None:
+            self.bees_dict=dict()
+        self.bees+=bees
+        new=[BEESFit(b) for b in bees]
+        for b in bees:
+            b.set_id()
+            b.parent=self
+            self.bees_dict[b.id]=b
+        for b in new:
+            b.set_id()
+            b.parent=self
+            self.beesfit_dict[b.id]=b
+        self.beesfit+=new
+        self._index=None
+        self._changed()
+        return new
+
+    def fit(self,threads=1,backend=None,chunksize=None,beesfit=None,
+            warm_start=False,**kwarg):
+        """Fit all the BEESFit of the grid
 
+        Args:
+            threads (int): number of process or threads (-1 for one per core)
+            backend (str): None to fit the curves one by one, 'process' to
+                fit them in a persistent pool of process (default if
+                threads!=1), 'batch' to fit all the curves together with
+                the batched Levenberg-Marquardt solver or 'threads' to run
+                the batched solver on chunks of curves in a pool of threads
+            chunksize (int): number of curves sent at once to a process or
+                a thread
+            beesfit (list): fit only these BEESFit (default: all)
+            warm_start (bool): fit the grid by wavefront, each curve starting
+                from its converged neighbours (see :mod:`warm_start`)
+            kwarg: passed to BEESFit.fit (or :func:`batch_fit.fit_beesfit`)
 
-    def fit(self,threads=1):
-        from time import time
+        When the instrumentation is enabled (:func:`instrument.enable`), the
+        summary of the events of the fit is kept in self.fit_stats.
+        """
+        if beesfit is None:
+            beesfit=self.beesfit
+        if backend is None and threads!=1:
+            backend='process'
+
+        if not instrument.enabled():
+            self._fit(beesfit,threads,backend,chunksize,warm_start,kwarg)
+            return
+        with instrument.collect() as stats:
+            self._fit(beesfit,threads,backend,chunksize,warm_start,kwarg)
+        self.fit_stats=stats.summary()
+
+    def _fit(self,beesfit,threads,backend,chunksize,warm_start,kwarg):
         t1=time()
-        if threads==1:
-            for x in self.beesfit:
-                x.fit_update()
+        with instrument.record('grid_fit',backend=backend,threads=threads,
+                               curves=len(beesfit)):
+            self._fit_all(beesfit,threads,backend,chunksize,warm_start,kwarg)
+        instrument.logger.info('fit of %d curves (backend %s) in %.3f s',
+                               len(beesfit),backend,time()-t1)
+
+    def _fit_all(self,beesfit,threads,backend,chunksize,warm_start,kwarg):
+        if warm_start:
+            seeder=Seeder(**dict((k,kwarg.pop(k)) for k in
+                    ['barrier_height','trans_a','noise'] if k in kwarg))
+            for front in wavefronts(beesfit):
+                init=[seeder.seed(b) for b in front]
+                self._fit_block(front,threads,backend,chunksize,init,kwarg)
+                seeder.add(front)
         else:
-            if threads==-1:
-                p=mp.Pool()
-            else:
-                p=mp.Pool(threads)
-            ## unlink the bees to prevent to pickle to big data
-            for x in self.beesfit:
-                x.parent = None
-                for y in x.data:
-                    y.parent = None
-            beesfit=p.map(fit_para,self.beesfit)
-            ## relink the bees
-            for x in self.beesfit:
-                x.parent = self
-                for y in x.data:
-                    y.parent = self
-            p.close()
-            for i in range(len(beesfit)):
-                self.beesfit[i].update(beesfit[i])
-        print(time()-t1)
+            self._fit_block(beesfit,threads,backend,chunksize,None,kwarg)
+        self._changed()
+
+    def _fit_block(self,beesfit,threads,backend,chunksize,init,kwarg):
+        """Fit a list of BEESFit with a backend of fit. init is None or the
+        initial values (dictionary) of each curve"""
+        if backend is None:
+            for i,x in enumerate(beesfit):
+                if init is None:
+                    x.fit_update(**kwarg)
+                else:
+                    x.fit_update(**dict(kwarg,**init[i]))
+            return
+
+        def fit(beesfit,init):
+            if backend=='batch':
+                fit_beesfit(beesfit,init=init,**kwarg)
+            elif backend=='process':
+                self.fit_pool(threads).fit(beesfit,chunksize,init=init,
+                                           **kwarg)
+            elif backend=='threads':
+                workers=mp.cpu_count() if threads==-1 else threads
+                size=chunksize
+                if size is None:
+                    size=max(1,min(2048,len(beesfit)//(4*workers)))
+                chunks=[(beesfit[i:i+size],
+                         None if init is None else init[i:i+size])
+                        for i in range(0,len(beesfit),size)]
+                with ThreadPoolExecutor(workers) as ex:
+                    list(ex.map(lambda x: fit_beesfit(x[0],init=x[1],
+                                                      **kwarg),chunks))
+        fit_cached(beesfit,init,kwarg,fit,
+                   'batch' if backend in ['batch','threads'] else 'minpack')
+
+    def fit_sweep(self,n=[2],range=[0.4],conv_ratio=[1],beesfit=None,
+                  threads=1,chunksize=2048,**kwarg):
+        """Fit the grid for every setting of the cartesian set of n, range
+        and conv_ratio in one job, each setting starting from the solution of
+        its neighbour. The BEESFit are not modified.
+
+        Args:
+            n, range, conv_ratio (list): values of the settings
+            beesfit (list): fit only these BEESFit (default: all)
+            threads (int): number of threads (-1 for one per core)
+            chunksize (int): number of curves fitted together
+            kwarg: initial values and auto range parameters (see
+                :func:`sweep.sweep_fit`)
+
+        Returns:
+            dict. result cube (setting x curve), see :func:`sweep.sweep_fit`
+        """
+        if beesfit is None:
+            beesfit=self.beesfit
+        return sweep_fit(beesfit,n,range,conv_ratio,chunk=chunksize,
+                         threads=threads,**kwarg)
+
+    def fit_uncertainty(self,method='residual',beesfit=None,**kwarg):
+        """Estimate the errors of the fitted BEESFit by resampling, in
+        their barrier_height_err_boot and trans_a_err_boot (barrier_height_err
+        and trans_a_err, used by fit_quality and the exports, keep the
+        covariance-based values)
+
+        Args:
+            method (str): 'residual' (bootstrap) or 'montecarlo'
+            beesfit (list): use only these BEESFit (default: all)
+            kwarg: see :func:`uncertainty.bootstrap`
+
+        Returns:
+            dict. see :func:`uncertainty.bootstrap`
+        """
+        if beesfit is None:
+            beesfit=self.beesfit
+        self._changed()
+        return bootstrap(beesfit,method,**kwarg)
 
+    def fit_pool(self,threads=-1):
+        """Return the pool of process used by fit (created if needed)"""
+        processes=None if threads==-1 else threads
+        pool=getattr(self,'_fit_pool',None)
+        if pool is None or pool.processes!=processes:
+            self.close_pool()
+            self._fit_pool=FitPool(processes)
+        return self._fit_pool
+
+    def close_pool(self):
+        if getattr(self,'_fit_pool',None) is not None:
+            self._fit_pool.close()
+        self._fit_pool=None
+
+
+    @property
+    def columnar(self):
+        """True if the bees are the curves of self.store (then the grid
+        methods work on the arrays of the store)"""
+        return self.store is not None and len(self.bees)==len(self.store)
 
     def set_coord(self):
-        self.xs = np.unique(filter(lambda x: not(x==None),
-                            [b.pos_x for b in self.bees]))
-        self.ys = np.unique(filter(lambda x: not(x==None),
-                            [b.pos_y for b in self.bees]))
+        if self.columnar:
+            self.xs = np.unique(self.store.pos_x[~np.isnan(self.store.pos_x)])
+            self.ys = np.unique(self.store.pos_y[~np.isnan(self.store.pos_y)])
+            return
+        self.xs = np.unique(list(filter(lambda x: not(x==None),
+                            [b.pos_x for b in self.bees])))
+        self.ys = np.unique(list(filter(lambda x: not(x==None),
+                            [b.pos_y for b in self.bees])))
 
     def set_indexes(self):
+        if self.columnar:
+            self.store.x_index[:]=np.searchsorted(self.xs,self.store.pos_x)
+            self.store.y_index[:]=np.searchsorted(self.ys,self.store.pos_y)
+            return
         x_len=np.array(range(len(self.xs)))
         y_len=np.array(range(len(self.ys)))
         for b in self.bees:
@@ -84,6 +277,17 @@ class Grid(Experiment):
             b.y_index=y_len[self.ys==b.pos_y][0]
 
     def set_pass_number(self):
+        if self.columnar:
+            ## the curves of a store share the date: keep the order of the rows
+            s=self.store
+            keys=(s.x_index,s.y_index,s.number,s.mode)
+            order=np.lexsort((np.arange(len(s)),)+keys[::-1])
+            new=np.ones(len(s),dtype=bool)
+            for k in keys:
+                new[1:]|=k[order][1:]!=k[order][:-1]
+            start=np.maximum.accumulate(np.where(new,np.arange(len(s)),0))
+            s.pass_number[order]=np.arange(len(s))-start+1
+            return
         dic=dict()
         for b in self.bees:
             b.pass_number=1
@@ -107,8 +311,12 @@ class Grid(Experiment):
         self.set_pass_number()
         self.num_x=len(self.xs)
         self.num_y=len(self.ys)
-        self.num_sweep=max([x.number for x in self.bees])
-        self.num_pass=max([x.pass_number for x in self.bees])
+        if self.columnar:
+            self.num_sweep=self.store.number.max()
+            self.num_pass=self.store.pass_number.max()
+        else:
+            self.num_sweep=max([x.number for x in self.bees])
+            self.num_pass=max([x.pass_number for x in self.bees])
         self.bees_dict=dict()
         for b in self.bees:
             b.set_id()
@@ -122,12 +330,229 @@ class Grid(Experiment):
             b.set_id()
             b.parent=self
             self.beesfit_dict[b.id]=b
+        self._index=None
+
+    @property
+    def index(self):
+        """Dense index of the BEESFit of one curve: index[x_index, y_index,
+        pass_number, number, mode] is their position in beesfit (-1 if there
+        is none). Built from the ids when needed, and again if beesfit is
+        replaced or changes length."""
+        if self._index is None or self._indexed is not self.beesfit or \
+                self._index_len!=len(self.beesfit):
+            keys=[(i,)+b.id.bees[0].key for i,b in enumerate(self.beesfit)
+                  if b.id is not None and len(b.id.bees)==1 and
+                  b.id.bees[0] is not None]
+            keys=np.array(keys,dtype=int).reshape(-1,6)
+            keys=keys[np.all(keys[:,1:]>=0,1)]
+            index=-np.ones(tuple(keys[:,1:].max(0)+1) if len(keys) else
+                           (0,)*5,dtype=int)
+            index[tuple(keys[:,1:].T)]=keys[:,0]
+            self._index=index
+            self._indexed=self.beesfit
+            self._index_len=len(self.beesfit)
+        return self._index
+
+    def at(self,key):
+        """Return the BEESFit of one curve at key=(x_index, y_index,
+        pass_number, number, mode) of the index (None if there is none)"""
+        if min(key)<0:
+            return None
+        for retry in [False,True]:
+            if retry:
+                ## beesfit was modified in place: build the index again
+                self._index=None
+            try:
+                i=self.index[key]
+            except IndexError:
+                return None
+            if i<0:
+                return None
+            b=self.beesfit[i] if i<len(self.beesfit) else None
+            if b is not None and b.id is not None and len(b.id.bees)==1 \
+                    and getattr(b.id.bees[0],'key',None)==key:
+                return b
+        return None
+
+    def find(self,bid):
+        """Return the BEESFit with the id bid (None if there is none)"""
+        if len(bid.bees)==1:
+            b=self.at(bid.bees[0].key)
+            if b is not None and b.id==bid:
+                return b
+        return self.beesfit_dict.get(bid)
+
+
+    def stack(self,attribute,beesfit=None):
+        """Return an attribute of every BEESFit as a (curves x points) array
+
+        Args:
+            attribute (str): name of the attribute (e.g.: 'bias', 'i_beem')
+            beesfit (list): BEESFit to use (default: all of self.beesfit)
+        """
+        if beesfit is None:
+            beesfit=self.beesfit
+        return _pad([getattr(b,attribute) for b in beesfit])
+
+    def params(self,beesfit=None):
+        """Return the fitted parameters as a (curves x parameters) array.
+        Curves not fitted (or with less barrier heights) are padded with NaN
+        """
+        if beesfit is None:
+            beesfit=self.beesfit
+        nbh=max(len(b.barrier_height) for b in beesfit)
+        params=np.empty((len(beesfit),1+2*nbh))
+        params[:]=np.nan
+        for i,b in enumerate(beesfit):
+            if b.barrier_height[0] is None:
+                continue
+            k=len(b.barrier_height)
+            params[i,0]=b.noise
+            params[i,1:k+1]=b.barrier_height
+            params[i,1+nbh:1+nbh+k]=b.trans_a
+        return params
+
+    def estimate(self,beesfit=None,fitted=False,out=None):
+        """Evaluate the fitted model of all the curves in one batched call
+
+        Args:
+            beesfit (list): BEESFit to use (default: all of self.beesfit)
+            fitted (bool): set to NaN the points outside the fit window
+            out (ndarray): preallocated (curves x points) array for the result
 
+        Returns:
+            ndarray. BEEM current estimated, one row per curve
+        """
+        if beesfit is None:
+            beesfit=self.beesfit
+        bias=self.stack('bias',beesfit)
+        out=self._model(bias,self.params(beesfit),beesfit,out)
+        if fitted:
+            out[~self._window(bias,beesfit)]=np.nan
+        return out
+
+    def residu(self,beesfit=None,fitted=False,out=None):
+        """Return the residu of the fitted model of all the curves
+
+        See :meth:`estimate` for the arguments.
+        """
+        if beesfit is None:
+            beesfit=self.beesfit
+        out=self.estimate(beesfit,fitted,out)
+        out-=self.stack('i_beem',beesfit)
+        return out
+
+    @staticmethod
+    def _model(bias,params,beesfit,out=None):
+        if out is None:
+            out=np.empty(bias.shape)
+        n=np.array([b.n for b in beesfit],dtype=float)
+        if np.all(n==n[0]):
+            exp.bell_kaiser_v_batch(bias,n[0],params,out)
+        else:
+            for x in np.unique(n):
+                i=n==x
+                out[i]=exp.bell_kaiser_v_batch(bias[i],x,params[i])
+        return out
+
+    @staticmethod
+    def _window(bias,beesfit):
+        bias_min=np.array([b.bias_min for b in beesfit],dtype=float)
+        bias_max=np.array([b.bias_max for b in beesfit],dtype=float)
+        return np.logical_and(bias>=bias_min[:,None],bias<=bias_max[:,None])
+
+    def prefilter(self,pipeline=None,combine=None,beesfit=None,
+                  attributes=['i_beem']):
+        """Set the filter (and the combine function) of the BEESFit and
+        compute the cleaned arrays of all the curves at once. They are cached
+        in the BEESFit until its data, filter or combine change.
+
+        Args:
+            pipeline: filter working on (curves x points) arrays (e.g.
+                :class:`filters.Pipeline`)
+            combine: combine function reducing the first axis (e.g.
+                :func:`filters.combine_median`), None to keep the current one
+            beesfit (list): BEESFit to filter (default: all)
+            attributes (list): arrays to compute
+        """
+        if beesfit is None:
+            beesfit=self.beesfit
+        groups=dict()
+        for b in beesfit:
+            b.filter=pipeline
+            if combine is not None:
+                b.combine=combine
+            groups.setdefault((len(b.data),len(b.bias),b.combine),[]).append(b)
+
+        for (k,m,comb),group in groups.items():
+            for x in attributes:
+                data=np.array([[getattr(t,x) for t in b.data] for b in group],
+                              dtype=float)
+                if k>1:
+                    data=comb(np.swapaxes(data,0,1))
+                else:
+                    data=data[:,0]
+                if pipeline is not None:
+                    data=pipeline(data)
+                for b,row in zip(group,data):
+                    b._prime(x,row)
+        self._changed()
+
+    def fit_quality(self,update=False,chunk=4096):
+        """Compute the quality of the fit of all the BEESFit in batched passes
+        and keep it in self.quality until the grid is fitted, prefiltered,
+        appended to or one of its BEESFit updated (BEESFit.update). Use
+        update=True after changing a BEESFit or its data in place.
+
+        Args:
+            update (bool): compute it again even if already known
+            chunk (int): number of curves evaluated at once
+
+        Returns:
+            dict. one array (value for each BEESFit) for: r_squared, chi2
+            (sum of the squared residu over the degrees of freedom), rms (of
+            the residu), barrier_height_ratio and trans_a_ratio (relative
+            error of the first barrier). NaN for the curves not fitted.
+        """
+        key=(self._version,len(self.beesfit))
+        if not update and self.quality is not None and \
+                key==self._quality_key:
+            return self.quality
+        q=dict((x,np.empty(len(self.beesfit))) for x in
+               ['r_squared','chi2','rms','barrier_height_ratio',
+                'trans_a_ratio'])
+        for s in range(0,len(self.beesfit),chunk):
+            block=self.beesfit[s:s+chunk]
+            params=self.params(block)
+            bias=self.stack('bias',block)
+            y=self.stack('i_beem',block)
+            res=self._model(bias,params,block)-y
+            w=self._window(bias,block)&~np.isnan(res)
+            y=np.where(w,y,0)
+            res[~w]=0
+            points=w.sum(1)
+            nb=(params.shape[1]-1)//2
+            with np.errstate(divide='ignore',invalid='ignore'):
+                sse=np.sum(res**2,1)
+                mean=y.sum(1)/points
+                sst=np.sum(np.where(w,y-mean[:,None],0)**2,1)
+                dof=points-np.sum(~np.isnan(params),1)
+                err=np.array([[b.barrier_height_err[0],b.trans_a_err[0]]
+                              for b in block],dtype=float)
+                val={'r_squared':1-sse/sst,
+                     'chi2':np.where(dof>0,sse/dof,np.nan),
+                     'rms':np.sqrt(sse/points),
+                     'barrier_height_ratio':np.abs(err[:,0]/params[:,1]),
+                     'trans_a_ratio':np.abs(err[:,1]/params[:,nb+1])}
+            fitted=~np.isnan(params[:,1])
+            for x in q:
+                q[x][s:s+chunk]=np.where(fitted,val[x],np.nan)
+        self.quality=q
+        self._quality_key=key
+        return q
 
     def extract_good(self,r_squared=0.6):
         fit=np.array(self.beesfit)
-        r=np.array([x.r_squared for x in fit])
-        return fit[np.logical_and(r>r_squared,r<1)]
-
-def fit_para(x):
-    return x.fit()
+        r=self.fit_quality()['r_squared']
+        with np.errstate(invalid='ignore'):
+            return fit[np.logical_and(r>r_squared,r<1)]
@@ -0,0 +1,116 @@
+"""Module that implement the columnar storage of the curves of a grid"""
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from .bees_data import StoredBEESData
+
+class GridStore(object):
+    """Store the BEES curves of a grid as arrays instead of one BEESData per
+    curve.
+
+    The channels (bias, i_beem, i_tunnel and pos_z) are arrays of shape
+    (positions x sweeps x points) where sweeps is the number of curves
+    measured at each position (e.g.: forward and backward), so they can be
+    strided views of the raw data. Curve number r is [r//sweeps, r%sweeps].
+    The indexes (x_index, y_index, pass_number, number, mode, pos_x, pos_y)
+    are arrays with one value per curve.
+
+    Only the BEESData are views of the store. A BEESFit may combine or filter
+    several curves and holds per-curve fit state (number of barriers,
+    memoized arrays, errors): it stays an object, and the batched code
+    stacks its parameters when needed (see Grid.params and Grid.stack).
+    """
+
+    CHANNELS = ['bias', 'i_beem', 'i_tunnel', 'pos_z']
+    INDEXES = ['x_index', 'y_index', 'pass_number', 'number', 'mode',
+               'pos_x', 'pos_y']
+
+    def __init__(self, bias, i_beem, i_tunnel, pos_z, mode, number=1,
+                 pos_x=np.nan, pos_y=np.nan, date=None, src_files=None,
+                 sample=None, device=None):
+        """
+        Args:
+            bias, i_beem, i_tunnel, pos_z (ndarray): channels with shape
+                (positions x sweeps x points) or (curves x points)
+            mode, number, pos_x, pos_y: value for each curve (or for all)
+            date: date of all the curves or an object array with one date
+                for each curve
+        """
+        self.bias = self._as_3d(bias)
+        self.i_beem = self._as_3d(i_beem)
+        self.i_tunnel = self._as_3d(i_tunnel)
+        self.pos_z = self._as_3d(pos_z)
+        self.sweeps = self.bias.shape[1]
+        size = len(self)
+        self.mode = self._column(mode, size, int)
+        self.number = self._column(number, size, int)
+        self.pos_x = self._column(pos_x, size, float)
+        self.pos_y = self._column(pos_y, size, float)
+        self.pass_number = self._column(-1, size, int)
+        self.x_index = self._column(-1, size, int)
+        self.y_index = self._column(-1, size, int)
+        self.date = date
+        self.src_files = src_files
+        self.sample = sample
+        self.device = device
+
+    @staticmethod
+    def _as_3d(x):
+        if x is None:
+            return None
+        if x.ndim == 2:
+            return x[:, None, :]
+        return x
+
+    @staticmethod
+    def _column(x, size, dtype):
+        out = np.empty(size, dtype=dtype)
+        out[:] = x
+        return out
+
+    def __len__(self):
+        return self.bias.shape[0]*self.bias.shape[1]
+
+    def get(self, name, row):
+        x = getattr(self, name)
+        if name in self.CHANNELS:
+            if x is None:
+                return None
+            return x[row//self.sweeps, row % self.sweeps]
+        return x[row]
+
+    def set(self, name, row, value):
+        if name in self.CHANNELS:
+            getattr(self, name)[row//self.sweeps, row % self.sweeps] = value
+        else:
+            getattr(self, name)[row] = value
+
+    def array(self, name):
+        """Return a channel as a (curves x points) array (a copy if the
+        channel is a strided view)"""
+        x = getattr(self, name)
+        return x.reshape(-1, x.shape[-1])
+
+    def views(self):
+        """Return a StoredBEESData for each curve"""
+        return [StoredBEESData(self, i) for i in range(len(self))]
+
+    @staticmethod
+    def interleave(data, first, other):
+        """Return a (rows x sweeps x points) view of the 2-D array data where
+        sweep k of each row is the slice data[:, first[k]:first[k]+points].
+        It's a copy only if the slices are not equally spaced.
+
+        Args:
+            data (ndarray): raw data, one row per position
+            first (list): index of the first column of each sweep
+            other (int): number of points
+        """
+        step = np.diff(first)
+        if len(first) == 1 or np.all(step == step[0]):
+            s = data[:, first[0]:]
+            return as_strided(s, shape=(data.shape[0], len(first), other),
+                    strides=(s.strides[0], (step[0] if len(step) else 0)*
+                             s.strides[1], s.strides[1]))
+        return np.stack([data[:, f:f+other] for f in first], 1)
@@ -0,0 +1,175 @@
+"""Module to instrument the fit pipeline. The code counts events (function
+evaluations, iterations, window expansions, exceptions...) with :func:`count`
+inside units of work opened by :func:`record` (the fit of a curve, the fit of
+a grid, the loading of a file). When a unit ends, an event (dictionary with
+its name, duration and counters) is sent to the hooks and to the logger
+'beem' at the DEBUG level.
+
+The instrumentation is disabled by default (the calls are then almost free),
+see :func:`enable`. :func:`collect` aggregates the events of a block of code:
+
+    enable()
+    with collect() as stats:
+        grid.fit()
+    stats.summary()
+
+The events of the workers of the 'process' backend are not collected.
+"""
+
+import functools
+import logging
+import threading
+import time
+from collections import Counter
+import numpy as np
+
+logger = logging.getLogger('beem')
+
+_enabled = False
+_hooks = []
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def enable(val=True):
+    """Enable (or disable) the instrumentation"""
+    global _enabled
+    _enabled = val
+
+
+def enabled():
+    return _enabled
+
+
+def add_hook(func):
+    """Call func(event) at the end of each unit of work"""
+    with _lock:
+        _hooks.append(func)
+
+
+def remove_hook(func):
+    with _lock:
+        if func in _hooks:
+            _hooks.remove(func)
+
+
+def count(name, value=1):
+    """Add value to a counter of the current unit of work"""
+    if _enabled:
+        stack = getattr(_local, 'stack', None)
+        if stack:
+            stack[-1].counters[name] += value
+
+
+class _Null(object):
+    counters = Counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL = _Null()
+
+
+class _Record(object):
+
+    def __init__(self, name, info):
+        self.name = name
+        self.info = info
+        self.counters = Counter()
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter()-self.start
+        stack = _local.stack
+        stack.pop()
+        if exc_type is not None:
+            self.counters['exception.'+exc_type.__name__] += 1
+        if stack:
+            stack[-1].counters.update(self.counters)
+
+        event = dict(self.info)
+        event.update({'name':self.name, 'time':duration,
+                      'counters':dict(self.counters)})
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('%s %.6f s %s', self.name, duration, event['counters'])
+        for h in list(_hooks):
+            h(event)
+        return False
+
+
+def record(name, **info):
+    """Context manager for a unit of work, info is added to the event"""
+    if not _enabled:
+        return _NULL
+    return _Record(name, info)
+
+
+def recorded(name):
+    """Decorator running a function in a unit of work"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*arg, **kwarg):
+            with record(name):
+                return func(*arg, **kwarg)
+        return wrapper
+    return decorator
+
+
+class Stats(object):
+    """Events collected by :func:`collect`"""
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    def summary(self, bins=10):
+        """Aggregate the events by name
+
+        Returns:
+            dict. for each event name: the number of events and for the time
+            and each counter a dictionary with total, mean, max and the
+            histogram (counts, bin edges) over the events
+        """
+        out = dict()
+        for name in sorted(set(e['name'] for e in self.events)):
+            events = [e for e in self.events if e['name'] == name]
+            keys = set(k for e in events for k in e['counters'])
+            res = {'count':len(events)}
+            values = dict((k, np.array([e['counters'].get(k, 0)
+                                        for e in events])) for k in keys)
+            values['time'] = np.array([e['time'] for e in events])
+            for k, v in values.items():
+                h, edges = np.histogram(v, bins)
+                res[k] = {'total':float(v.sum()), 'mean':float(v.mean()),
+                          'max':float(v.max()), 'histogram':(h.tolist(),
+                                                             edges.tolist())}
+            out[name] = res
+        return out
+
+
+class collect(object):
+    """Context manager collecting the events of a block of code in a
+    :class:`Stats`"""
+
+    def __enter__(self):
+        self.stats = Stats()
+        add_hook(self.stats)
+        return self.stats
+
+    def __exit__(self, *exc):
+        remove_hook(self.stats)
+        return False
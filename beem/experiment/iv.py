@@ -1,9 +1,10 @@
 import numpy as np
-import scipy.optimize as op
 import scipy.constants as constants
 
-from .experiment import Experiment
-from .experiment import r_squared
+from .experiment import Experiment, MODE
+from .batch_fit import _pad
+
+KB = constants.physical_constants['Boltzmann constant in eV/K'][0]
 
 class IV(Experiment):
 
@@ -17,11 +18,12 @@ class IV(Experiment):
         self.W = np.pi*2.5e-4**2
         self.n = 0
         self.barrier_height = 0
+        self.n_err = np.inf
+        self.barrier_height_err = np.inf
         self.r_squared = 0
         self.Vmax = 0
         self.Vmin = 0
-        self.KbT = constants.physical_constants['Boltzmann constant in eV/K'][0]\
-                *self.T
+        self.KbT = KB*self.T
         self.Is = self.A*self.W*self.T**2
 
     @property
@@ -44,11 +46,127 @@ class IV(Experiment):
     def _model_fit(self,V,Vbh,n):
         return np.log(np.abs(IV.schottky_richardson(V,Vbh,n,self.Is,self.KbT)))
 
-    def fit(self,Vbh_init=0.8,n_init=1.0):
-        popt,pconv=op.curve_fit(self._model_fit,self.V_fitted,
-                np.log(np.abs(self.I_fitted)),[Vbh_init,n_init])
-        self.barrier_height = popt[0]
-        self.n = popt[1]
-        self.r_squared = r_squared(np.log(np.abs(self.I_fitted)),
-                self._model_fit(self.V_fitted,popt[0],popt[1]))
+    def fit(self,Vbh_init=None,n_init=None):
+        """Fit the curve in its window (see :func:`fit_iv`). The initial
+        values default to the closed-form ones instead of 0.8 and 1.0: ln|I|
+        is linear in 1/n so the minimum found is the same"""
+        fit_iv([self],Vbh_init,n_init)
+
+
+def _guess(V, z, mask):
+    """Closed-form least squares of z=c0+c1*V on the points of mask of each
+    row, return c0 and c1"""
+    w = mask.astype(float)
+    num = w.sum(1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mv = np.sum(w*V, 1)/num
+        mz = np.sum(w*z, 1)/num
+        dv = np.where(mask, V-mv[:, None], 0)
+        c1 = np.sum(dv*np.where(mask, z, 0), 1)/np.sum(dv**2, 1)
+    return mz-c1*mv, c1
+
+
+def fit_iv(ivs, Vbh_init=None, n_init=None, maxIt=20, tol=1e-10):
+    """Fit ln|I| of many IV curves (in their window) with the
+    Schottky-Richardson model at once and update them with the result.
+
+    Without the known term ln(Is)+ln|1-exp(-V/KbT)|, ln|I| is linear in V
+    (slope 1/(n*KbT), intercept -Vbh/KbT): the initial values come from the
+    closed-form linear least squares of each curve, then all the curves are
+    refined together by Gauss-Newton with the analytic Jacobian (which also
+    gives the errors).
+
+    Args:
+        ivs (list): IV to fit
+        Vbh_init, n_init (float): initial values (None for the closed-form
+            ones)
+        maxIt (int): maximum number of Gauss-Newton iterations
+        tol (float): relative change of the parameters to stop
+
+    Returns:
+        dict. one array (value for each IV) for: barrier_height, n, their
+        errors (barrier_height_err, n_err), r_squared and points (number of
+        points fitted). NaN for the curves which could not be fitted.
+    """
+    c = len(ivs)
+    if not c:
+        return dict((x, np.empty(0)) for x in
+                    ['barrier_height', 'n', 'barrier_height_err', 'n_err',
+                     'r_squared', 'points'])
+    V = _pad([x.V_fitted for x in ivs])
+    I = _pad([x.I_fitted for x in ivs])
+    KbT = np.array([x.KbT for x in ivs], dtype=float)[:, None]
+    Is = np.array([x.Is for x in ivs], dtype=float)[:, None]
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        y = np.log(np.abs(I))
+        ## known part of the model
+        known = np.log(Is)+np.log(np.abs(1-np.exp(-V/KbT)))
+    mask = np.isfinite(y) & np.isfinite(known)
+    V = np.where(mask, V, 0)
+    z = np.where(mask, y-known, 0)
+
+    ## z=-Vbh/KbT+V/(n*KbT) is linear in V
+    c0, c1 = _guess(V, z, mask)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Vbh = -c0*KbT[:, 0]
+        n = 1/(c1*KbT[:, 0])
+    if Vbh_init is not None:
+        Vbh[:] = Vbh_init
+    if n_init is not None:
+        n[:] = n_init
+
+    ## Gauss-Newton, the residu is r=z+Vbh/KbT-V/(n*KbT)
+    active = np.flatnonzero(np.isfinite(Vbh) & np.isfinite(n) & (n != 0))
+    for i in range(maxIt):
+        if not len(active):
+            break
+        k = KbT[active]
+        m = mask[active]
+        Va = V[active]
+        r = np.where(m, z[active]+Vbh[active, None]/k-
+                     Va/(n[active, None]*k), 0)
+        ## jacobian of r: d/dVbh=1/KbT and d/dn=V/(n^2*KbT)
+        jb = np.where(m, 1/k, 0)
+        jn = np.where(m, Va/(n[active, None]**2*k), 0)
+        a11, a12, a22 = np.sum(jb*jb, 1), np.sum(jb*jn, 1), np.sum(jn*jn, 1)
+        g1, g2 = np.sum(jb*r, 1), np.sum(jn*r, 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            det = a11*a22-a12**2
+            d_bh = -(a22*g1-a12*g2)/det
+            d_n = -(a11*g2-a12*g1)/det
+        Vbh[active] += d_bh
+        n[active] += d_n
+        with np.errstate(invalid='ignore'):
+            done = ~np.isfinite(det) | (det == 0) | \
+                    ((np.abs(d_bh) <= tol*np.abs(Vbh[active])) &
+                     (np.abs(d_n) <= tol*np.abs(n[active])))
+        active = active[~done]
+
+    ## errors and r_squared of ln|I|
+    points = mask.sum(1)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        r = np.where(mask, z+Vbh[:, None]/KbT-V/(n[:, None]*KbT), 0)
+        sse = np.sum(r**2, 1)
+        mean = np.sum(np.where(mask, y, 0), 1)/points
+        sst = np.sum(np.where(mask, y-mean[:, None], 0)**2, 1)
+        jb = np.where(mask, 1/KbT, 0)
+        jn = np.where(mask, V/(n[:, None]**2*KbT), 0)
+        a11, a12, a22 = np.sum(jb*jb, 1), np.sum(jb*jn, 1), np.sum(jn*jn, 1)
+        det = a11*a22-a12**2
+        s_sq = sse/(points-2)
+        res = {'barrier_height':Vbh, 'n':n,
+               'barrier_height_err':np.sqrt(a22/det*s_sq),
+               'n_err':np.sqrt(a11/det*s_sq),
+               'r_squared':1-sse/sst,
+               'points':points}
+    failed = ~(np.isfinite(Vbh) & np.isfinite(n)) | (points < 2)
+    for x in ['barrier_height', 'n', 'r_squared']:
+        res[x][failed] = np.nan
+    for x in ['barrier_height_err', 'n_err']:
+        res[x][failed | (points <= 2) | ~np.isfinite(res[x])] = np.inf
 
+    for i, x in enumerate(ivs):
+        for k in ['barrier_height', 'n', 'barrier_height_err', 'n_err',
+                  'r_squared']:
+            setattr(x, k, res[k][i])
+    return res
@@ -7,6 +7,7 @@ import numpy as np
 from scipy.linalg.lapack import get_lapack_funcs
 from scipy.linalg import calc_lwork
 from numpy.linalg import LinAlgError
+from . import instrument
 getrf, getri = get_lapack_funcs(('getrf','getri'), (np.eye(3),))
 
 def inv(a):
@@ -25,11 +26,22 @@ def inv(a):
     return inv_a
 
 
-def leastsq(func,p0,args,full_output):
+def leastsq(func,p0,args,full_output,Dfun=None):
+    """Minimize the sum of squares of func. If Dfun is given, it must return
+    the jacobian of func with one row per parameter (col_deriv) and MINPACK
+    lmder is used instead of the finite differences of lmdif.
+    """
     n=len(p0)
-    retval = op._minpack._lmdif(func, p0, args, 1, 1.49012e-8, 1.49012e-8,
-                                 0.0, 2000, 1.49012e-8, 100.0, None)
+    if Dfun is None:
+        retval = op._minpack._lmdif(func, p0, args, 1, 1.49012e-8, 1.49012e-8,
+                                     0.0, 2000, 1.49012e-8, 100.0, None)
+    else:
+        retval = op._minpack._lmder(func, Dfun, p0, args, 1, 1, 1.49012e-8,
+                                     1.49012e-8, 0.0, 2000, 100.0, None)
     info = retval[-1]
+    instrument.count('leastsq')
+    instrument.count('nfev', retval[1]['nfev'])
+    instrument.count('njev', retval[1].get('njev', 0))
     cov_x = None
     if info in [1, 2, 3, 4]:
         perm = np.take(np.eye(n), retval[1]['ipvt'] - 1, 0)
@@ -41,3 +53,113 @@ def leastsq(func,p0,args,full_output):
             pass
     return retval[0], cov_x
 
+
+def leastsq_batch(func, Dfun, p0, args=(), mask=None, ftol=1.49012e-8,
+                  xtol=1.49012e-8, maxiter=200):
+    """Levenberg-Marquardt minimisation of many independent problems at once.
+
+    Every problem (curve) keeps its own damping and convergence state and the
+    converged problems are dropped from the active set, so each iteration
+    only costs one batched call of func and Dfun on the remaining curves.
+
+    Args:
+        func (callable): func(p, *args) return the residu (curves x points)
+        Dfun (callable): Dfun(p, *args) return the jacobian
+            (curves x parameters x points)
+        p0 (ndarray): initial parameters (curves x parameters)
+        args (tuple): extra arguments, arrays with one row per curve are
+            sliced with the active curves, everything else is passed as is
+        mask (ndarray): points used by the fit (curves x points)
+
+    Returns:
+        tuple. (popt, cov_x, cost, info) with the unscaled covariance as
+        in :func:`leastsq` (NaN when singular), the sum of squares, and
+        info=1 for converged curves, 0 if maxiter was reached and -1 for
+        curves that diverged.
+    """
+    p = np.array(p0, dtype=float)
+    c, n = p.shape
+    args = tuple(args)
+    if mask is None:
+        mask = np.ones(np.shape(func(p, *args)), dtype=bool)
+
+    def take(idx):
+        return tuple(x[idx] if isinstance(x, np.ndarray) and x.ndim > 0 and
+                     len(x) == c else x for x in args)
+
+    def residu(pa, idx):
+        return np.where(mask[idx], func(pa, *take(idx)), 0)
+
+    def jacobian(pa, idx):
+        return np.where(mask[idx][:, None, :], Dfun(pa, *take(idx)), 0)
+
+    info = np.zeros(c, dtype=int)
+    lam = np.ones(c)*1e-3
+    r = residu(p, np.arange(c))
+    cost = np.sum(r**2, 1)
+    info[~np.isfinite(cost)] = -1
+    active = np.flatnonzero(info == 0)
+
+    instrument.count('nfev', c)
+    for it in range(maxiter):
+        if not len(active):
+            break
+        instrument.count('iterations')
+        instrument.count('njev', len(active))
+        J = jacobian(p[active], active)
+        A = np.einsum('ipm,iqm->ipq', J, J)
+        g = np.einsum('ipm,im->ip', J, r[active])
+        d = np.diagonal(A, 0, 1, 2).copy()
+        d[d <= 0] = 1
+
+        #Increase the damping of the curves until the step reduce the cost
+        pending = np.arange(len(active))
+        for k in range(10):
+            idx = active[pending]
+            M = A[pending] + lam[idx, None, None]*d[pending, :, None]*np.eye(n)
+            try:
+                delta = -np.linalg.solve(M, g[pending, :, None])[:, :, 0]
+            except LinAlgError:
+                delta = np.array([-np.linalg.lstsq(x, y, rcond=None)[0]
+                                  for x, y in zip(M, g[pending])])
+            p_new = p[idx] + delta
+            r_new = residu(p_new, idx)
+            instrument.count('nfev', len(idx))
+            cost_new = np.sum(r_new**2, 1)
+            ok = cost_new <= cost[idx]
+
+            good = idx[ok]
+            red = cost[good] - cost_new[ok]
+            small = np.logical_or(red <= ftol*cost[good],
+                    np.all(np.abs(delta[ok]) <= xtol*np.abs(p_new[ok]), 1))
+            p[good] = p_new[ok]
+            r[good] = r_new[ok]
+            cost[good] = cost_new[ok]
+            lam[good] /= 10
+            lam[idx[~ok]] *= 10
+            info[good[small]] = 1
+            pending = pending[~ok]
+            if not len(pending):
+                break
+
+        #No step could reduce the cost: it's a minimum
+        info[active[pending]] = np.where(info[active[pending]] == 0, 1,
+                                         info[active[pending]])
+        active = np.flatnonzero(info == 0)
+
+    #Covariance from the jacobian at the solution
+    cov_x = np.empty((c, n, n))
+    cov_x[:] = np.nan
+    idx = np.flatnonzero(info >= 0)
+    if len(idx):
+        J = jacobian(p[idx], idx)
+        A = np.einsum('ipm,iqm->ipq', J, J)
+        try:
+            cov_x[idx] = np.linalg.inv(A)
+        except LinAlgError:
+            for i, a in zip(idx, A):
+                try:
+                    cov_x[i] = inv(a)
+                except (LinAlgError, ValueError):
+                    pass
+    return p, cov_x, cost, info
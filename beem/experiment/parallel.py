@@ -0,0 +1,177 @@
+"""Module to fit the curves of a grid in a pool of process. The data sit once
+in shared memory: the workers only receive curve indices and fit settings and
+send back one compact record per curve. The shared memory is kept by the pool
+and only rebuilt when the curves to fit change.
+"""
+
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+from .bees_data import BEESData
+from .bees_fit import BEESFit
+
+#Settings of BEESFit sent to the workers
+SETTINGS = ['n', 'method', 'auto_range', 'range', 'bias_min', 'bias_max']
+
+#Shared memory attached in the worker process
+_attached = {}
+
+
+def _address(x):
+    """Identify the memory of an array (its content is not compared)"""
+    return (x.__array_interface__['data'][0], x.shape, x.strides)
+
+
+class FitPool(object):
+    """Persistent pool of process to fit BEESFit. The pool and the shared
+    memory holding the curves are created at the first fit and reused until
+    :meth:`close` is called. The shared memory is copied again when other
+    curves are fitted; call :meth:`release` after modifying the data of the
+    curves in place.
+    """
+
+    def __init__(self, processes=None, chunksize=64):
+        """
+        Kwargs:
+            processes (int): number of process (None for one per core)
+            chunksize (int): number of curves sent at once to a worker
+        """
+        self.processes = processes
+        self.chunksize = chunksize
+        self._pool = None
+        self._shm = None
+        self._curves = None
+        self._key = None
+
+    def __getstate__(self):
+        raise TypeError('FitPool can not be pickled')
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = mp.Pool(self.processes)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        self.release()
+
+    def release(self):
+        """Free the shared memory holding the curves"""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+            self._curves = None
+            self._key = None
+
+    def _share(self, beesfit):
+        """Return the shared memory, its shape and the length of the curves
+        of beesfit, copying them only if they are not already shared"""
+        curves = [(b.bias, b.i_beem) for b in beesfit]
+        key = [(_address(x), _address(y)) for x, y in curves]
+        if self._shm is None or key != self._key:
+            self.release()
+            length = np.array([len(x) for x, y in curves])
+            shape = (2, len(curves), length.max())
+            shm = shared_memory.SharedMemory(create=True,
+                                             size=int(np.prod(shape))*8)
+            data = np.ndarray(shape, dtype=float, buffer=shm.buf)
+            for i, (x, y) in enumerate(curves):
+                data[0, i, :length[i]] = x
+                data[1, i, :length[i]] = y
+            del data
+            ## the arrays are kept so their memory is not reused by others
+            self._shm, self._shape, self._length = shm, shape, length
+            self._curves, self._key = curves, key
+        return self._shm, self._shape, self._length
+
+    def fit(self, beesfit, chunksize=None, init=None, **kwarg):
+        """Fit a list of BEESFit and update them with the result
+
+        Args:
+            beesfit (list): BEESFit to fit
+            chunksize (int): overwrite the chunksize of the pool
+            init (list): initial values (dictionary passed to BEESFit.fit)
+                of each curve
+            kwarg: passed to BEESFit.fit
+        """
+        if not beesfit:
+            return
+        if chunksize is None:
+            chunksize = self.chunksize
+        shm, shape, length = self._share(beesfit)
+
+        tasks = []
+        for s in range(0, len(beesfit), chunksize):
+            index = np.arange(s, min(s+chunksize, len(beesfit)))
+            settings = [tuple(getattr(beesfit[i], x) for x in SETTINGS)
+                        for i in index]
+            inits = [{} if init is None else init[i] for i in index]
+            tasks.append((shm.name, shape, index, length[index], settings,
+                          inits, kwarg))
+
+        for index, records in self.pool.imap_unordered(_fit_chunk, tasks):
+            for i, r in zip(index, records):
+                beesfit[i].update(decode(r))
+
+
+def encode(res, nb=1):
+    """Pack the dictionary returned by BEESFit.fit (with nb barrier heights)
+    in a flat array"""
+    if res['barrier_height'][0] is None:
+        val = [np.nan]*(1+2*nb) + [np.inf]*(1+2*nb)
+    else:
+        val = np.r_[res['noise'], res['barrier_height'], res['trans_a'],
+                    res['noise_err'], res['barrier_height_err'],
+                    res['trans_a_err']]
+    return np.r_[val, res.get('bias_min', np.nan), res.get('bias_max', np.nan)]
+
+
+def decode(record):
+    """Inverse of :func:`encode`"""
+    nb = (len(record)-4)//4
+    p = 1+2*nb
+    if np.isnan(record[1]):
+        res = {'barrier_height':[None],
+               'trans_a':[None],
+               'noise':None,
+               'barrier_height_err':[np.inf],
+               'trans_a_err':[np.inf],
+               'noise_err':np.inf}
+    else:
+        res = {'noise':record[0],
+               'barrier_height':record[1:nb+1],
+               'trans_a':record[nb+1:p],
+               'noise_err':record[p],
+               'barrier_height_err':record[p+1:p+nb+1],
+               'trans_a_err':record[p+nb+1:2*p]}
+    if not np.isnan(record[-1]):
+        res.update({'bias_min':record[-2], 'bias_max':record[-1]})
+    return res
+
+
+def _attach(name, shape):
+    if name not in _attached:
+        for shm in _attached.values():
+            shm.close()
+        _attached.clear()
+        _attached[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=float, buffer=_attached[name].buf)
+
+
+def _fit_chunk(task):
+    name, shape, index, length, settings, inits, kwarg = task
+    data = _attach(name, shape)
+    records = []
+    for i, l, s, init in zip(index, length, settings, inits):
+        b = BEESFit(BEESData(bias=data[0, i, :l], i_beem=data[1, i, :l]))
+        b.update(dict(zip(SETTINGS, s)))
+        arg = dict(kwarg, **init)
+        nb = len(arg.get('barrier_height', [None]))
+        records.append(encode(b.fit(**arg), nb))
+    return index, records
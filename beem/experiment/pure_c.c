@@ -7,13 +7,30 @@
 //Header (.h)
 static PyObject *bell_kaiser_v(PyObject *self, PyObject *args);
 static PyObject *residu_bell_kaiser_v(PyObject *self, PyObject *args);
+static PyObject *bell_kaiser_v_batch(PyObject *self, PyObject *args);
+static PyObject *residu_bell_kaiser_v_batch(PyObject *self, PyObject *args);
+static PyObject *jacobian_bell_kaiser_v(PyObject *self, PyObject *args);
+static PyObject *jacobian_bell_kaiser_v_batch(PyObject *self, PyObject *args);
+static PyObject *bell_kaiser_v_reference(PyObject *self, PyObject *args);
+int _bias_order(int l, double *bias);
 void _bell_kaiser_v(int leng ,double * bias, double * i_beem, double n,
         double noise, int n_barriers, double* barrier_height, double* trans_a);
+void _bell_kaiser_v_sorted(int leng ,double * bias, double * i_beem, double n,
+        double noise, int n_barriers, double* barrier_height, double* trans_a,
+        int order);
+void _bell_kaiser_v_reference(int leng ,double * bias, double * i_beem,
+        double n, double noise, int n_barriers, double* barrier_height,
+        double* trans_a);
+void _jacobian_bell_kaiser_v(int l ,double * bias, double * jac, double n,
+        int n_barriers, double* barrier_height, double* trans_a);
+void _jacobian_bell_kaiser_v_sorted(int l ,double * bias, double * jac,
+        double n, int n_barriers, double* barrier_height, double* trans_a,
+        int order);
 
 //Doc of the module
 static char module_docstring[] ="This module reimplement some critical "
     "function in C to increase speed.\nAll function have the same interface "
-    "than their python counterpart.\nAttention: these functions doesn't "
+    "than their python counterpart and release the GIL during the calcul.\nAttention: these functions doesn't "
     "implement any verification of the parameter passed. In case of bug "
     "use the python implementation to do the debugging (use_pure_c=Flase).";
 
@@ -21,6 +38,18 @@ static char module_docstring[] ="This module reimplement some critical "
 static char bell_kaiser_v_docstring[] = "See _pure_python.bell_kaiser_v.";
 static char residu_bell_kaiser_v_docstring[] = "See "
     "_pure_python.residu_bell_kaiserV.";
+static char bell_kaiser_v_batch_docstring[] = "See "
+    "_pure_python.bell_kaiser_v_batch.";
+static char residu_bell_kaiser_v_batch_docstring[] = "See "
+    "_pure_python.residu_bell_kaiser_v_batch.";
+static char jacobian_bell_kaiser_v_docstring[] = "See "
+    "_pure_python.jacobian_bell_kaiser_v.";
+static char jacobian_bell_kaiser_v_batch_docstring[] = "See "
+    "_pure_python.jacobian_bell_kaiser_v_batch.";
+static char bell_kaiser_v_reference_docstring[] = "Same as "
+    "bell_kaiser_v_batch with a test on each point instead of the crossover "
+    "index of a sorted bias and pow for any n. Kept for the tests and the "
+    "benchmarks.";
 
 
 //Definition of the function see by python
@@ -28,6 +57,16 @@ static PyMethodDef module_methods[] = {
   {"bell_kaiser_v",bell_kaiser_v, METH_VARARGS,bell_kaiser_v_docstring},
   {"residu_bell_kaiser_v",residu_bell_kaiser_v, METH_VARARGS,
       residu_bell_kaiser_v_docstring},
+  {"bell_kaiser_v_batch",bell_kaiser_v_batch, METH_VARARGS,
+      bell_kaiser_v_batch_docstring},
+  {"residu_bell_kaiser_v_batch",residu_bell_kaiser_v_batch, METH_VARARGS,
+      residu_bell_kaiser_v_batch_docstring},
+  {"jacobian_bell_kaiser_v",jacobian_bell_kaiser_v, METH_VARARGS,
+      jacobian_bell_kaiser_v_docstring},
+  {"jacobian_bell_kaiser_v_batch",jacobian_bell_kaiser_v_batch, METH_VARARGS,
+      jacobian_bell_kaiser_v_batch_docstring},
+  {"bell_kaiser_v_reference",bell_kaiser_v_reference, METH_VARARGS,
+      bell_kaiser_v_reference_docstring},
   {NULL,NULL,0,NULL}
 };
 
@@ -83,9 +122,11 @@ static PyObject *bell_kaiser_v(PyObject *self, PyObject *args)
   i_beem=PyArray_EMPTY(PyArray_NDIM(bias_array),PyArray_SHAPE(bias_array),NPY_DOUBLE,0);
 
   //Do the calcul
+  Py_BEGIN_ALLOW_THREADS
   _bell_kaiser_v(l,(double*)PyArray_DATA(bias_array),
           (double*)PyArray_DATA(i_beem),n ,dparams[0],n_barriers,dparams+1,
           dparams+1+n_barriers);
+  Py_END_ALLOW_THREADS
 
   //Clean Py_objects
   Py_DECREF(bias_array);
@@ -124,6 +165,7 @@ static PyObject *residu_bell_kaiser_v(PyObject *self, PyObject *args)
 
   double* temp=(double*)PyArray_DATA(bias_array);
 
+  Py_BEGIN_ALLOW_THREADS
   //calcul beem for bell_kaiser_v
   _bell_kaiser_v(l,temp,dres,n ,dparams[0],n_barriers,dparams+1,
           dparams+1+n_barriers);
@@ -131,6 +173,7 @@ static PyObject *residu_bell_kaiser_v(PyObject *self, PyObject *args)
   //calcul residu
   for(i=0;i<l;i++)
     dres[i]-=di_beem[i];
+  Py_END_ALLOW_THREADS
 
   //clean PyObjects
   Py_DECREF(bias_array);
@@ -143,8 +186,410 @@ static PyObject *residu_bell_kaiser_v(PyObject *self, PyObject *args)
 
 
 
+//Check the shapes of a batch: bias is (curves x points) and params is
+//(curves x parameters); a 1-D bias or params is shared by every curve.
+static int _batch_dims(PyArrayObject *bias_array, PyArrayObject *params_array,
+        npy_intp *shape, npy_intp *bias_stride, npy_intp *params_stride,
+        int *n_barriers)
+{
+  int bias_nd=PyArray_NDIM(bias_array), params_nd=PyArray_NDIM(params_array);
+  npy_intp n_params;
+
+  if (bias_nd<1 || bias_nd>2 || params_nd<1 || params_nd>2)
+  {
+    PyErr_SetString(PyExc_ValueError, "bias and params must be 1-D or 2-D");
+    return -1;
+  }
+
+  shape[1]=PyArray_DIM(bias_array, bias_nd-1);
+  n_params=PyArray_DIM(params_array, params_nd-1);
+  *n_barriers=((int)n_params-1)/2;
+
+  if (bias_nd==2)
+    shape[0]=PyArray_DIM(bias_array, 0);
+  else if (params_nd==2)
+    shape[0]=PyArray_DIM(params_array, 0);
+  else
+    shape[0]=1;
+
+  if (bias_nd==2 && params_nd==2 && PyArray_DIM(params_array, 0)!=shape[0])
+  {
+    PyErr_SetString(PyExc_ValueError,
+            "bias and params have a different number of curves");
+    return -1;
+  }
+
+  *bias_stride=bias_nd==2 ? shape[1] : 0;
+  *params_stride=params_nd==2 ? n_params : 0;
+  return 0;
+}
+
+//Return a new reference to the array where a batch is stored: the
+//preallocated out array if given, a new array of the given shape otherwise
+static PyArrayObject *_batch_output(PyObject *out, int nd, npy_intp *shape)
+{
+  PyArrayObject *out_array;
+  npy_intp size=1;
+  int i;
+
+  if (out==NULL || out==Py_None)
+    return (PyArrayObject*) PyArray_EMPTY(nd, shape, NPY_DOUBLE, 0);
+
+  for (i=0; i<nd; i++)
+    size*=shape[i];
+  out_array=(PyArrayObject*) out;
+  if (!PyArray_Check(out) || PyArray_TYPE(out_array)!=NPY_DOUBLE ||
+          !PyArray_ISCARRAY(out_array) || !PyArray_ISNOTSWAPPED(out_array) ||
+          PyArray_SIZE(out_array)!=size)
+  {
+    PyErr_SetString(PyExc_ValueError, "out must be a writable C-contiguous "
+            "float64 array with one row per curve");
+    return NULL;
+  }
+  Py_INCREF(out);
+  return out_array;
+}
+
+//Body of bell_kaiser_v_batch and bell_kaiser_v_reference
+static PyObject *_bell_kaiser_v_batch(PyObject *args, int reference)
+{
+  PyObject *bias, *params, *out=NULL;
+  PyArrayObject *bias_array, *params_array, *out_array=NULL;
+  double *dbias, *dparams, *dout, *p, n;
+  npy_intp shape[2], bias_stride, params_stride, k;
+  int n_barriers, order;
+
+  //Extract argument
+  if (!PyArg_ParseTuple(args, "OdO|O", &bias, &n, &params, &out)) return NULL;
+  bias_array = (PyArrayObject*) PyArray_FROM_OTF(bias, NPY_DOUBLE, NPY_ARRAY_CARRAY_RO);
+  params_array = (PyArrayObject*) PyArray_FROM_OTF(params, NPY_DOUBLE, NPY_ARRAY_CARRAY_RO);
+  if (bias_array==NULL || params_array==NULL)
+    goto fail;
+
+  //Retrieve dimension and get the array to store the result
+  if (_batch_dims(bias_array, params_array, shape, &bias_stride,
+              &params_stride, &n_barriers)<0)
+    goto fail;
+  out_array=_batch_output(out, 2, shape);
+  if (out_array==NULL)
+    goto fail;
+
+  dbias=(double*)PyArray_DATA(bias_array);
+  dparams=(double*)PyArray_DATA(params_array);
+  dout=(double*)PyArray_DATA(out_array);
+
+  //Do the calcul for each curve
+  Py_BEGIN_ALLOW_THREADS
+  //a bias shared by the curves is checked once
+  order=bias_stride ? 0 : _bias_order((int)shape[1], dbias);
+  for (k=0; k<shape[0]; k++)
+  {
+    p=dparams+k*params_stride;
+    if (reference)
+      _bell_kaiser_v_reference((int)shape[1], dbias+k*bias_stride,
+              dout+k*shape[1], n, p[0], n_barriers, p+1, p+1+n_barriers);
+    else
+      _bell_kaiser_v_sorted((int)shape[1], dbias+k*bias_stride,
+              dout+k*shape[1], n, p[0], n_barriers, p+1, p+1+n_barriers,
+              bias_stride ? _bias_order((int)shape[1], dbias+k*bias_stride) :
+              order);
+  }
+  Py_END_ALLOW_THREADS
+
+  Py_DECREF(bias_array);
+  Py_DECREF(params_array);
+  return (PyObject*) out_array;
+
+fail:
+  Py_XDECREF(bias_array);
+  Py_XDECREF(params_array);
+  return NULL;
+}
+
+static PyObject *bell_kaiser_v_batch(PyObject *self, PyObject *args)
+{
+  return _bell_kaiser_v_batch(args, 0);
+}
+
+static PyObject *bell_kaiser_v_reference(PyObject *self, PyObject *args)
+{
+  return _bell_kaiser_v_batch(args, 1);
+}
+
+static PyObject *residu_bell_kaiser_v_batch(PyObject *self, PyObject *args)
+{
+  PyObject *bias, *i_beem, *params, *out=NULL;
+  PyArrayObject *bias_array, *i_beem_array, *params_array, *out_array=NULL;
+  double *dbias, *di_beem, *dparams, *dout, *p, n;
+  npy_intp shape[2], bias_stride, params_stride, k, i;
+  int n_barriers, order;
+
+  //Extract parameters
+  if (!PyArg_ParseTuple(args, "OOOd|O", &params, &bias, &i_beem, &n, &out))
+    return NULL;
+  bias_array = (PyArrayObject*)PyArray_FROM_OTF(bias, NPY_DOUBLE, NPY_ARRAY_CARRAY_RO);
+  i_beem_array = (PyArrayObject*)PyArray_FROM_OTF(i_beem, NPY_DOUBLE, NPY_ARRAY_CARRAY_RO);
+  params_array = (PyArrayObject*)PyArray_FROM_OTF(params, NPY_DOUBLE, NPY_ARRAY_CARRAY_RO);
+  if (bias_array==NULL || i_beem_array==NULL || params_array==NULL)
+    goto fail;
+
+  //Get Data
+  if (_batch_dims(bias_array, params_array, shape, &bias_stride,
+              &params_stride, &n_barriers)<0)
+    goto fail;
+  if (PyArray_NDIM(bias_array)==1 && PyArray_NDIM(i_beem_array)==2)
+    shape[0]=PyArray_DIM(i_beem_array, 0);
+  if (PyArray_SIZE(i_beem_array)!=shape[0]*shape[1])
+  {
+    PyErr_SetString(PyExc_ValueError, "i_beem must have one row per curve");
+    goto fail;
+  }
+  out_array=_batch_output(out, 2, shape);
+  if (out_array==NULL)
+    goto fail;
+
+  dbias=(double*)PyArray_DATA(bias_array);
+  di_beem=(double*)PyArray_DATA(i_beem_array);
+  dparams=(double*)PyArray_DATA(params_array);
+  dout=(double*)PyArray_DATA(out_array);
+
+  //calcul beem for bell_kaiser_v and the residu of each curve
+  Py_BEGIN_ALLOW_THREADS
+  //a bias shared by the curves is checked once
+  order=bias_stride ? 0 : _bias_order((int)shape[1], dbias);
+  for (k=0; k<shape[0]; k++)
+  {
+    p=dparams+k*params_stride;
+    _bell_kaiser_v_sorted((int)shape[1], dbias+k*bias_stride,
+            dout+k*shape[1], n, p[0], n_barriers, p+1, p+1+n_barriers,
+            bias_stride ? _bias_order((int)shape[1], dbias+k*bias_stride) :
+            order);
+  }
+  for (i=0; i<shape[0]*shape[1]; i++)
+    dout[i]-=di_beem[i];
+  Py_END_ALLOW_THREADS
+
+  Py_DECREF(bias_array);
+  Py_DECREF(i_beem_array);
+  Py_DECREF(params_array);
+  return (PyObject*) out_array;
+
+fail:
+  Py_XDECREF(bias_array);
+  Py_XDECREF(i_beem_array);
+  Py_XDECREF(params_array);
+  return NULL;
+}
+
+static PyObject *jacobian_bell_kaiser_v(PyObject *self, PyObject *args)
+{
+  PyObject *bias, *i_beem, *jac, *params;
+  PyArrayObject *bias_array, *params_array;
+  double *dparams, n;
+  npy_intp dims[2];
+  int n_barriers;
+
+  //Extract parameters (same as residu_bell_kaiser_v)
+  if (!PyArg_ParseTuple(args, "OOOd",&params, &bias, &i_beem, &n)) return NULL;
+  bias_array = (PyArrayObject*)PyArray_FROM_OTF(bias, NPY_DOUBLE, NPY_ARRAY_CARRAY_RO);
+  params_array = (PyArrayObject*)PyArray_FROM_OTF(params, NPY_DOUBLE, NPY_ARRAY_CARRAY_RO);
+
+  //Get Data
+  dims[0]=PyArray_SIZE(params_array);
+  dims[1]=PyArray_SIZE(bias_array);
+  n_barriers=((int)dims[0]-1)/2;
+  dparams=(double*)PyArray_DATA(params_array);
+
+  //Create an array to store the result (one row per parameter)
+  jac=PyArray_EMPTY(2,dims,NPY_DOUBLE,0);
+
+  Py_BEGIN_ALLOW_THREADS
+  _jacobian_bell_kaiser_v((int)dims[1],(double*)PyArray_DATA(bias_array),
+          (double*)PyArray_DATA(jac),n,n_barriers,dparams+1,
+          dparams+1+n_barriers);
+  Py_END_ALLOW_THREADS
+
+  //clean PyObjects
+  Py_DECREF(bias_array);
+  Py_DECREF(params_array);
+
+  return PyArray_Return((PyArrayObject*) jac);
+}
+
+static PyObject *jacobian_bell_kaiser_v_batch(PyObject *self, PyObject *args)
+{
+  PyObject *bias, *i_beem, *params, *out=NULL;
+  PyArrayObject *bias_array, *params_array, *out_array=NULL;
+  double *dbias, *dparams, *dout, *p, n;
+  npy_intp shape[2], jac_shape[3], bias_stride, params_stride, k;
+  int n_barriers, order;
+
+  //Extract parameters (same as residu_bell_kaiser_v_batch)
+  if (!PyArg_ParseTuple(args, "OOOd|O", &params, &bias, &i_beem, &n, &out))
+    return NULL;
+  bias_array = (PyArrayObject*)PyArray_FROM_OTF(bias, NPY_DOUBLE, NPY_ARRAY_CARRAY_RO);
+  params_array = (PyArrayObject*)PyArray_FROM_OTF(params, NPY_DOUBLE, NPY_ARRAY_CARRAY_RO);
+  if (bias_array==NULL || params_array==NULL)
+    goto fail;
+
+  //Result is (curves x parameters x points)
+  if (_batch_dims(bias_array, params_array, shape, &bias_stride,
+              &params_stride, &n_barriers)<0)
+    goto fail;
+  jac_shape[0]=shape[0];
+  jac_shape[1]=1+2*n_barriers;
+  jac_shape[2]=shape[1];
+  out_array=_batch_output(out, 3, jac_shape);
+  if (out_array==NULL)
+    goto fail;
+
+  dbias=(double*)PyArray_DATA(bias_array);
+  dparams=(double*)PyArray_DATA(params_array);
+  dout=(double*)PyArray_DATA(out_array);
+
+  Py_BEGIN_ALLOW_THREADS
+  //a bias shared by the curves is checked once
+  order=bias_stride ? 0 : _bias_order((int)shape[1], dbias);
+  for (k=0; k<shape[0]; k++)
+  {
+    p=dparams+k*params_stride;
+    _jacobian_bell_kaiser_v_sorted((int)shape[1], dbias+k*bias_stride,
+            dout+k*jac_shape[1]*shape[1], n, n_barriers, p+1, p+1+n_barriers,
+            bias_stride ? _bias_order((int)shape[1], dbias+k*bias_stride) :
+            order);
+  }
+  Py_END_ALLOW_THREADS
+
+  Py_DECREF(bias_array);
+  Py_DECREF(params_array);
+  return (PyObject*) out_array;
+
+fail:
+  Py_XDECREF(bias_array);
+  Py_XDECREF(params_array);
+  return NULL;
+}
+
+
+//Order of a bias sweep: 1 if increasing, -1 if decreasing, 0 otherwise (or
+//with a NaN)
+int _bias_order(int l, double *bias)
+{
+  int i, inc=1, dec=1;
+
+  for (i=1; i<l; i++)
+  {
+    inc&=bias[i]>=bias[i-1];
+    dec&=bias[i]<=bias[i-1];
+  }
+  if (l>1 && bias[0]==bias[l-1])
+    return 0;
+  return inc ? 1 : (dec ? -1 : 0);
+}
+
+//Range [*start, *stop) of the points of a sorted bias where bias<barrier_height
+static void _crossover(int l, double *bias, int order, double barrier_height,
+        int *start, int *stop)
+{
+  int lo=0, hi=l, mid;
+
+  //first point on the side bias<barrier_height of the sweep
+  while (lo<hi)
+  {
+    mid=(lo+hi)/2;
+    if ((order>0)!=(bias[mid]<barrier_height))
+      hi=mid;
+    else
+      lo=mid+1;
+  }
+  if (order>0)
+  {
+    *start=0;
+    *stop=lo;
+  }
+  else
+  {
+    *start=lo;
+    *stop=l;
+  }
+}
+
+//Add -a*k^n/bias with k=barrier_height-bias to i_beem[start:stop]. The loops
+//have no branch and the common exponents avoid pow.
+static void _add_barrier(int start, int stop, double *bias, double *i_beem,
+        double n, double barrier_height, double a)
+{
+  double k;
+  int i;
+
+  if (n==2.0)
+    for (i=start; i<stop; i++)
+    {
+      k=barrier_height-bias[i];
+      i_beem[i]-=a*k*k/bias[i];
+    }
+  else if (n==1.5)
+    for (i=start; i<stop; i++)
+    {
+      k=barrier_height-bias[i];
+      i_beem[i]-=a*k*sqrt(k)/bias[i];
+    }
+  else if (n==2.5)
+    for (i=start; i<stop; i++)
+    {
+      k=barrier_height-bias[i];
+      i_beem[i]-=a*k*k*sqrt(k)/bias[i];
+    }
+  else if (n==0.5)
+    for (i=start; i<stop; i++)
+      i_beem[i]-=a*sqrt(barrier_height-bias[i])/bias[i];
+  else if (n==1.0)
+    for (i=start; i<stop; i++)
+      i_beem[i]-=a*(barrier_height-bias[i])/bias[i];
+  else if (n==3.0)
+    for (i=start; i<stop; i++)
+    {
+      k=barrier_height-bias[i];
+      i_beem[i]-=a*k*k*k/bias[i];
+    }
+  else
+    for (i=start; i<stop; i++)
+      i_beem[i]-=a*pow(barrier_height-bias[i],n)/bias[i];
+}
+
+//Bell-Kaiser V of a bias sweep of known order (see _bias_order)
+void _bell_kaiser_v_sorted(int l ,double * bias, double * i_beem, double n,
+        double noise, int n_barriers, double* barrier_height, double* trans_a,
+        int order)
+{
+  int i, j, start, stop;
+
+  if (order==0)
+  {
+    _bell_kaiser_v_reference(l, bias, i_beem, n, noise, n_barriers,
+            barrier_height, trans_a);
+    return;
+  }
+  for (i=0; i<l; i++)
+    i_beem[i]=noise;
+  for (j=0;j<n_barriers;j++)
+  {
+    _crossover(l, bias, order, barrier_height[j], &start, &stop);
+    _add_barrier(start, stop, bias, i_beem, n, barrier_height[j], trans_a[j]);
+  }
+}
+
 void _bell_kaiser_v(int l ,double * bias, double * i_beem, double n,
         double noise, int n_barriers, double* barrier_height, double* trans_a)
+{
+  _bell_kaiser_v_sorted(l, bias, i_beem, n, noise, n_barriers,
+          barrier_height, trans_a, _bias_order(l, bias));
+}
+
+//Kernel with a test on each point (any bias), used when the bias is not sorted
+//and as reference in the tests and benchmarks
+void _bell_kaiser_v_reference(int l ,double * bias, double * i_beem, double n,
+        double noise, int n_barriers, double* barrier_height, double* trans_a)
 {
   double k;
   int i, j;
@@ -184,3 +629,102 @@ void _bell_kaiser_v(int l ,double * bias, double * i_beem, double n,
 
   }
 }
+
+
+//Jacobian of _bell_kaiser_v stored row by row: d/dnoise, d/dbarrier_height
+//then d/dtrans_a (the layout expected by MINPACK with col_deriv)
+void _jacobian_bell_kaiser_v_sorted(int l ,double * bias, double * jac,
+        double n, int n_barriers, double* barrier_height, double* trans_a,
+        int order)
+{
+  double k, p, a, *dbh, *da;
+  int i, j, start, stop;
+
+  for (i=0; i<l; i++)
+    jac[i]=1.0;
+
+  for (j=0;j<n_barriers;j++)
+  {
+    dbh=jac+(1+j)*l;
+    da=jac+(1+n_barriers+j)*l;
+    a=trans_a[j];
+    if (order==0)
+    {
+      for (i=0; i<l; i++)
+      {
+        if(bias[i]<barrier_height[j])
+        {
+          k=barrier_height[j]-bias[i];
+          //p=k^(n-1)
+          p=(n==2.0) ? k : pow(k,n-1);
+          da[i]=-p*k/bias[i];
+          dbh[i]=-a*n*p/bias[i];
+        }
+        else
+        {
+          da[i]=0;
+          dbh[i]=0;
+        }
+      }
+      continue;
+    }
+
+    _crossover(l, bias, order, barrier_height[j], &start, &stop);
+    for (i=0; i<start; i++)
+      da[i]=dbh[i]=0;
+    for (i=stop; i<l; i++)
+      da[i]=dbh[i]=0;
+    //da=-k^n/bias, dbh=n*a*da/k
+    if (n==2.0)
+      for (i=start; i<stop; i++)
+      {
+        k=barrier_height[j]-bias[i];
+        da[i]=-k*k/bias[i];
+        dbh[i]=-2.0*a*k/bias[i];
+      }
+    else if (n==1.5)
+      for (i=start; i<stop; i++)
+      {
+        k=barrier_height[j]-bias[i];
+        p=sqrt(k);
+        da[i]=-p*k/bias[i];
+        dbh[i]=-1.5*a*p/bias[i];
+      }
+    else if (n==2.5)
+      for (i=start; i<stop; i++)
+      {
+        k=barrier_height[j]-bias[i];
+        p=k*sqrt(k);
+        da[i]=-p*k/bias[i];
+        dbh[i]=-2.5*a*p/bias[i];
+      }
+    else if (n==1.0)
+      for (i=start; i<stop; i++)
+      {
+        da[i]=-(barrier_height[j]-bias[i])/bias[i];
+        dbh[i]=-a/bias[i];
+      }
+    else if (n==3.0)
+      for (i=start; i<stop; i++)
+      {
+        k=barrier_height[j]-bias[i];
+        da[i]=-k*k*k/bias[i];
+        dbh[i]=-3.0*a*k*k/bias[i];
+      }
+    else
+      for (i=start; i<stop; i++)
+      {
+        k=barrier_height[j]-bias[i];
+        p=pow(k,n-1);
+        da[i]=-p*k/bias[i];
+        dbh[i]=-a*n*p/bias[i];
+      }
+  }
+}
+
+void _jacobian_bell_kaiser_v(int l ,double * bias, double * jac, double n,
+        int n_barriers, double* barrier_height, double* trans_a)
+{
+  _jacobian_bell_kaiser_v_sorted(l, bias, jac, n, n_barriers, barrier_height,
+          trans_a, _bias_order(l, bias));
+}
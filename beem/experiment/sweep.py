@@ -0,0 +1,151 @@
+"""Module to fit the curves of a grid for a cartesian set of fit settings
+(exponent n, auto range and conv_ratio) in one job. The data of the curves are
+stacked once, every setting is fitted with the batched solver of
+:mod:`batch_fit` and starts from the solution of a neighbour setting (same
+values but one) instead of the fixed initial values. The BEESFit are not
+modified.
+"""
+
+import itertools
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from . import experiment
+from .experiment import BEEM_MODEL
+from .batch_fit import _pad, _auto_range
+from . import instrument
+
+
+def settings(n=[2], range=[0.4], conv_ratio=[1]):
+    """Return the settings (n, range, conv_ratio) of a sweep in C order and
+    for each of them the index of the neighbour setting it starts from (-1 for
+    the first one)"""
+    shape = (len(n), len(range), len(conv_ratio))
+    out = []
+    neighbour = []
+    for i, j, k in itertools.product(*[np.arange(x) for x in shape]):
+        out.append((n[i], range[j], conv_ratio[k]))
+        if k:
+            neighbour.append(int(np.ravel_multi_index((i, j, k-1), shape)))
+        elif j:
+            neighbour.append(int(np.ravel_multi_index((i, j-1, k), shape)))
+        elif i:
+            neighbour.append(int(np.ravel_multi_index((i-1, j, k), shape)))
+        else:
+            neighbour.append(-1)
+    return out, neighbour
+
+
+def _quality(bias, i_beem, window, popt, n):
+    """r_squared and chi2 of a block of curves fitted on their window"""
+    res = experiment.bell_kaiser_v_batch(np.where(window, bias, -1), n,
+                                         np.nan_to_num(popt)) - i_beem
+    res[~window] = 0
+    y = np.where(window, i_beem, 0)
+    points = window.sum(1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sse = np.sum(res**2, 1)
+        mean = y.sum(1)/points
+        sst = np.sum(np.where(window, y-mean[:, None], 0)**2, 1)
+        r2 = 1-sse/sst
+        chi2 = sse/(points-popt.shape[1])
+    failed = ~np.isfinite(popt[:, 1])
+    r2[failed] = np.nan
+    chi2[failed] = np.nan
+    return r2, chi2
+
+
+def _sweep_block(block, setting, neighbour, p0, tol, maxIt, out, rows):
+    """Fit all the settings for a block of BEESFit and store the results in
+    the rows of the arrays of out"""
+    bias = _pad([b.bias for b in block])
+    i_beem = _pad([b.i_beem for b in block])
+    valid = np.logical_and(np.isfinite(bias), np.isfinite(i_beem))
+    bias_min = np.array([b.bias_min for b in block], dtype=float)
+    bias_max = np.array([b.bias_max for b in block], dtype=float)
+    auto = np.array([bool(b.auto_range) for b in block])
+    start = np.tile(p0, (len(block), 1))
+    nb = (len(p0)-1)//2
+    for s, (n, auto_range, conv_ratio) in enumerate(setting):
+        a = start
+        if neighbour[s] >= 0:
+            t = neighbour[s]
+            a = out['params'][t, rows].copy()
+            if setting[t][0] != n:
+                ## same current at the far edge of the window for the new n
+                edge = np.where(bias_max < 0, out['bias_min'][t, rows],
+                                out['bias_max'][t, rows])
+                k = np.abs(edge[:, None]-a[:, 1:nb+1])
+                with np.errstate(divide='ignore', invalid='ignore',
+                                 over='ignore'):
+                    a[:, nb+1:] *= k**(setting[t][0]-n)
+            a = np.where(np.all(np.isfinite(a), 1)[:, None], a, start)
+        popt, perr, b_min, b_max = _auto_range(
+                bias, i_beem, valid, n, a, bias_min, bias_max,
+                np.full(len(block), auto_range, dtype=float), auto, tol,
+                maxIt, conv_ratio)
+        window = np.logical_and(valid, np.logical_and(
+            bias >= b_min[:, None], bias <= b_max[:, None]))
+        r2, chi2 = _quality(bias, i_beem, window, popt, n)
+        out['params'][s, rows] = popt
+        out['errors'][s, rows] = np.where(np.isfinite(popt), perr, np.inf)
+        out['bias_min'][s, rows] = b_min
+        out['bias_max'][s, rows] = b_max
+        out['r_squared'][s, rows] = r2
+        out['chi2'][s, rows] = chi2
+
+
+def sweep_fit(beesfit, n=[2], range=[0.4], conv_ratio=[1],
+              barrier_height=[-0.8], trans_a=[0.001], noise=1e-9, tol=0.001,
+              maxIt=10, chunk=2048, threads=1):
+    """Fit a list of BEESFit for every setting of a cartesian set
+
+    Args:
+        beesfit (list): BEESFit to fit (the auto range ones use it)
+        n (list): exponents of the Bell-Kaiser V model
+        range (list): auto ranges
+        conv_ratio (list): conv_ratio of the auto range
+        barrier_height, trans_a, noise: initial values of the first setting
+        tol, maxIt: auto range parameters (as BEESFit.fit)
+        chunk (int): number of curves fitted together
+        threads (int): number of threads fitting the chunks (-1 for one per
+            core)
+
+    Returns:
+        dict. 'n', 'range' and 'conv_ratio': value of each setting (in C order
+        of the shape (len(n), len(range), len(conv_ratio)) kept in 'shape'),
+        'params' and 'errors': (settings x curves x parameters) arrays (NaN
+        parameters if the fit failed or the curve does not use the bkv
+        model), 'bias_min', 'bias_max', 'r_squared' and 'chi2': (settings x
+        curves) arrays
+    """
+    setting, neighbour = settings(n, range, conv_ratio)
+    nb = len(barrier_height)
+    p0 = np.r_[noise, barrier_height, trans_a]
+    shape = (len(setting), len(beesfit))
+    out = {'n':np.array([s[0] for s in setting], dtype=float),
+           'range':np.array([s[1] for s in setting], dtype=float),
+           'conv_ratio':np.array([s[2] for s in setting], dtype=float),
+           'shape':(len(n), len(range), len(conv_ratio)),
+           'params':np.full(shape+(1+2*nb,), np.nan),
+           'errors':np.full(shape+(1+2*nb,), np.inf)}
+    for x in ['bias_min', 'bias_max', 'r_squared', 'chi2']:
+        out[x] = np.full(shape, np.nan)
+
+    rows = np.flatnonzero([b.method == BEEM_MODEL['bkv'] for b in beesfit])
+    jobs = [rows[i:i+chunk] for i in np.arange(0, len(rows), chunk)]
+    def job(r):
+        _sweep_block([beesfit[i] for i in r], setting, neighbour, p0, tol,
+                     maxIt, out, r)
+
+    with instrument.record('sweep_fit', settings=len(setting),
+                           curves=len(rows)):
+        workers = mp.cpu_count() if threads == -1 else threads
+        if workers == 1 or len(jobs) < 2:
+            for r in jobs:
+                job(r)
+        else:
+            with ThreadPoolExecutor(workers) as ex:
+                list(ex.map(job, jobs))
+    return out
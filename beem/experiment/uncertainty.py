@@ -0,0 +1,184 @@
+"""Module to estimate the uncertainty of the fitted parameters by resampling
+instead of the local covariance, which is unreliable near the threshold.
+Every fitted curve is refitted on its window for replicates of its data:
+
+* 'residual': residual bootstrap (fitted model plus residues drawn with
+  replacement)
+* 'montecarlo': fitted model plus gaussian noise of the standard deviation of
+  the residues
+
+The replicates of many curves are refitted together with the batched solver
+of :mod:`optimize`, by rounds of `step` replicates until the confidence
+intervals of every parameter move by less than rtol of their width. Each curve
+draws from its own random generator seeded by (seed, index of the curve) so
+the result does not depend on the chunks or on the number of workers.
+"""
+
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from . import experiment
+from .experiment import BEEM_MODEL
+from .batch_fit import _pad
+from .optimize import leastsq_batch
+from . import instrument
+
+METHODS = ['residual', 'montecarlo']
+
+
+def _replicates(rng, method, fitted, res, window, step):
+    """Draw step replicates of one curve (step x points)"""
+    w = np.flatnonzero(window)
+    out = np.tile(fitted, (step, 1))
+    if method == 'residual':
+        r = res[w]
+        ## centered and corrected for the degrees of freedom used by the fit
+        r = (r-r.mean())*np.sqrt(len(w)/max(len(w)-3, 1))
+        out[:, w] += r[rng.integers(0, len(w), (step, len(w)))]
+    else:
+        sigma = np.sqrt(np.sum(res[w]**2)/max(len(w)-3, 1))
+        out[:, w] += rng.normal(0, sigma, (step, len(w)))
+    return out
+
+
+def _bootstrap_block(args):
+    """Resample a block of curves with the same n and number of barriers.
+    Return the standard deviation, the confidence interval (curves x
+    parameters x 2) and the number of replicates of each curve."""
+    (bias, i_beem, window, params, n, method, seeds, replicates, step, rtol,
+     level) = args
+    c, m = bias.shape
+    ## padded points (outside the window) at the last bias to keep it sorted
+    last = np.isfinite(bias).sum(1)-1
+    bias = np.where(np.isfinite(bias), bias, bias[np.arange(c), last][:, None])
+    fitted = experiment.bell_kaiser_v_batch(bias, n, params)
+    res = np.where(window, i_beem-fitted, 0)
+    rngs = [np.random.default_rng(s) for s in seeds]
+    q = [50*(1-level), 100-50*(1-level)]
+
+    samples = [[] for i in range(c)]
+    ci = np.full((c, params.shape[1], 2), np.nan)
+    active = np.arange(c)
+    while len(active):
+        y = np.concatenate([_replicates(rngs[i], method, fitted[i], res[i],
+                                        window[i], step) for i in active])
+        rows = np.repeat(active, step)
+        popt, cov, cost, info = leastsq_batch(
+                experiment.residu_bell_kaiser_v_batch,
+                experiment.jacobian_bell_kaiser_v_batch,
+                params[rows], (bias[rows], y, n), window[rows])
+        ok = (info >= 0) & np.all(np.isfinite(popt), 1)
+        instrument.count('replicates', len(rows))
+        instrument.count('replicates_failed', int(np.sum(~ok)))
+        keep = []
+        for k, i in enumerate(active):
+            samples[i].append(popt[k*step:(k+1)*step][ok[k*step:(k+1)*step]])
+            s = np.concatenate(samples[i])
+            if len(s) < 2:
+                continue
+            new = np.moveaxis(np.percentile(s, q, 0), 0, -1)
+            ## the noise is not used to stop
+            moved = np.abs(new-ci[i])[1:].max(1)
+            stable = np.all(moved <= rtol*(new[1:, 1]-new[1:, 0]))
+            ci[i] = new
+            if not stable and len(samples[i])*step < replicates:
+                keep.append(i)
+        active = np.array(keep, dtype=int)
+
+    std = np.full(params.shape, np.inf)
+    count = np.zeros(c, dtype=int)
+    for i, x in enumerate(samples):
+        s = np.concatenate(x)
+        count[i] = len(s)
+        if len(s) > 1:
+            std[i] = np.std(s, 0, ddof=1)
+    return std, ci, count
+
+
+def bootstrap(beesfit, method='residual', replicates=1000, step=100,
+              rtol=0.05, level=0.95, seed=0, threads=1, backend='threads',
+              chunk=32):
+    """Estimate the errors of fitted BEESFit by resampling: the standard
+    deviations of the refitted parameters go to barrier_height_err_boot and
+    trans_a_err_boot and the confidence intervals to barrier_height_ci and
+    trans_a_ci (barriers x 2), next to the covariance-based
+    barrier_height_err and trans_a_err which are left as they are.
+
+    Args:
+        beesfit (list): BEESFit already fitted (the others are skipped)
+        method (str): 'residual' or 'montecarlo'
+        replicates (int): maximum number of replicates of each curve
+        step (int): number of replicates of each curve between two tests of
+            the confidence intervals
+        rtol (float): stop when the bounds of the confidence intervals move
+            by less than rtol of their width
+        level (float): level of the confidence intervals
+        seed (int): seed of the random generators
+        threads (int): number of threads or process (-1 for one per core)
+        backend (str): 'threads' or 'process'
+        chunk (int): number of curves resampled together
+
+    Returns:
+        dict. for each BEESFit (inf/NaN if skipped): the standard deviation
+        ('std', curves x parameters), the confidence interval ('ci', curves x
+        parameters x 2) and the number of replicates ('replicates'). The
+        parameters are (noise, barrier heights, trans_a) with the number of
+        barriers of the first fitted curve.
+    """
+    if method not in METHODS:
+        raise ValueError('method must be one of %s' % METHODS)
+    fitted = [i for i, b in enumerate(beesfit) if b.barrier_height[0] is not
+              None and b.method == BEEM_MODEL['bkv']]
+    nb = len(beesfit[fitted[0]].barrier_height) if fitted else 1
+    out = {'std':np.full((len(beesfit), 1+2*nb), np.inf),
+           'ci':np.full((len(beesfit), 1+2*nb, 2), np.nan),
+           'replicates':np.zeros(len(beesfit), dtype=int)}
+
+    ## blocks of curves with the same model
+    groups = dict()
+    for i in fitted:
+        b = beesfit[i]
+        groups.setdefault((b.n, len(b.barrier_height)), []).append(i)
+    blocks = []
+    args = []
+    for (n, k), index in groups.items():
+        for s in range(0, len(index), chunk):
+            block = index[s:s+chunk]
+            bf = [beesfit[i] for i in block]
+            bias = _pad([b.bias for b in bf])
+            i_beem = _pad([b.i_beem for b in bf])
+            bias_min = np.array([b.bias_min for b in bf], dtype=float)
+            bias_max = np.array([b.bias_max for b in bf], dtype=float)
+            window = np.isfinite(i_beem) & (bias >= bias_min[:, None]) & \
+                    (bias <= bias_max[:, None])
+            blocks.append(block)
+            args.append((bias, i_beem, window,
+                         np.array([b.params for b in bf], dtype=float), n,
+                         method, [(seed, i) for i in block], replicates,
+                         step, rtol, level))
+
+    with instrument.record('bootstrap', curves=len(fitted), method=method):
+        workers = mp.cpu_count() if threads == -1 else threads
+        if workers == 1 or len(args) < 2:
+            results = list(map(_bootstrap_block, args))
+        elif backend == 'process':
+            with mp.Pool(workers) as pool:
+                results = pool.map(_bootstrap_block, args)
+        else:
+            with ThreadPoolExecutor(workers) as ex:
+                results = list(ex.map(_bootstrap_block, args))
+
+    for block, (std, ci, count) in zip(blocks, results):
+        for i, s, c, r in zip(block, std, ci, count):
+            b = beesfit[i]
+            k = len(b.barrier_height)
+            if k == nb:
+                out['std'][i] = s
+                out['ci'][i] = c
+            out['replicates'][i] = r
+            b.barrier_height_err_boot = s[1:k+1]
+            b.trans_a_err_boot = s[k+1:]
+            b.barrier_height_ci = c[1:k+1]
+            b.trans_a_ci = c[k+1:]
+    return out
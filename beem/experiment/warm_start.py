@@ -0,0 +1,55 @@
+"""Module to fit the curves of a grid in a spatially coherent order. The curves
+are fitted by wavefront (constant x_index+y_index) and each curve starts from
+the parameters of its converged neighbours of the previous wavefronts instead
+of the fixed initial values. The window is not seeded: the auto range starts
+it from the seeded barrier height.
+"""
+
+import numpy as np
+
+#Neighbours (dx, dy) already fitted when a wavefront starts
+NEIGHBOURS = [(-1, 0), (0, -1), (-1, -1)]
+
+
+def wavefronts(beesfit):
+    """Split a list of BEESFit in lists of constant x_index+y_index, in
+    increasing order"""
+    d = np.array([b.x_index + b.y_index for b in beesfit])
+    return [[beesfit[i] for i in np.flatnonzero(d == x)] for x in np.unique(d)]
+
+
+def _key(b, dx=0, dy=0):
+    return (b.x_index+dx, b.y_index+dy, b.mode, b.number, b.pass_number)
+
+
+class Seeder(object):
+    """Keep the result of the converged fits and give the initial values of
+    the next curves"""
+
+    def __init__(self, barrier_height=[-0.8], trans_a=[0.001], noise=1e-9):
+        self.default = {'barrier_height':list(barrier_height),
+                        'trans_a':list(trans_a),
+                        'noise':noise}
+        self.nb = len(barrier_height)
+        self.done = dict()
+
+    def add(self, beesfit):
+        """Store the converged fits of a list of BEESFit"""
+        for b in beesfit:
+            if b.barrier_height[0] is None or \
+                    len(b.barrier_height) != self.nb:
+                continue
+            p = b.params
+            if np.all(np.isfinite(p)):
+                self.done[_key(b)] = p
+
+    def seed(self, b):
+        """Return the initial values of a BEESFit"""
+        found = [self.done[k] for k in
+                 [_key(b, dx, dy) for dx, dy in NEIGHBOURS] if k in self.done]
+        if not found:
+            return dict(self.default)
+        p = np.median(found, 0)
+        return {'noise':p[0],
+                'barrier_height':p[1:self.nb+1],
+                'trans_a':p[self.nb+1:]}
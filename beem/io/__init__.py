@@ -1,4 +1,4 @@
 from .nanosis import bees_from_file, grid_from_files, iv_from_file
-from .grid3ds import grid_from_3ds
+from .grid3ds import grid_from_3ds, Grid3dsReader
 from .space import load_space, save_space
 from .csv import bees2csv, grid2csv
@@ -3,6 +3,23 @@ import numpy as np
 from os import mkdir
 from os.path import join
 
+GRID_HEAD='''GRID DATA
+[METADATA]
+position x : {b.pos_x}
+position y : {b.pos_y}
+size x : {b.size_x}
+size y : {b.size_y}
+dimension x : {b.num_x}
+dimension y : {b.num_y}
+date : {b.date}'''
+
+SUMMARY_HEAD=('no;index x;index y;sweep;pass;direction (fwd=0, bwd=1);'
+              'offset;barrier height;R')
+SUMMARY_FMT=['%d','%d','%d','%d','%d','%d','%e','%.4f','%.4f']
+
+CURVES_HEAD='no;bias;i_beem;i_beem_fitted;i_tunnel;z'
+CURVES_FMT=['%d','%e','%e','%e','%e','%e']
+
 def bees2csv(filename,bees):
     
     if hasattr(bees,'barrier_height'):
@@ -52,9 +69,9 @@ n : {n}
 offset : {off}
 barrier height : {bh}
 Transmission R : {r}
-offset error : {off}
-barrier height error : {bh}
-Transmission R error : {r}
+offset error : {off_err}
+barrier height error : {bh_err}
+Transmission R error : {r_err}
 R squared : {R2}
 [DATA]
 bias;i_beem;i_beem_fitted;i_tunnel;z'''.format(b=bees, bh=bh, r=r, off=off,
@@ -67,47 +84,84 @@ bias;i_beem;i_beem_fitted;i_tunnel;z'''.format(b=bees, bh=bh, r=r, off=off,
     data[:,3]=bees.i_tunnel
     data[:,4]=bees.pos_z
 
-    if hasattr(bees,'i_beem_estimated'):
-        data[np.in1d(bees.bias,bees.bias_fitted),2]=bees.i_beem_estimated
+    if getattr(bees,'i_beem_estimated',None) is not None:
+        data[bees.index,2]=bees.i_beem_estimated
 
     np.savetxt(filename, data, delimiter=';', header=head, comments='')
 
-def grid2csv(folder,grid,mode='good',r2=0.6):
+def _summary(grid,liste,fitted,start=0):
+    """Rows of the grid summary for a block of curves"""
+    data=np.empty((len(liste),9))
+    data[:]=np.nan
+    data[:,0]=np.arange(start,start+len(liste))
+    for k,x in enumerate(['x_index','y_index','number','pass_number','mode']):
+        data[:,k+1]=[getattr(b,x) for b in liste]
+    if fitted and len(liste):
+        params=grid.params(liste)
+        nbh=(params.shape[1]-1)//2
+        i_tunnel=grid.stack('i_tunnel',liste)
+        with np.errstate(divide='ignore',invalid='ignore'):
+            i_tunnel=np.nansum(i_tunnel,1)/np.sum(~np.isnan(i_tunnel),1)
+        data[:,6]=params[:,0]
+        data[:,7]=params[:,1]
+        data[:,8]=params[:,nbh+1]/i_tunnel
+    return data
+
+def _write_rows(f,fmt,data):
+    """Format a whole block of rows at once and write it"""
+    if len(data):
+        row=';'.join(fmt)+'\n'
+        f.write((row*len(data)) % tuple(data.ravel()))
+
+def _select(grid,mode,r2):
     if mode=='data':
-        liste=grid.bees
+        return grid.bees
     elif mode=='fit':
-        grid.beesfit
-    else:
-        liste=grid.extract_good(r2)
+        return grid.beesfit
+    return grid.extract_good(r2)
 
-    head='''GRID DATA
-[METADATA]
-position x : {b.pos_x}
-position y : {b.pos_y}
-size x : {b.size_x}
-size y : {b.size_y}
-dimension x : {b.num_x}
-dimension y : {b.num_y}
-date : {b.date}
-[DATA]
-no;index x;index y;sweep;pass;direction (fwd=0, bwd=1);offset;barrier height;R'''.format(b=grid)
+def grid2csv(folder,grid,mode='good',r2=0.6,layout='folder',chunk=1024):
+    """Export a grid in csv
+
+    Args:
+        folder (str): folder to create (layout 'folder') or file to write
+            (layout 'long')
+        grid (Grid): grid to export
+        mode (str): 'data' (all BEESData), 'fit' (all BEESFit) or 'good'
+            (BEESFit with r squared larger than r2)
+        layout (str): 'folder' writes grid.csv and one file per curve,
+            'long' writes the summary and all the curves in one file
+        chunk (int): number of curves formatted at once (layout 'long')
+    """
+    liste=_select(grid,mode,r2)
+    fitted=not(mode=='data')
+
+    if layout=='long':
+        with open(folder,'w') as f:
+            f.write(GRID_HEAD.format(b=grid)+'\n[SUMMARY]\n'+SUMMARY_HEAD+'\n')
+            for s in range(0,len(liste),chunk):
+                _write_rows(f,SUMMARY_FMT,
+                            _summary(grid,liste[s:s+chunk],fitted,s))
+            f.write('[CURVES]\n'+CURVES_HEAD+'\n')
+            for s in range(0,len(liste),chunk):
+                block=liste[s:s+chunk]
+                bias=grid.stack('bias',block)
+                data=np.empty(bias.shape+(6,))
+                data[:,:,0]=np.arange(s,s+len(block))[:,None]
+                data[:,:,1]=bias
+                data[:,:,2]=grid.stack('i_beem',block)
+                data[:,:,3]=grid.estimate(block,fitted=True) if fitted \
+                        else np.nan
+                data[:,:,4]=grid.stack('i_tunnel',block)
+                data[:,:,5]=grid.stack('pos_z',block)
+                _write_rows(f,CURVES_FMT,data[~np.isnan(bias)])
+        return
 
-    data=np.ones((len(liste),9))*np.nan
     mkdir(folder)
-    for i in xrange(len(liste)):
-        b = liste[i]
-        data[i,0] = i
-        data[i,1] = b.x_index
-        data[i,2] = b.y_index
-        data[i,3] = b.number
-        data[i,4] = b.pass_number
-        data[i,5] = b.mode
-        if not(mode=='data'):
-            data[i,6] = b.noise
-            data[i,7] = b.barrier_height[0]
-            data[i,8] = b.trans_r[0]
-        bees2csv(join(folder, 'bees_%04d.csv' % i),b)
-
-    np.savetxt(join(folder,'grid.csv'),data,
-            fmt=['%d','%d','%d','%d','%d','%d','%e','%.4f','%.4f'],
-            delimiter=';', header=head, comments='')
+    for i in range(len(liste)):
+        bees2csv(join(folder, 'bees_%04d.csv' % i),liste[i])
+
+    data=_summary(grid,liste,fitted)
+    np.savetxt(join(folder,'grid.csv'),data,fmt=SUMMARY_FMT,delimiter=';',
+               header=GRID_HEAD.format(b=grid)+'\n[DATA]\n'+SUMMARY_HEAD,
+               comments='')
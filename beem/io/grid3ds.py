@@ -1,7 +1,10 @@
 import numpy as np
 import datetime
-from beem.experiment import Grid, BEESData
+import os
+from beem.experiment import Grid
+from beem.experiment.grid_store import GridStore
 from beem.experiment.experiment import MODE
+from beem.experiment import instrument
 
 CHANNEL_NAME={
         'beem':'BEEM Current',
@@ -10,14 +13,16 @@ CHANNEL_NAME={
         'z':'Z'
         }
 
-def grid_from_3ds(filename, channel={}):
-    fid = open(filename, 'rb')
-    grid = Grid()
+def _read_header(fid, grid):
+    """Read the header of a 3ds file and set the grid metadata
+
+    Returns:
+        dict. layout of the data: param_num, points, length (number of float
+        per point), param_dict and channel_dict (index of each parameter and
+        channel) and offset (start of the data in the file)
+    """
     line = fid.readline().decode('utf_8').strip()
-    grid.src_files = [filename]
     param_list = []
-    channel_name = CHANNEL_NAME.copy()
-    channel_name.update(channel)
 
     while line!=':HEADER_END:':
         splited = line.split('=')
@@ -64,52 +69,198 @@ def grid_from_3ds(filename, channel={}):
 
         line=fid.readline().decode('utf_8').strip()
 
-
     param_num = len(param_list)
-    length = len(channel_list)*points+param_num
-    param_dict = dict(zip(param_list,range(0,len(param_list))))
-    channel_dict = dict(zip(channel_list,range(0,len(channel_list))))
+    return {'param_num':param_num,
+            'points':points,
+            'length':len(channel_list)*points+param_num,
+            'param_dict':dict(zip(param_list,range(0,len(param_list)))),
+            'channel_dict':dict(zip(channel_list,range(0,len(channel_list)))),
+            'offset':fid.tell()}
+
+
+def _channels(data, header):
+    """Strided (points x channel length) view of each channel of data"""
+    channels = dict()
+    points = header['points']
+    for name, i in header['channel_dict'].items():
+        first = header['param_num']+i*points
+        channels[name] = data[:, first:first+points]
+    for name, i in header['param_dict'].items():
+        channels[name] = data[:, i]
+    return channels
+
+
+def _store(data, header, grid, channel_name):
+    """Return a GridStore of the BEES curves of data (None if the grid
+    doesn't contain BEES curves)"""
+    channel_dict = header['channel_dict']
+    if not(channel_name['tunnel'] + ' (A)' in channel_dict):
+        return None
+
+    def column(name, unit):
+        first = [header['param_num']+channel_dict[name+x+unit]*header['points']
+                 for x in [' ', ' [bwd] ']]
+        return GridStore.interleave(data, first, header['points'])
+
+    param = header['param_dict']
+    return GridStore(bias=column('Bias', '(V)'),
+            i_beem=column('BEEM Current', '(A)'),
+            i_tunnel=column('Current', '(A)'),
+            pos_z=column('Z', '(m)'),
+            mode=np.tile([MODE['fwd'], MODE['bwd']], len(data)),
+            pos_x=np.repeat(data[:, param['X (m)']], 2),
+            pos_y=np.repeat(data[:, param['Y (m)']], 2),
+            date=grid.date, src_files=grid.src_files)
+
+
+@instrument.recorded('grid_from_3ds')
+def grid_from_3ds(filename, channel={}, mmap=False):
+    """Read a Nanonis grid (.3ds)
+
+    Args:
+        filename (str): location of the file
+        channel (dict): name of the channels if not the default ones
+        mmap (bool): memory-map the data instead of reading it. The BEESData
+            are then big endian float32 views of the file converted only
+            when used.
+    """
+    fid = open(filename, 'rb')
+    grid = Grid()
+    grid.src_files = [filename]
+    channel_name = CHANNEL_NAME.copy()
+    channel_name.update(channel)
 
+    header = _read_header(fid, grid)
+    length = header['length']
+    offset = header['offset']
 
-    data=fid.read()
+    if mmap:
+        size = os.fstat(fid.fileno()).st_size - offset
+    else:
+        data = fid.read()
+        size = len(data)
     fid.close()
 
     #Test if all the data is there
-    if len(data)==length*grid.num_x*grid.num_y*4:
+    if size==length*grid.num_x*grid.num_y*4:
         grid.completed = True
         num = grid.num_x*grid.num_y
     else:
         grid.completed=False
-        num=len(data)//length//4
-
-    #Transform the data from 32bits Big Endian to 64bits Little Endian
-    data=np.array(np.ndarray(shape=(length*num,), dtype='>f4', buffer=data),
-                  dtype='<f8')
-
-    for i in range(num):
-        delta = i*length
-        pos_x = data[delta+param_dict['X (m)']]
-        pos_y = data[delta+param_dict['Y (m)']]
-        dico = {'pos_x':pos_x,
-                'pos_y':pos_y,
-                'date':grid.date,
-                'src_files':grid.src_files
-                }
-
-        if channel_name['tunnel'] + ' (A)' in channel_dict :
-            grid.bees.append(BEESData(
-            bias = data[delta+param_num+channel_dict['Bias (V)']*points:param_num+channel_dict['Bias (V)']*points+points+delta:],
-            i_beem = data[delta+param_num+channel_dict['BEEM Current (A)']*points:param_num+channel_dict['BEEM Current (A)']*points+points+delta:],
-            i_tunnel = data[delta+param_num+channel_dict['Current (A)']*points:param_num+channel_dict['Current (A)']*points+points+delta:],
-            pos_z = data[delta+param_num+channel_dict['Z (m)']*points:param_num+channel_dict['Z (m)']*points+points+delta:],
-            mode=MODE['fwd'],**dico))
-
-            grid.bees.append(BEESData(
-            bias = data[delta+param_num+channel_dict['Bias [bwd] (V)']*points:param_num+channel_dict['Bias [bwd] (V)']*points+points+delta:],
-            i_beem = data[delta+param_num+channel_dict['BEEM Current [bwd] (A)']*points:param_num+channel_dict['BEEM Current [bwd] (A)']*points+points+delta:],
-            i_tunnel = data[delta+param_num+channel_dict['Current [bwd] (A)']*points:param_num+channel_dict['Current [bwd] (A)']*points+points+delta:],
-            pos_z = data[delta+param_num+channel_dict['Z [bwd] (m)']*points:param_num+channel_dict['Z [bwd] (m)']*points+points+delta:],
-            mode=MODE['bwd'],**dico))
+        num=size//length//4
 
+    #One row per point: parameters then each channel
+    if mmap and num:
+        data = np.memmap(filename, dtype='>f4', mode='r', offset=offset,
+                         shape=(num, length))
+    elif mmap:
+        data = np.empty((0, length), dtype='>f4')
+    else:
+        #Transform the data from 32bits Big Endian to 64bits Little Endian
+        data=np.array(np.ndarray(shape=(num, length), dtype='>f4',
+                                 buffer=data), dtype='<f8')
+
+    grid.channels = _channels(data, header)
+    grid.store = _store(data, header, grid, channel_name)
+    if grid.store is not None:
+        grid.bees = grid.store.views()
 
+    instrument.count('curves', len(grid.bees))
     return grid
+
+
+class Grid3dsReader(object):
+    """Follow a 3ds file while it is acquired: each call of :meth:`read` only
+    read the points completed since the last call.
+
+    The new points are indexed by their position in the scan (x_index is the
+    point number modulo the grid dimension x) since the positions of the
+    points not yet acquired are unknown. A grid already indexed by the
+    positions (init_grid or update_dict) is indexed again by
+    :meth:`update` so its old and new curves share the same indexes.
+    """
+
+    def __init__(self, filename, channel={}, grid=None):
+        """
+        Kwargs:
+            channel (dict): name of the channels if not the default ones
+            grid (Grid): grid already read from filename (e.g. by
+                grid_from_3ds) to continue: its points are not read again
+        """
+        self.filename = filename
+        self.channel_name = CHANNEL_NAME.copy()
+        self.channel_name.update(channel)
+        info = Grid()
+        with open(filename, 'rb') as fid:
+            self.header = _read_header(fid, info)
+        #dimensions of the scan (num_x of an indexed grid is the number of
+        #positions already acquired)
+        self.num_x = info.num_x
+        self.num_y = info.num_y
+        if grid is None:
+            info.src_files = [filename]
+            info.num_pass = 1
+            info.num_sweep = 1
+            grid = info
+        self.grid = grid
+        #a forward and a backward curve by point
+        self.position = len(grid.bees)//2
+
+    @property
+    def offset(self):
+        """Byte offset of the end of the last complete point read"""
+        return self.header['offset'] + self.position*self.header['length']*4
+
+    @instrument.recorded('grid3ds_read')
+    def read(self):
+        """Return the BEESData of the points completed since the last call
+        """
+        length = self.header['length']
+        total = self.num_x*self.num_y
+        with open(self.filename, 'rb') as fid:
+            size = os.fstat(fid.fileno()).st_size - self.header['offset']
+            num = min(size//length//4, total)
+            if num <= self.position:
+                return []
+            fid.seek(self.offset)
+            data = fid.read((num-self.position)*length*4)
+
+        data = np.array(np.ndarray(shape=(num-self.position, length),
+                                   dtype='>f4', buffer=data), dtype='<f8')
+        store = _store(data, self.header, self.grid, self.channel_name)
+        if store is None:
+            return []
+        point = np.repeat(np.arange(self.position, num), store.sweeps)
+        store.x_index[:] = point % self.num_x
+        store.y_index[:] = point // self.num_x
+        store.pass_number[:] = 1
+        self.position = num
+        self.grid.completed = num==total
+        instrument.count('curves', len(store))
+        return store.views()
+
+    def update(self, grid=None, fit=True, **kwarg):
+        """Append the new points to the grid and fit only their curves
+
+        Args:
+            grid (Grid): grid to update, which becomes the grid followed
+                (default: the current one)
+            fit (bool): fit the new curves
+            kwarg: passed to Grid.fit
+
+        Returns:
+            list. the new BEESFit
+        """
+        if grid is not None and grid is not self.grid:
+            self.grid = grid
+            self.position = len(grid.bees)//2
+        grid = self.grid
+        #indexed by the positions (see init_grid)
+        indexed = len(grid.xs) > 0
+        bees = self.read()
+        new = grid.append(bees)
+        if indexed and new:
+            grid.update_dict()
+        if fit and new:
+            grid.fit(beesfit=new, **kwarg)
+        return new
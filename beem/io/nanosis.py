@@ -1,6 +1,41 @@
 import numpy as np
 import datetime
+import io
+import multiprocessing as mp
+import warnings
+from types import MappingProxyType
+from functools import lru_cache
 from beem.experiment import BEESData, Grid, IV, MODE
+from beem.experiment import instrument
+
+_HEADER = {
+        'Date': lambda x: {'date' : datetime.datetime.strptime(
+                x[1] + ' ' + x[2], '%d.%m.%Y %H:%M:%S')},
+        'X': lambda x: {'pos_x': np.double(x[2])},
+        'Y': lambda x: {'pos_y': np.double(x[2])},
+        }
+
+@lru_cache(maxsize=64)
+def _column_index(line):
+    """Index of each column of a header line (shared by all the files with
+    the same columns, so read only)"""
+    header_list=line.rstrip().split('\t')
+    return MappingProxyType(dict(zip(header_list, range(len(header_list)))))
+
+def _parse_block(body, columns):
+    """Parse a block of numbers separated by tabs and new lines in a
+    (lines x columns) array"""
+    try:
+        with warnings.catch_warnings():
+            #fromstring stops at the first token which is not a number
+            warnings.simplefilter('error', DeprecationWarning)
+            data=np.fromstring(body, sep=' ')
+    except (DeprecationWarning, ValueError):
+        data=None
+    if data is None or data.size % columns:
+        #Something else than numbers (missing values...): slow path
+        return np.genfromtxt(io.BytesIO(body))
+    return data.reshape(-1, columns)
 
 def _file2data(filename, lastHeader="[DATA]"):
     """Function to read data from ASCII file with header
@@ -16,26 +51,21 @@ def _file2data(filename, lastHeader="[DATA]"):
 
     while line.rstrip()!=lastHeader:
         split_line = line.split()
-        if not(not(split_line)):
-            dico.update({
-            'Date': lambda x: {'date' : datetime.datetime.strptime(
-                    x[1] + ' ' + x[2], '%d.%m.%Y %H:%M:%S')},
-            'X': lambda x: {'pos_x': np.double(x[2])},
-            'Y': lambda x: {'pos_y': np.double(x[2])},
-            }.get(split_line[0],lambda x: {})(split_line))
+        if not(not(split_line)) and split_line[0] in _HEADER:
+            dico.update(_HEADER[split_line[0]](split_line))
 
         line = fid.readline().decode('utf_8')
 
     line=fid.readline().decode('utf_8')
-    header_list=line.rstrip().split('\t')
-    name=dict(zip(header_list, range(len(header_list))))
+    name=_column_index(line)
 
-    data=np.genfromtxt(fid)
+    data=_parse_block(fid.read(), len(name))
 
     fid.close()
 
     return data, name, dico
 
+@instrument.recorded('bees_from_file')
 def bees_from_file(filename,dic={'beem':'BEEM Current'}):
     data, name, dico = _file2data(filename)
     BEES=[]
@@ -73,37 +103,79 @@ def bees_from_file(filename,dic={'beem':'BEEM Current'}):
 
             i+=1
 
+    instrument.count('curves', len(BEES))
     return BEES
 
 
-def grid_from_files(filenames, dic=None):
+def _bees_from_file(args):
+    filename, dic = args
+    if dic==None:
+        return bees_from_file(filename)
+    return bees_from_file(filename, dic)
+
+@instrument.recorded('grid_from_files')
+def grid_from_files(filenames, dic=None, threads=1):
+    """Read many BEES files in one Grid
+
+    Args:
+        filenames (list): files to read
+        dic (dict): see bees_from_file
+        threads (int): number of process parsing the files (-1 for one per
+            core)
+    """
     g = Grid()
-    for f in filenames:
-        if dic==None:
-            b = bees_from_file(f)
-        else:
-            b = bees_from_file(f, dic)
+    args = [(f, dic) for f in filenames]
+    if threads==1:
+        bees = map(_bees_from_file, args)
+    else:
+        threads = mp.cpu_count() if threads==-1 else threads
+        with mp.Pool(threads) as p:
+            bees = p.map(_bees_from_file, args,
+                         chunksize=max(1, len(args)//(4*threads)))
+    for b in bees:
         g.bees += b
+    instrument.count('curves', len(g.bees))
     return g
 
 
-def _iv_from_file(filename,dic={}):
-    if not('Current' in dic):
-        dic['Current']='IV Current'
+def _iv_from_file(args):
+    filename, dic = args
     data,name,other=_file2data(filename)
-    a=[IV(),IV()]
+    current=dic.get('Current','IV Current')
+    a=[IV(src_files=filename,**other),IV(src_files=filename,**other)]
     a[0].V=data[:,name['Bias (V)']]
     a[1].V=data[:,name['Bias [bwd] (V)']]
-    a[0].I=data[:,name[dic['Current'] + ' (A)']]
-    a[1].I=data[:,name[dic['Current'] + ' [bwd] (A)']]
+    a[0].I=data[:,name[current + ' (A)']]
+    a[1].I=data[:,name[current + ' [bwd] (A)']]
     a[1].mode=MODE['bwd']
     return a
 
-def iv_from_file(filenames, dic={}):
-    list = []
-    if not isinstance(filename,list):
-        filename = [filename]
-    for filename in filenames:
-        list += iv_from_file(filename,dic)
-    return list
+@instrument.recorded('iv_from_file')
+def iv_from_file(filenames, dic={}, threads=1):
+    """Read the forward and backward IV curves of one or many files
 
+    Args:
+        filenames (str or list): files to read
+        dic (dict): name of the current channel ({'Current':'IV Current'} by
+            default)
+        threads (int): number of process parsing the files (-1 for one per
+            core)
+
+    Returns:
+        list. IV of all the files in order (forward then backward of each)
+    """
+    if isinstance(filenames,str):
+        filenames=[filenames]
+    args=[(f, dic) for f in filenames]
+    if threads==1 or len(args)<2:
+        ivs=map(_iv_from_file, args)
+    else:
+        threads=mp.cpu_count() if threads==-1 else threads
+        with mp.Pool(threads) as p:
+            ivs=p.map(_iv_from_file, args,
+                      chunksize=max(1, len(args)//(4*threads)))
+    out=[]
+    for a in ivs:
+        out+=a
+    instrument.count('curves', len(out))
+    return out
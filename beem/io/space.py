@@ -1,7 +1,48 @@
+"""Module to save and load a work space.
+
+A Grid is saved in a folder holding a JSON manifest and one .npy file per
+array (raw channels, indexes, fit parameters, errors and fit windows), so it
+can be loaded with a memory map or partially (one sweep and/or mode). Other
+objects, and the files written by old versions, are gzip pickles.
+"""
+
 import gzip
 import pickle
+import json
+import datetime
+import os
+from os.path import join, isdir
+import numpy as np
+
+from beem.experiment import Grid, BEESFit
+from beem.experiment import bees_fit, filters
+from beem.experiment.grid_store import GridStore
+
+FORMAT = 'pybeem-space'
+VERSION = 1
+
+GRID_ATTR = ['pos_x', 'pos_y', 'sample', 'device', 'src_files', 'size_x',
+             'size_y', 'num_x', 'num_y', 'num_pass', 'num_sweep', 'completed']
+FIT_ATTR = ['noise', 'noise_err', 'bias_min', 'bias_max', 'n', 'range',
+            'auto_range', 'method']
+FIT_LIST_ATTR = ['barrier_height', 'trans_a', 'barrier_height_err',
+                 'trans_a_err']
+
+
+def save_space(filenames, space, comp=True, format=None):
+    """Save a work space
+
+    Args:
+        filenames (str): file (or folder for a Grid) to write
+        space: object to save
+        comp (bool): compress the pickle
+        format (str): 'npy' (default for a Grid) or 'pickle'
+    """
+    if format is None:
+        format = 'npy' if isinstance(space, Grid) else 'pickle'
+    if format == 'npy':
+        return _save_grid(filenames, space)
 
-def save_space(filenames, space, comp=True):
     if comp:
         f = gzip.open(filenames,'wb')
     else:
@@ -9,7 +50,19 @@ def save_space(filenames, space, comp=True):
     pickle.dump(space, f, protocol=3)
     f.close()
 
-def load_space(filenames):
+
+def load_space(filenames, mmap_mode=None, sweep=None, mode=None):
+    """Load a work space saved by save_space
+
+    Args:
+        filenames (str): file or folder to read
+        mmap_mode (str): memory map the arrays of a Grid (see numpy.load)
+        sweep (int): only load this sweep of a Grid
+        mode (int): only load this mode (MODE['fwd'] or MODE['bwd'])
+    """
+    if isdir(filenames):
+        return _load_grid(filenames, mmap_mode, sweep, mode)
+
     try:
         f = gzip.open(filenames, 'rb')
         a=pickle.load(f)
@@ -19,3 +72,189 @@ def load_space(filenames):
         a=pickle.load(f)
     f.close()
     return a
+
+
+def _date2str(date):
+    if date is None:
+        return None
+    return date.isoformat()
+
+
+def _str2date(date):
+    if not date:
+        return None
+    for fmt in ['%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S']:
+        try:
+            return datetime.datetime.strptime(date, fmt)
+        except ValueError:
+            pass
+    return None
+
+
+def _json(x):
+    if hasattr(x, 'tolist'):
+        return x.tolist()
+    return str(x)
+
+
+def _save_grid(folder, grid):
+    if not isdir(folder):
+        os.makedirs(folder)
+
+    def save(name, array):
+        np.save(join(folder, name + '.npy'), np.asarray(array))
+
+    #Raw data, one row per bees
+    bees = grid.bees
+    row = dict((id(b), i) for i, b in enumerate(bees))
+    length = np.array([len(b.bias) for b in bees], dtype=int)
+    if grid.columnar:
+        for x in GridStore.CHANNELS:
+            save(x, grid.store.array(x))
+        for x in GridStore.INDEXES:
+            save(x, getattr(grid.store, x))
+    else:
+        for x in GridStore.CHANNELS:
+            data = np.empty((len(bees), length.max() if len(bees) else 0))
+            data[:] = np.nan
+            for i, b in enumerate(bees):
+                if getattr(b, x) is not None:
+                    data[i, :length[i]] = getattr(b, x)
+            save(x, data)
+        for x in GridStore.INDEXES:
+            save(x, [np.nan if getattr(b, x) is None else getattr(b, x)
+                     for b in bees])
+    save('length', length)
+    save('date', [_date2str(b.date) or '' for b in bees])
+
+    #Fit results, one row per beesfit
+    fits = [b for b in grid.beesfit if all(id(x) in row for x in b.data)]
+    num_data = max([len(b.data) for b in fits] + [0])
+    data = -np.ones((len(fits), num_data), dtype=int)
+    for i, b in enumerate(fits):
+        data[i, :len(b.data)] = [row[id(x)] for x in b.data]
+    save('fit_data', data)
+    for x in FIT_ATTR:
+        save(x, [np.nan if getattr(b, x) is None else getattr(b, x)
+                 for b in fits])
+    nb = max([len(b.barrier_height) for b in fits] + [1])
+    for x in FIT_LIST_ATTR:
+        val = np.empty((len(fits), nb))
+        val[:] = np.nan
+        for i, b in enumerate(fits):
+            v = getattr(b, x)
+            if v[0] is not None:
+                val[i, :len(v)] = v
+        save(x, val)
+
+    manifest = {'format': FORMAT,
+                'version': VERSION,
+                'date': _date2str(grid.date),
+                'combine': [getattr(b.combine, '__name__', None)
+                            for b in fits[:1]],
+                'grid': dict((x, getattr(grid, x, None)) for x in GRID_ATTR)}
+    save('xs', grid.xs)
+    save('ys', grid.ys)
+    with open(join(folder, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1, default=_json)
+
+
+def _load_grid(folder, mmap_mode=None, sweep=None, mode=None):
+    with open(join(folder, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FORMAT:
+        raise IOError('%s is not a pybeem space' % folder)
+
+    def load(name, mmap=None):
+        return np.load(join(folder, name + '.npy'), mmap_mode=mmap)
+
+    grid = Grid()
+    for x, v in manifest['grid'].items():
+        setattr(grid, x, v)
+    grid.date = _str2date(manifest['date'])
+    grid.xs = load('xs')
+    grid.ys = load('ys')
+
+    #Select the curves to load
+    index = dict((x, load(x)) for x in GridStore.INDEXES)
+    keep = np.ones(len(index['mode']), dtype=bool)
+    if sweep is not None:
+        keep &= index['number'] == sweep
+    if mode is not None:
+        keep &= index['mode'] == mode
+    rows = np.flatnonzero(keep)
+    partial = len(rows) != len(keep)
+
+    channels = dict()
+    for x in GridStore.CHANNELS:
+        c = load(x, mmap_mode)
+        channels[x] = c[rows] if partial else c
+    date = np.array([_str2date(d) for d in load('date')[rows]], dtype=object)
+    if len(date) and all(d == date[0] for d in date):
+        date = date[0]
+    store = GridStore(mode=index['mode'][rows], number=index['number'][rows],
+                      pos_x=index['pos_x'][rows], pos_y=index['pos_y'][rows],
+                      date=date, src_files=grid.src_files, sample=grid.sample,
+                      device=grid.device, **channels)
+    for x in ['x_index', 'y_index', 'pass_number']:
+        getattr(store, x)[:] = index[x][rows]
+    grid.store = store
+    grid.bees = store.views()
+    length = load('length')[rows]
+    if np.any(length < store.bias.shape[-1]):
+        ## curves of different length: plain arrays for the shorter ones
+        from beem.experiment import BEESData
+        for i in np.flatnonzero(length < store.bias.shape[-1]):
+            b = grid.bees[i]
+            grid.bees[i] = BEESData(bias=b.bias[:length[i]],
+                    i_beem=b.i_beem[:length[i]],
+                    i_tunnel=b.i_tunnel[:length[i]],
+                    pos_z=b.pos_z[:length[i]], mode=b.mode, number=b.number,
+                    pos_x=b.pos_x, pos_y=b.pos_y, date=b.date,
+                    src_files=b.src_files, sample=b.sample, device=b.device)
+            for x in ['x_index', 'y_index', 'pass_number']:
+                setattr(grid.bees[i], x, getattr(b, x))
+
+    #Rebuild the BEESFit
+    new_row = -np.ones(len(keep), dtype=int)
+    new_row[rows] = np.arange(len(rows))
+    fit_data = load('fit_data')
+    fit_data = np.where(fit_data >= 0, new_row[np.maximum(fit_data, 0)], -2)
+    fits = np.flatnonzero(np.all(fit_data != -1, 1))
+    combine = manifest['combine'][0] if manifest['combine'] else None
+    combine = getattr(bees_fit, combine or 'combine_mean', None) or \
+            getattr(filters, combine, None) or bees_fit.combine_mean
+    val = dict((x, load(x)[fits]) for x in FIT_ATTR + FIT_LIST_ATTR)
+
+    for i, f in enumerate(fits):
+        b = BEESFit([grid.bees[k] for k in fit_data[f] if k >= 0])
+        b.combine = combine
+        for x in FIT_ATTR:
+            v = val[x][i]
+            setattr(b, x, None if np.isnan(v) else v.item())
+        b.auto_range = bool(b.auto_range)
+        b.method = int(b.method)
+        bh = val['barrier_height'][i]
+        if np.isnan(bh[0]):
+            b.noise = None
+            b.barrier_height = [None]
+            b.trans_a = [None]
+            b.noise_err = np.inf
+            b.barrier_height_err = [np.inf]
+            b.trans_a_err = [np.inf]
+        else:
+            nb = np.sum(~np.isnan(bh))
+            for x in FIT_LIST_ATTR:
+                setattr(b, x, val[x][i][:nb])
+        grid.beesfit.append(b)
+
+    grid.bees_dict = dict()
+    for b in grid.bees:
+        b.set_id()
+        b.parent = grid
+        grid.bees_dict[b.id] = b
+    for b in grid.beesfit:
+        b.set_id()
+        b.parent = grid
+        grid.beesfit_dict[b.id] = b
+    return grid
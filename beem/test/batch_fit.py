@@ -0,0 +1,63 @@
+from beem.experiment import BEESData, BEESFit, Grid
+from beem.experiment.batch_fit import fit_beesfit
+from beem.experiment.parallel import FitPool
+from beem.test.benchmark import synthetic
+import numpy as np
+
+def test_batch_fit():
+    bias, params, i_beem = synthetic(50, 200, barrier_height=-0.9)
+    bh = params[:, 1]
+    fits = [BEESFit(BEESData(bias=bias, i_beem=y)) for y in i_beem]
+    fit_beesfit(fits)
+    found = np.array([b.barrier_height[0] for b in fits])
+    err = np.array([b.barrier_height_err[0] for b in fits])
+    assert np.all(np.abs(found-bh) < 5*err)
+    assert np.all(err < 0.05)
+
+def test_pool():
+    bias, params, i_beem = synthetic(3, 100, noise=0,
+                                     barrier_height=[-0.85, -0.9, -1.0])
+    fits = [BEESFit(BEESData(bias=bias, i_beem=y)) for y in i_beem]
+    pool = FitPool(2, chunksize=2)
+    try:
+        pool.fit(fits)
+        name = pool._shm.name
+        pool.fit(fits)
+        ## the shared memory is reused for the same curves only
+        assert pool._shm.name == name
+        pool.fit(fits[:2])
+        assert pool._shm.name != name
+    finally:
+        pool.close()
+    assert pool._shm is None
+    found = [b.barrier_height[0] for b in fits]
+    assert np.allclose(found, params[:, 1], atol=1e-3)
+
+def test_quality():
+    bias, params, i_beem = synthetic(3, 100,
+                                     barrier_height=[-0.85, -0.9, -1.0])
+    g = Grid()
+    g.bees = [BEESData(bias=bias, i_beem=y) for y in i_beem]
+    g.normal_fit()
+    g.fit(backend='batch')
+    q = g.fit_quality()
+    assert g.fit_quality() is q and np.all(q['r_squared'] > 0.9)
+    assert len(g.extract_good()) == 3
+    ## a fit or a setting of one curve changes the quality
+    b = g.beesfit[1]
+    b.update({'barrier_height':[-0.5]})
+    r2 = g.fit_quality()['r_squared']
+    assert r2[1] < q['r_squared'][1] and len(g.extract_good(0.9)) == 2
+    b.fit_update()
+    assert np.isclose(g.fit_quality()['r_squared'][1], q['r_squared'][1],
+                      atol=1e-3)
+    ## data changed in place: only seen when asked for
+    q = g.fit_quality()
+    b.data[0].i_beem *= 2
+    assert g.fit_quality() is q
+    assert g.fit_quality(update=True)['r_squared'][1] < q['r_squared'][1]
+
+if __name__ == "__main__":
+    test_batch_fit()
+    test_pool()
+    test_quality()
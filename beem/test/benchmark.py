@@ -0,0 +1,283 @@
+"""Benchmark of the loading, fitting, saving and export of synthetic grids made
+of Bell-Kaiser curves. The results are written in a JSON file to compare the
+runs (C and pure python code, backends, versions).
+
+Usage:
+    python -m beem.test.benchmark [output.json]
+    python -m beem.test.benchmark kernels
+"""
+
+import json
+import multiprocessing as mp
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+from beem.experiment import use_pure_c
+from beem.experiment import experiment
+from beem.experiment import _pure_python
+from beem.io import grid_from_3ds, bees_from_file, grid_from_files
+from beem.io import save_space, load_space, grid2csv
+
+CHANNELS = ['Bias (V)', 'Current (A)', 'BEEM Current (A)', 'Z (m)',
+            'Bias [bwd] (V)', 'Current [bwd] (A)', 'BEEM Current [bwd] (A)',
+            'Z [bwd] (m)']
+
+
+def synthetic(num, points=300, barriers=1, noise=2e-12, n=2, seed=0,
+              barrier_height=-0.8):
+    """Generate Bell-Kaiser curves
+
+    Args:
+        num (int): number of curves
+        points (int): number of points of the bias sweep (-0.2 to -1.6 V)
+        barriers (int): number of barrier heights
+        noise (float): standard deviation of the gaussian noise (A)
+        n (float): exponent of the model
+        seed (int): seed of the random generator
+        barrier_height (float or ndarray): mean first barrier height (of
+            each curve), the others are 0.3 V lower
+
+    Returns:
+        tuple. bias (points), parameters (num x 1+2*barriers) and BEEM current
+        (num x points)
+    """
+    r = np.random.RandomState(seed)
+    bias = np.linspace(-0.2, -1.6, points)
+    params = np.empty((num, 1+2*barriers))
+    params[:, 0] = 1e-10
+    bh = np.reshape(barrier_height, (-1, 1)) - 0.3*np.arange(barriers)
+    params[:, 1:barriers+1] = bh + r.normal(0, 0.03, (num, barriers))
+    params[:, barriers+1:] = 2e-10
+    i_beem = _pure_python.bell_kaiser_v_batch(bias, n, params)
+    return bias, params, i_beem + r.normal(0, noise, i_beem.shape)
+
+
+def write_3ds(filename, num_x, num_y, points=300, **kwarg):
+    """Write a synthetic Nanonis grid (forward and backward sweeps), kwarg are
+    passed to :func:`synthetic`"""
+    num = num_x*num_y
+    bias, params, i_beem = synthetic(2*num, points, **kwarg)
+    i_tunnel = 1e-9 + np.zeros(i_beem.shape)
+    x, y = np.meshgrid(np.arange(num_x)*1e-9, np.arange(num_y)*1e-9)
+    data = [np.tile([bias[0], bias[-1]], (num, 1)), x.reshape(-1, 1),
+            y.reshape(-1, 1), np.zeros((num, 1))]
+    for k in range(2):
+        data += [np.tile(bias, (num, 1)), i_tunnel[k::2], i_beem[k::2],
+                 np.zeros((num, points))]
+    head = ('Grid dim="%d x %d"\r\n'
+            'Grid settings=0;0;%g;%g;0\r\n'
+            'Fixed parameters="Sweep Start;Sweep End"\r\n'
+            'Experiment parameters="X (m);Y (m);Z (m)"\r\n'
+            'Points=%d\r\n'
+            'Channels="%s"\r\n'
+            ':HEADER_END:\r\n') % (num_x, num_y, num_x*1e-9, num_y*1e-9,
+                                   points, ';'.join(CHANNELS))
+    with open(filename, 'wb') as f:
+        f.write(head.encode())
+        f.write(np.hstack(data).astype('>f4').tobytes())
+
+
+def write_dat(filename, points=300, sweeps=2, x=0., y=0., **kwarg):
+    """Write a synthetic Nanonis spectroscopy file, kwarg are passed to
+    :func:`synthetic`"""
+    bias, params, i_beem = synthetic(2*sweeps, points, **kwarg)
+    names = []
+    cols = []
+    for i in range(sweeps):
+        for k, d in enumerate(['', ' [bwd]']):
+            for c, v in [('Bias', bias), ('Current', 1e-9+0*bias),
+                         ('BEEM Current', i_beem[2*i+k]), ('Z', 0*bias)]:
+                unit = {'Bias':'(V)', 'Z':'(m)'}.get(c, '(A)')
+                names.append('%s [%05i]%s %s' % (c, i+1, d, unit))
+                cols.append(v)
+    with open(filename, 'w') as f:
+        f.write('Experiment\tbias spectroscopy\n'
+                'Date\t26.12.2012 10:00:00\n'
+                'X (m)\t%g\nY (m)\t%g\n\n[DATA]\n' % (x, y))
+        f.write('\t'.join(names)+'\n')
+        np.savetxt(f, np.array(cols).T, delimiter='\t', fmt='%.6E')
+
+
+def _time(func, repeat=3):
+    """Best time of repeat calls of func and its last result"""
+    best = np.inf
+    for i in range(repeat):
+        t = time.perf_counter()
+        res = func()
+        best = min(best, time.perf_counter()-t)
+    return best, res
+
+
+def _fitted_grid(filename):
+    grid = grid_from_3ds(filename)
+    grid.normal_fit()
+    grid.update_dict()
+    return grid
+
+
+def _summary(grid):
+    bh = np.array([np.nan if b.barrier_height[0] is None else
+                   b.barrier_height[0] for b in grid.beesfit], dtype=float)
+    return {'failed':int(np.isnan(bh).sum()),
+            'barrier_height':float(np.nanmedian(bh))}
+
+
+def kernels(curves=1024, points=300, barriers=1,
+            ns=[0.5, 1, 1.5, 2, 2.5, 3, 2.2], repeat=5):
+    """Micro-benchmark of the C kernel of the Bell-Kaiser V model against the
+    reference kernel (test on each point, pow for any n)
+
+    Returns:
+        list. one dictionary for each n with the times of both kernels (s)
+    """
+    from beem.experiment import _pure_c
+    bias, params, i_beem = synthetic(curves, points, barriers)
+    out = np.empty(i_beem.shape)
+    results = []
+    for n in ns:
+        t_ref = _time(lambda: _pure_c.bell_kaiser_v_reference(bias, n, params,
+                                                             out), repeat)[0]
+        t = _time(lambda: _pure_c.bell_kaiser_v_batch(bias, n, params, out),
+                  repeat)[0]
+        results.append({'name':'kernel', 'n':n, 'curves':curves,
+                        'points':points, 'barriers':barriers,
+                        'time_reference':t_ref, 'time':t, 'speedup':t_ref/t})
+    return results
+
+
+def run(folder, size=24, points=300, barriers=1, noise=2e-12,
+        backends=[None, 'batch', 'threads', 'process'], threads=[1, -1],
+        repeat=3):
+    """Run the benchmarks with the code in use (C or pure python)
+
+    Args:
+        folder (str): folder for the files written
+        size (int): the grid is size x size
+        points, barriers, noise: see :func:`synthetic`
+        backends (list): backends of Grid.fit
+        threads (list): numbers of threads (or process) tried
+        repeat (int): the best time of repeat runs is kept
+
+    Returns:
+        list. one dictionary for each benchmark
+    """
+    results = []
+    def add(name, t, **kwarg):
+        kwarg.update({'name':name, 'time':t,
+                      'pure_c':experiment._use_pure_c})
+        results.append(kwarg)
+
+    kw = {'barriers':barriers, 'noise':noise}
+    fn = os.path.join(folder, 'grid.3ds')
+    write_3ds(fn, size, size, points, **kw)
+    dat = [os.path.join(folder, 'bees_%03d.dat' % i) for i in range(16)]
+    for i, f in enumerate(dat):
+        write_dat(f, points, x=i*1e-9, seed=i, **kw)
+    curves = 2*size*size
+
+    add('grid_from_3ds', _time(lambda: grid_from_3ds(fn), repeat)[0],
+        curves=curves)
+    add('grid_from_3ds_mmap', _time(lambda: grid_from_3ds(fn, mmap=True),
+                                    repeat)[0], curves=curves)
+    add('bees_from_file', _time(lambda: bees_from_file(dat[0]), repeat)[0],
+        curves=4)
+    add('grid_from_files', _time(lambda: grid_from_files(dat), repeat)[0],
+        curves=4*len(dat))
+
+    grid = _fitted_grid(fn)
+    b = grid.beesfit[0]
+    p0 = {'barrier_height':[-0.8-0.3*i for i in range(barriers)],
+          'trans_a':[0.001]*barriers}
+    add('fit_single', _time(lambda: b.fit(**p0), repeat)[0], curves=1)
+
+    for backend in backends:
+        for t in threads if backend in ['threads', 'process'] else [1]:
+            def fit():
+                g = _fitted_grid(fn)
+                start = time.perf_counter()
+                g.fit(threads=t, backend=backend, **p0)
+                g.close_pool()
+                return time.perf_counter()-start, g
+            best = np.inf
+            for i in range(repeat):
+                dt, grid = fit()
+                best = min(best, dt)
+            add('fit_grid', best, curves=curves, backend=backend, threads=t,
+                **_summary(grid))
+
+    space = os.path.join(folder, 'space')
+    add('save_space', _time(lambda: save_space(space, grid), repeat)[0],
+        curves=curves)
+    add('load_space', _time(lambda: load_space(space), repeat)[0],
+        curves=curves)
+    add('load_space_mmap', _time(lambda: load_space(space, mmap_mode='r'),
+                                 repeat)[0], curves=curves)
+    add('fit_quality', _time(lambda: grid.fit_quality(True), repeat)[0],
+        curves=curves)
+    add('grid2csv_long', _time(lambda: grid2csv(os.path.join(folder,
+        'grid.csv'), grid, 'fit', layout='long'), repeat)[0], curves=curves)
+    def folder_csv():
+        f = os.path.join(folder, 'csv')
+        shutil.rmtree(f, ignore_errors=True)
+        grid2csv(f, grid, 'fit')
+    add('grid2csv_folder', _time(folder_csv, 1)[0], curves=curves)
+    if experiment._use_pure_c:
+        results += kernels(points=points, barriers=barriers)
+    return results
+
+
+def test_synthetic():
+    folder = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(folder, 'grid.3ds')
+        write_3ds(fn, 4, 3, 200)
+        grid = _fitted_grid(fn)
+        assert len(grid.bees) == 24 and grid.num_x == 4 and grid.num_y == 3
+        grid.fit(backend='batch')
+        bh = np.array([b.barrier_height[0] for b in grid.beesfit])
+        params = synthetic(24, 200)[1]
+        assert np.all(np.abs(bh - params[:, 1]) < 0.05)
+        write_dat(os.path.join(folder, 'bees.dat'), 200)
+        assert len(bees_from_file(os.path.join(folder, 'bees.dat'))) == 4
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def main(output='benchmark.json', pure_c=[True, False], **kwarg):
+    """Run the benchmarks with the C and the pure python code and write the
+    results in output (JSON)"""
+    folder = tempfile.mkdtemp()
+    results = []
+    try:
+        for c in pure_c:
+            use_pure_c(c)
+            results += run(folder, **kwarg)
+    finally:
+        use_pure_c(True)
+        shutil.rmtree(folder, ignore_errors=True)
+    report = {'date':time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'platform':platform.platform(),
+              'python':platform.python_version(),
+              'numpy':np.__version__,
+              'cpu_count':mp.cpu_count(),
+              'parameters':kwarg,
+              'results':results}
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1)
+    return report
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'test':
+        test_synthetic()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'kernels':
+        for r in kernels():
+            print('n=%(n)-4g reference %(time_reference).4f s, '
+                  'specialized %(time).4f s (x%(speedup).2f)' % r)
+    else:
+        main(*sys.argv[1:])
@@ -0,0 +1,35 @@
+from beem.experiment import BEESData, BEESFit, Grid, use_cache
+from beem.test.benchmark import synthetic
+import numpy as np
+import tempfile
+import os
+
+def test_cache():
+    bias, _, i_beem = synthetic(1, 200, barrier_height=-0.9)
+    i_beem = i_beem[0]
+    cache = use_cache(path=os.path.join(tempfile.mkdtemp(), 'cache.sqlite'))
+    try:
+        a = BEESFit(BEESData(bias=bias, i_beem=i_beem))
+        a.fit_update()
+        b = BEESFit(BEESData(bias=bias, i_beem=i_beem))
+        b.fit_update()
+        assert cache.hits == 1 and cache.misses == 1
+        assert np.all(a.barrier_height == b.barrier_height)
+        assert a.bias_min == b.bias_min
+        b.n = 1.5
+        b.fit_update()
+        assert cache.misses == 2
+        ## the batched solver does not share the results of MINPACK
+        g = Grid()
+        g.bees = [BEESData(bias=bias, i_beem=i_beem)]
+        g.normal_fit()
+        g.fit(backend='batch')
+        assert cache.hits == 1 and cache.misses == 3
+        g.fit(backend='threads', threads=2)
+        g.fit()
+        assert cache.hits == 3 and cache.misses == 3
+    finally:
+        use_cache(False)
+
+if __name__ == "__main__":
+    test_cache()
@@ -0,0 +1,49 @@
+import io
+import os
+import shutil
+import tempfile
+from beem.io import grid_from_3ds, grid2csv
+from beem.test.benchmark import write_3ds
+import numpy as np
+
+def test_long():
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, 'grid.3ds')
+        write_3ds(path, 4, 3, points=100)
+        g = grid_from_3ds(path)
+        g.normal_fit()
+        g.update_dict()
+        g.fit(backend='batch')
+        g.beesfit[3].update({'barrier_height':[None], 'trans_a':[None],
+                             'noise':None})
+        out = os.path.join(folder, 'grid.csv')
+        grid2csv(out, g, mode='fit', layout='long', chunk=5)
+        with open(out) as f:
+            text = f.read()
+        head, curves = text.split('[CURVES]\n')
+        summary = np.genfromtxt(io.StringIO(head.split('[SUMMARY]\n')[1]),
+                                delimiter=';', skip_header=1)
+        curves = np.genfromtxt(io.StringIO(curves), delimiter=';',
+                               skip_header=1)
+        assert summary.shape == (len(g.beesfit), 9)
+        for k, x in enumerate(['x_index', 'y_index', 'number',
+                               'pass_number', 'mode']):
+            assert np.array_equal(summary[:, k+1],
+                                  [getattr(b, x) for b in g.beesfit])
+        params = g.params()
+        assert np.allclose(summary[:, 7], params[:, 1], atol=1e-4,
+                           equal_nan=True)
+        assert np.isnan(summary[3, 7])
+        assert len(curves) == sum(len(b.bias) for b in g.beesfit)
+        assert np.array_equal(np.bincount(curves[:, 0].astype(int)),
+                              [len(b.bias) for b in g.beesfit])
+        ## the fitted current is only given in the fit window
+        window = g._window(g.stack('bias'), g.beesfit)
+        window[np.isnan(params[:, 1])] = False
+        assert np.sum(~np.isnan(curves[:, 3])) == window.sum()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_long()
@@ -0,0 +1,16 @@
+from beem.experiment.filters import Pipeline, hampel, savgol, median
+import numpy as np
+
+def test_filters():
+    r = np.random.RandomState(0)
+    x = np.cumsum(r.normal(0, 1, (20, 100)), 1)
+    spiked = x.copy()
+    spiked[np.arange(20), r.randint(5, 95, 20)] += 100
+    assert np.abs(hampel(spiked) - x).max() < 20
+    p = Pipeline(hampel, (savgol, {'width':9}), (median, {'width':3}))
+    batch = p(spiked)
+    for i in range(len(x)):
+        assert np.allclose(batch[i], p(spiked[i]))
+
+if __name__ == "__main__":
+    test_filters()
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+from beem.io import grid_from_3ds, Grid3dsReader
+from beem.test.benchmark import write_3ds
+import numpy as np
+
+def test_mmap():
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, 'grid.3ds')
+        write_3ds(path, 6, 5, points=120)
+        a = grid_from_3ds(path)
+        b = grid_from_3ds(path, mmap=True)
+        assert len(a.bees) == len(b.bees) == 60
+        for x, y in zip(a.bees, b.bees):
+            assert np.array_equal(x.bias, y.bias)
+            assert np.array_equal(x.i_beem, y.i_beem)
+            assert x.mode == y.mode
+        for g in [a, b]:
+            g.normal_fit()
+            g.update_dict()
+            g.fit(backend='batch')
+        assert np.array_equal(a.params(), b.params(), equal_nan=True)
+        del b
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+def test_reader():
+    folder = tempfile.mkdtemp()
+    try:
+        full = os.path.join(folder, 'full.3ds')
+        path = os.path.join(folder, 'grid.3ds')
+        write_3ds(full, 6, 5, points=120)
+        with open(full, 'rb') as f:
+            raw = f.read()
+        head = raw.index(b':HEADER_END:\r\n')+14
+        point = (len(raw)-head)//30
+        ## the file acquired up to the middle of the second row
+        with open(path, 'wb') as f:
+            f.write(raw[:head+8*point+point//2])
+        g = grid_from_3ds(path)
+        g.normal_fit()
+        g.update_dict()
+        reader = Grid3dsReader(path, grid=g)
+        for k in [8, 13, 29, 30]:
+            with open(path, 'wb') as f:
+                f.write(raw[:head+k*point])
+            before = len(g.beesfit)
+            new = reader.update(fit=False)
+            assert len(new) == 2*k-before and len(g.beesfit) == 2*k
+        assert g.completed and reader.update(fit=False) == []
+        ref = grid_from_3ds(full)
+        ref.normal_fit()
+        ref.update_dict()
+        assert len(g.beesfit) == len(g.beesfit_dict) == len(ref.beesfit)
+        assert sorted(str(b.id) for b in g.beesfit) == \
+                sorted(str(b.id) for b in ref.beesfit)
+        for b in ref.beesfit:
+            assert g.find(b.id).get_reverse_mode().id == b.id.switch_mode()
+        ## a reader on its own grid, updated to a grid of the same file
+        a = grid_from_3ds(path)
+        a.normal_fit()
+        a.update_dict()
+        assert Grid3dsReader(path).update(grid=a, fit=False) == []
+        assert len(a.beesfit) == 60
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_mmap()
+    test_reader()
@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+from beem.experiment import IV
+from beem.experiment.iv import fit_iv
+from beem.io import iv_from_file
+from beem.io.nanosis import _file2data
+import numpy as np
+
+def _synthetic(num=200, seed=0):
+    r = np.random.RandomState(seed)
+    V = np.linspace(-0.3, 0.4, 150)
+    ivs = []
+    for i in range(num):
+        x = IV()
+        x.Vbh, x.n_true = r.normal(0.8, 0.02), r.normal(1.1, 0.05)
+        x.V = V
+        x.I = IV.schottky_richardson(V, x.Vbh, x.n_true, x.Is, x.KbT) * \
+                np.exp(r.normal(0, 0.01, len(V)))
+        x.Vmin, x.Vmax = 0.05, 0.35
+        ivs.append(x)
+    return ivs
+
+def test_fit():
+    ivs = _synthetic()
+    res = fit_iv(ivs)
+    assert np.all(np.abs(res['barrier_height'] -
+                         [x.Vbh for x in ivs]) < 5*res['barrier_height_err'])
+    assert np.all(np.abs(res['n']-[x.n_true for x in ivs]) < 5*res['n_err'])
+    assert np.all(res['r_squared'] > 0.99)
+    ## same minimum from other initial values and with IV.fit
+    x = ivs[0]
+    x.fit(0.6, 1.5)
+    assert np.isclose(x.barrier_height, res['barrier_height'][0], atol=1e-8)
+    assert np.isclose(x.n, res['n'][0], atol=1e-8)
+    x.Vmax = x.Vmin
+    x.fit()
+    assert np.isnan(x.barrier_height)
+    assert len(fit_iv([])['barrier_height']) == 0
+
+def test_iv_from_file():
+    folder = tempfile.mkdtemp()
+    try:
+        files = []
+        for k in range(3):
+            V = np.linspace(0, 0.5, 20)
+            f = os.path.join(folder, 'iv%d.dat' % k)
+            with open(f, 'w') as fid:
+                fid.write('Date\t26.12.2012 10:00:0%d\n\n[DATA]\n' % k)
+                fid.write('Bias (V)\tIV Current (A)\tBias [bwd] (V)\t'
+                          'IV Current [bwd] (A)\n')
+                np.savetxt(fid, np.c_[V, V*k, V, -V], delimiter='\t')
+            files.append(f)
+        ivs = iv_from_file(files, threads=2)
+        assert len(ivs) == 6 and ivs[5].mode == 1
+        assert np.allclose(ivs[4].I, ivs[4].V*2)
+        assert ivs[2].date.second == 1
+        assert len(iv_from_file(files[0])) == 2
+        ## the cached column index is shared by the files: read only
+        name = _file2data(files[1])[1]
+        try:
+            name['Bias (V)'] = 1
+            assert False
+        except TypeError:
+            pass
+        ## a value which is not a number is read as NaN, not truncated
+        with open(files[0], 'a') as fid:
+            fid.write('N/A\t8\t9\t10\n0.6\t1\t2\t3\n')
+        ivs = iv_from_file(files[0])
+        assert len(ivs[0].V) == 22 and np.isnan(ivs[0].V[20])
+        assert ivs[1].I[21] == 3
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_fit()
+    test_iv_from_file()
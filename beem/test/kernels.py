@@ -0,0 +1,62 @@
+from beem.experiment import _pure_python
+from beem.experiment.experiment import _pure_c
+import numpy as np
+
+def _synthetic(curves=20, points=300, n_barriers=1):
+    bias = np.linspace(-0.1, -1.5, points)
+    r = np.random.RandomState(0)
+    params = np.empty((curves, 1+2*n_barriers))
+    params[:, 0] = r.normal(1e-10, 1e-11, curves)
+    params[:, 1:n_barriers+1] = r.normal(-0.8, 0.1, (curves, n_barriers))
+    params[:, n_barriers+1:] = r.normal(1e-10, 1e-11, (curves, n_barriers))
+    i_beem = _pure_python.bell_kaiser_v_batch(bias, 2, params)
+    return bias, params, i_beem + r.normal(0, 1e-12, i_beem.shape)
+
+def test_batch():
+    bias, params, i_beem = _synthetic()
+    for n in [1.5, 2, 2.5]:
+        single = np.array([_pure_c.bell_kaiser_v(bias, n, p) for p in params])
+        out = np.empty(single.shape)
+        _pure_c.bell_kaiser_v_batch(bias, n, params, out)
+        assert np.allclose(out, single)
+        assert np.allclose(_pure_python.bell_kaiser_v_batch(bias, n, params),
+                           single)
+        res = _pure_c.residu_bell_kaiser_v_batch(params, bias, i_beem, n)
+        assert np.allclose(res, single - i_beem)
+
+def test_jacobian():
+    bias, params, i_beem = _synthetic(curves=1, n_barriers=2)
+    p = params[0]
+    for n in [1.5, 2, 2.5]:
+        jac = _pure_c.jacobian_bell_kaiser_v(p, bias, i_beem[0], n)
+        assert np.allclose(jac, _pure_python.jacobian_bell_kaiser_v(
+            p, bias, i_beem[0], n))
+        for i in range(len(p)):
+            e = np.zeros(len(p))
+            e[i] = abs(p[i])*1e-5
+            num = (_pure_c.residu_bell_kaiser_v(p+e, bias, i_beem[0], n) -
+                   _pure_c.residu_bell_kaiser_v(p-e, bias, i_beem[0], n))/\
+                   (2*e[i])
+            assert np.abs(jac[i]-num).max() < 1e-5*np.abs(jac[i]).max()
+
+def test_sorted():
+    bias, params, i_beem = _synthetic(curves=5, points=301, n_barriers=2)
+    params[0, 1] = bias[100]
+    r = np.random.RandomState(1)
+    for b in [bias, bias[::-1], r.permutation(bias)]:
+        for n in [0.5, 1, 1.5, 2, 2.5, 3, 2.2]:
+            ref = _pure_c.bell_kaiser_v_reference(b, n, params)
+            assert np.allclose(_pure_c.bell_kaiser_v_batch(b, n, params), ref,
+                               rtol=1e-12, atol=0)
+            assert np.allclose(_pure_c.bell_kaiser_v_batch(
+                np.tile(b, (5, 1)), n, params), ref, rtol=1e-12, atol=0)
+            jac = _pure_c.jacobian_bell_kaiser_v_batch(params, b, ref, n)
+            for p, j in zip(params, jac):
+                ref = _pure_python.jacobian_bell_kaiser_v(p, b, None, n)
+                assert np.all(np.abs(j-ref) <=
+                              1e-12*np.abs(ref).max(1)[:, None])
+
+if __name__ == "__main__":
+    test_batch()
+    test_jacobian()
+    test_sorted()
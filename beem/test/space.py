@@ -0,0 +1,102 @@
+from beem.experiment import Grid, BEESFit, MODE
+from beem.experiment.grid_store import GridStore
+from beem.experiment.bees_data import BEESID
+from beem.experiment.bees_fit import BEESFitID
+from beem.io.space import save_space, load_space
+from beem.test.benchmark import synthetic
+import numpy as np
+import tempfile
+import pickle
+import os
+
+def _grid():
+    bias, _, i_beem = synthetic(24, 150, barrier_height=-0.9)
+    shape = (12, 2, len(bias))
+    store = GridStore(np.broadcast_to(bias, shape), i_beem.reshape(shape),
+                      np.zeros(shape), np.zeros(shape),
+                      np.tile([MODE['fwd'], MODE['bwd']], 12),
+                      pos_x=np.repeat(np.arange(12) % 4, 2),
+                      pos_y=np.repeat(np.arange(12)//4, 2))
+    g = Grid()
+    g.store = store
+    g.bees = store.views()
+    g.normal_fit()
+    g.update_dict()
+    g.fit(backend='batch')
+    return g
+
+def test_space():
+    g = _grid()
+    path = os.path.join(tempfile.mkdtemp(), 'grid')
+    save_space(path, g)
+    for kwarg in [{}, {'mmap_mode':'r'}]:
+        h = load_space(path, **kwarg)
+        assert len(h.bees) == len(g.bees)
+        for a, b in zip(g.beesfit, h.beesfit):
+            assert a.id == b.id
+            assert np.allclose(a.barrier_height, b.barrier_height)
+            assert np.allclose(a.barrier_height_err, b.barrier_height_err)
+            assert a.bias_min == b.bias_min and a.bias_max == b.bias_max
+    h = load_space(path, mode=MODE['bwd'])
+    assert len(h.bees) == 12
+    assert all(b.mode == MODE['bwd'] for b in h.beesfit)
+
+def test_ids():
+    a = BEESID(1, 2, 1, 1, MODE['fwd'])
+    b = a.switch_mode()
+    assert a.mode == MODE['fwd'] and b.mode == MODE['bwd'] and a < b
+    try:
+        a.mode = MODE['bwd']
+        assert False
+    except AttributeError:
+        pass
+    f = BEESFitID([b, a], 2)
+    assert f == BEESFitID([a, b], 2.0) and hash(f) == hash(BEESFitID([a, b], 2))
+    assert pickle.loads(pickle.dumps(f)) == f
+    ## state of the mutable ids of old versions
+    old = BEESFitID.__new__(BEESFitID)
+    old.__setstate__({'bees':[a], 'n':2})
+    assert old == BEESFitID([a], 2)
+
+    g = _grid()
+    for b in g.beesfit:
+        r = b.get_reverse_mode()
+        assert r.id == b.id.switch_mode() and r.get_reverse_mode() is b
+        assert b.get_same_pos(1, r.data[0].mode) is r
+        assert b.get_next_sweep() is None
+        assert g.index[b.id.bees[0].key] == g.beesfit.index(b)
+    k = g.beesfit[5].id.bees[0]
+    assert g.find(BEESFitID([k], 2)) is g.beesfit[5]
+    assert g.find(BEESFitID([k], 2.5)) is None
+    ## beesfit changed without update_dict
+    last = g.beesfit[-1].id.bees[0].key
+    g.beesfit.reverse()
+    assert g.beesfit[0].get_reverse_mode() is g.beesfit[1]
+    g.beesfit = g.beesfit[12:]
+    assert g.at(last) is None and g.at(k.key) is not None
+    assert g.beesfit[0].get_reverse_mode() is g.beesfit[1]
+
+def test_old_pickle():
+    g = _grid()
+    state = g.__getstate__()
+    ## state of a Grid pickled before these attributes existed
+    for x in ['store', 'channels', 'quality', 'fit_stats', '_index',
+              '_fit_pool']:
+        state.pop(x)
+    h = Grid.__new__(Grid)
+    h.__setstate__(state)
+    assert h.store is None and not h.columnar
+    h.update_dict()
+    assert h.beesfit[0].get_reverse_mode() is h.beesfit[1]
+    h.fit(backend='batch')
+    path = os.path.join(tempfile.mkdtemp(), 'grid')
+    save_space(path, h)
+    assert len(load_space(path).beesfit) == len(g.beesfit)
+    h = pickle.loads(pickle.dumps(h))
+    h.fit(threads=2, beesfit=h.beesfit[:4])
+    h.close_pool()
+
+if __name__ == "__main__":
+    test_space()
+    test_ids()
+    test_old_pickle()
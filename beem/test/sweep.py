@@ -0,0 +1,32 @@
+from beem.experiment import BEESData, BEESFit
+from beem.experiment.batch_fit import fit_beesfit
+from beem.experiment.sweep import settings, sweep_fit
+from beem.test.benchmark import synthetic
+import numpy as np
+
+def test_settings():
+    s, neighbour = settings([1.5, 2], [0.3, 0.4, 0.5], [1])
+    assert len(s) == 6 and s[4] == (2, 0.4, 1)
+    assert neighbour == [-1, 0, 1, 0, 3, 4]
+
+def test_sweep():
+    bias, params, i_beem = synthetic(30, 200, noise=2e-13, n=2.5,
+                                     barrier_height=-0.9)
+    bh = params[:, 1]
+    fits = [BEESFit(BEESData(bias=bias, i_beem=y)) for y in i_beem]
+    res = sweep_fit(fits, [1.5, 2, 2.5], [0.4, 0.5], chunk=16)
+    assert res['shape'] == (3, 2, 1) and res['params'].shape == (6, 30, 3)
+    assert fits[0].barrier_height[0] is None
+    ## the exponent of the data fits best
+    chi2 = np.nanmedian(res['chi2'].reshape(3, 2, 30), 2)
+    assert np.all(np.argmin(chi2, 0) == 2)
+    for b in fits:
+        b.n = 2.5
+    fit_beesfit(fits)
+    found = np.array([b.barrier_height[0] for b in fits])
+    assert np.all(np.abs(res['params'][4, :, 1]-found) < 0.01)
+    assert np.all(np.abs(res['params'][4, :, 1]-bh) < 0.05)
+
+if __name__ == "__main__":
+    test_settings()
+    test_sweep()
@@ -0,0 +1,39 @@
+from beem.experiment import BEESData, BEESFit
+from beem.experiment.batch_fit import fit_beesfit
+from beem.experiment.uncertainty import bootstrap
+from beem.test.benchmark import synthetic
+import numpy as np
+
+def _fits(num=20):
+    bias, params, i_beem = synthetic(num, 200, barrier_height=-0.9)
+    fits = [BEESFit(BEESData(bias=bias, i_beem=y)) for y in i_beem]
+    fit_beesfit(fits)
+    return fits, params[:, 1]
+
+def test_bootstrap():
+    fits, bh = _fits()
+    cov = np.array([b.barrier_height_err[0] for b in fits])
+    res = bootstrap(fits, replicates=400, step=50, chunk=8)
+    err = np.array([b.barrier_height_err_boot[0] for b in fits])
+    assert np.allclose(err, res['std'][:, 1])
+    assert np.array_equal([b.barrier_height_err[0] for b in fits], cov)
+    ## same order of magnitude as the covariance, intervals around the truth
+    assert np.all((err > cov/3) & (err < 3*cov))
+    ci = res['ci'][:, 1]
+    assert np.mean((ci[:, 0] < bh) & (bh < ci[:, 1])) > 0.8
+    assert np.all((res['replicates'] >= 100) & (res['replicates'] <= 400))
+
+    ## deterministic, whatever the chunks and the workers
+    again = bootstrap(fits, replicates=400, step=50, chunk=3, threads=2)
+    assert np.array_equal(again['std'], res['std'])
+    assert np.array_equal([b.barrier_height_err[0] for b in fits], cov)
+    mc = bootstrap(fits, 'montecarlo', replicates=200, step=50)
+    assert np.all(np.abs(mc['std'][:, 1]/res['std'][:, 1]-1) < 0.5)
+
+    ## the resampled errors belong to the previous fit
+    fit_beesfit(fits[:1])
+    assert fits[0].barrier_height_err_boot is None
+    assert fits[0].barrier_height_ci is None
+
+if __name__ == "__main__":
+    test_bootstrap()
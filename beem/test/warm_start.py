@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+from beem.io import grid_from_3ds
+from beem.experiment import instrument
+from beem.test.benchmark import write_3ds, synthetic
+import numpy as np
+
+def _fit(path, backend, warm_start):
+    """Barrier heights, their errors and the counters of a fit of the grid"""
+    g = grid_from_3ds(path)
+    g.normal_fit()
+    g.update_dict()
+    with instrument.collect() as stats:
+        g.fit(backend=backend, warm_start=warm_start)
+    c = stats.summary()['grid_fit']
+    err = np.array([b.barrier_height_err[0] for b in g.beesfit], dtype=float)
+    return g.params()[:, 1], err, dict((k, c[k]['total']) for k in
+                                       ['nfev', 'auto_range_iterations']
+                                       if k in c)
+
+def test_warm_start():
+    folder = tempfile.mkdtemp()
+    instrument.enable()
+    try:
+        ## barrier heights of the neighbours not correlated
+        path = os.path.join(folder, 'noise.3ds')
+        write_3ds(path, 8, 8, points=200)
+        bh, err, cold = _fit(path, 'batch', False)
+        for backend in ['batch', None]:
+            found, e, warm = _fit(path, backend, True)
+            assert not np.any(np.isnan(found))
+            ## within the errors of the batched fit (MINPACK ones are smaller)
+            assert np.all(np.abs(found-bh) < 2*np.maximum(err, e))
+            if backend == 'batch':
+                assert warm['nfev'] <= cold['nfev']
+
+        ## smooth barrier heights far from the default initial value
+        y, x = np.divmod(np.arange(64), 8)
+        smooth = np.repeat(-1.3+0.3*(x+y)/14, 2)
+        path = os.path.join(folder, 'smooth.3ds')
+        write_3ds(path, 8, 8, points=200, barrier_height=smooth)
+        truth = synthetic(128, 200, barrier_height=smooth)[1][:, 1]
+        for backend in ['batch', None]:
+            bh, err, cold = _fit(path, backend, False)
+            found, e, warm = _fit(path, backend, True)
+            assert not np.any(np.isnan(found))
+            for k in cold:
+                assert warm[k] <= cold[k]
+            assert np.abs(found-truth).max() <= np.abs(bh-truth).max()
+            if backend == 'batch':
+                assert np.all(np.abs(found-truth) < 8*e)
+    finally:
+        instrument.enable(False)
+        shutil.rmtree(folder, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_warm_start()
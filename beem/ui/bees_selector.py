@@ -1,8 +1,27 @@
-from .ui import QtGui
+from .ui import QtGui, QtCore, signal
 import pyqtgraph as pg
 import numpy as np
 
+class _FitThread(QtCore.QThread):
+    """Fit a BEESFit out of the GUI thread"""
+
+    fitted = signal(object, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.job = None
+
+    def run(self):
+        beesfit, kwarg = self.job
+        self.fitted.emit(beesfit, beesfit.fit(auto=False, **kwarg))
+
+
 class BEESFitGraph(pg.PlotWidget):
+    """Plot of a BEESFit with a region to select the fit window. The region
+    events are coalesced (only the last position is fitted once the region
+    stop moving for `delay` ms) and the fit runs in a background thread."""
+
+    delay = 30
 
     def __init__(self,parent=None):
         super().__init__(parent)
@@ -11,13 +30,21 @@ class BEESFitGraph(pg.PlotWidget):
         plot.setLabel('left', 'BEEM Current','A')
         plot.setLabel('bottom', 'Bias','V')
         self.region = pg.LinearRegionItem([0, 1])
-        self.region.sigRegionChanged.connect(self.fit)
+        self.region.sigRegionChanged.connect(self._region_changed)
         plot.sigRangeChanged.connect(self._update_pos)
         plot.addItem(self.region)
         plot.addItem(self.label)
         self.cara = plot.plot([np.nan], [np.nan])
         self.fitted = plot.plot([np.nan], [np.nan], pen='r')
         self.beesfit = None
+        self._sorted_bias = None
+        self._bounds = None
+        self._pending = False
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.fit)
+        self._thread = _FitThread(self)
+        self._thread.fitted.connect(self._fitted)
 
     def _update_pos(self):
         plot = self.getPlotItem()
@@ -30,27 +57,53 @@ class BEESFitGraph(pg.PlotWidget):
         self.cara.setData(self.beesfit.bias, self.beesfit.i_beem)
 
     def _update_fitted(self):
-        if self.beesfit.i_beem_estimated==None:
+        estimated = self.beesfit.i_beem_estimated
+        if estimated is None:
             self.fitted.setData([np.nan], [np.nan])
         else:
-            self.fitted.setData(self.beesfit.bias_fitted,
-                self.beesfit.i_beem_estimated)
+            self.fitted.setData(self.beesfit.bias_fitted, estimated)
+
+    def _region_changed(self):
+        self._timer.start(self.delay)
 
     def fit(self):
+        """Fit the BEESFit on the region (latest region only if a fit is
+        already running)"""
+        if self._thread.isRunning():
+            self._pending = True
+            return
         vmin, vmax = self.region.getRegion()
         b=self.beesfit
         b.bias_max = vmax
         b.bias_min = vmin
+
+        ## same points in the window: same result
+        bounds = (np.searchsorted(self._sorted_bias, vmin, 'left'),
+                  np.searchsorted(self._sorted_bias, vmax, 'right'))
+        if bounds == self._bounds:
+            return
+        self._bounds = bounds
+
         if b.r_squared>0.1:
-            b.fit_update(auto=False,barrier_height=b.barrier_height,
-                    trans_a=b.trans_a, noise=b.noise)
+            kwarg = {'barrier_height':b.barrier_height, 'trans_a':b.trans_a,
+                     'noise':b.noise}
         else:
-            b.fit_update(auto=False)
-        self._update_fitted()
-
+            kwarg = {}
+        self._thread.job = (b, kwarg)
+        self._thread.start()
+
+    def _fitted(self, beesfit, res):
+        beesfit.update(res)
+        if beesfit is self.beesfit:
+            self._update_fitted()
+        if self._pending:
+            self._pending = False
+            self.fit()
 
     def set_bees(self, beesfit):
         self.beesfit = beesfit
+        self._sorted_bias = np.sort(beesfit.bias)
+        self._bounds = None
         self.region.setRegion([beesfit.bias_min, beesfit.bias_max])
         self._update_beem()
         self._update_fitted()
@@ -43,13 +43,18 @@ def grid2dplot(grid,attribute='barrier_height', num=0, pass_num=1, sweep=1,
                mode=MODE['fwd'],cmap='Blues',bad='k',under='g',over='r',
                threshold=0.6, **kwd):
     val=np.ones((grid.num_x,grid.num_y))*np.nan
-    for b in grid.beesfit:
-        if b.pass_number == pass_num and b.number == sweep and \
-                b.mode == mode and b.r_squared>=threshold:
-            tmp=b.__getattribute__(attribute)
-            if num!=-1:
-                tmp=tmp[num]
-            val[b.x_index,b.y_index]=tmp
+    fit=grid.beesfit
+    index=np.array([[b.pass_number,b.number,b.mode,b.x_index,b.y_index]
+                    for b in fit]).reshape(-1,5)
+    r=grid.fit_quality()['r_squared']
+    with np.errstate(invalid='ignore'):
+        keep=np.flatnonzero((index[:,0]==pass_num)&(index[:,1]==sweep)&
+                            (index[:,2]==mode)&(r>=threshold))
+    for i in keep:
+        tmp=fit[i].__getattribute__(attribute)
+        if num!=-1:
+            tmp=tmp[num]
+        val[index[i,3],index[i,4]]=tmp
     if attribute=='barrier_height':
         with np.errstate(invalid='ignore'):
             val=np.abs(val)
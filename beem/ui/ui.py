@@ -42,15 +42,17 @@ def open3ds(filename = None, folder = None):
             a = grid_from_3ds(f)
     return a
 
-def fast_analysis(filename = None):
-    """Do the default analysis on 3ds files
+def fast_analysis(filename = None, threads = 1, backend = None):
+    """Do the default analysis on 3ds files: one by one MINPACK fits unless
+    threads or backend are given (see Grid.fit, e.g. threads = -1 and
+    backend = 'threads' for the batched fit in all the cores)
     """
     grid=open3ds(filename)
     if grid==None:
         return None
     grid.normal_fit()
     grid.update_dict()
-    grid.fit()
+    grid.fit(threads = threads, backend = backend)
     contourplot(grid.extract_good())
     return grid
 
@@ -51,7 +51,7 @@ setup(name = 'pyBEEM',
           'License :: OSI Approved :: GNU General Public License v3 (GPLv3)',
           'Operating System :: Microsoft :: Windows',
           'Operating System :: POSIX',
-          'Programming Language :: Python :: 3.3',
+          'Programming Language :: Python :: 3.8',
           'Programming Language :: C',
           'Topic :: Scientific/Engineering :: Physics',
           ],